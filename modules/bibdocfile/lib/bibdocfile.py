@@ -669,7 +669,7 @@ class BibRecDocs(object):
     @ivar bibdocs: the list of documents attached to the record.
     @type bibdocs: list of BibDoc
     """
-    def __init__(self, recid, deleted_too=False, human_readable=False):
+    def __init__(self, recid, deleted_too=False, human_readable=False, initial_data=None):
         try:
             self.id = int(recid)
         except ValueError:
@@ -678,7 +678,44 @@ class BibRecDocs(object):
         self.deleted_too = deleted_too
         self.bibdocs = {}
         self.attachment_types = {} # dictionary docname->attachment type
-        self.build_bibdoc_list()
+        self.build_bibdoc_list(initial_data)
+
+    @staticmethod
+    def load_many(recids, deleted_too=False, human_readable=False):
+        """
+        Instantiate the C{BibRecDocs} of many records at once, retrieving
+        the data of all their documents with a few queries (instead of
+        several queries per document).
+
+        @param recids: the record identifiers.
+        @type recids: list of integers
+        @param deleted_too: see L{BibRecDocs}.
+        @type deleted_too: bool
+        @param human_readable: see L{BibRecDocs}.
+        @type human_readable: bool
+        @return: the dictionary of recid -> BibRecDocs.
+        @rtype: dict
+        """
+        recids = [int(recid) for recid in recids]
+        if not recids:
+            return {}
+        query = """SELECT brbd.id_bibrec, brbd.id_bibdoc, brbd.docname, brbd.type
+                   FROM bibrec_bibdoc as brbd JOIN bibdoc as bd ON bd.id=brbd.id_bibdoc
+                   WHERE brbd.id_bibrec IN (%s)""" % ','.join([str(recid) for recid in recids])
+        if not deleted_too:
+            query += " AND bd.status<>'DELETED'"
+        attachments = {}
+        for recid, docid, docname, doctype in run_sql(query + " ORDER BY brbd.docname ASC"):
+            attachments.setdefault(recid, []).append((docid, docname, doctype))
+        docs_data = BibDoc._retrieve_data_many([row[0] for rows in attachments.values() for row in rows])
+        ret = {}
+        for recid in recids:
+            ret[recid] = BibRecDocs(recid, deleted_too=deleted_too,
+                                    human_readable=human_readable,
+                                    initial_data=[(docid, docname, doctype, docs_data[docid])
+                                                  for docid, docname, doctype in attachments.get(recid, [])
+                                                  if docid in docs_data])
+        return ret
 
     def __repr__(self):
         """
@@ -780,12 +817,24 @@ class BibRecDocs(object):
             size += bibdoc.get_total_size()
         return size
 
-    def build_bibdoc_list(self):
+    def build_bibdoc_list(self, initial_data=None):
         """
         This method must be called everytime a I{bibdoc} is added, removed or
         modified.
+
+        @param initial_data: the list of (docid, docname, attachment type,
+            document data) of the documents of the record, as retrieved
+            by L{BibRecDocs.load_many}.
+        @type initial_data: list
         """
         self.bibdocs = {}
+        if initial_data is not None:
+            for docid, docname, doctype, doc_data in initial_data:
+                cur_doc = BibDoc.create_instance(docid=docid, recid=self.id,
+                                                 human_readable=self.human_readable,
+                                                 initial_data=doc_data)
+                self.bibdocs[docname] = (cur_doc, doctype)
+            return
         if self.deleted_too:
             res = run_sql("""SELECT brbd.id_bibdoc, brbd.docname, brbd.type FROM bibrec_bibdoc as brbd JOIN
                          bibdoc as bd ON bd.id=brbd.id_bibdoc WHERE brbd.id_bibrec=%s
@@ -1586,16 +1635,19 @@ class BibDoc(object):
         specifying recid, docname and doctype without specifying docid results in
         attaching newly created document to a record
         """
+        if initial_data is None:
+            initial_data = BibDoc._retrieve_data(docid)
+
         # docid is known, the document already exists
-        res2 = run_sql("SELECT id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc=%s", (docid,))
+        if "bibrec_types" in initial_data:
+            res2 = initial_data["bibrec_types"]
+        else:
+            res2 = run_sql("SELECT id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc=%s", (docid,))
         self.bibrec_types = [(r[0], r[1], r[2]) for r in res2 ] # just in case the result was behaving like tuples but was something else
         if not res2:
             # fake attachment
             self.bibrec_types = [(0, None, "fake_name_for_unattached_document")]
 
-        if initial_data is None:
-            initial_data = BibDoc._retrieve_data(docid)
-
         self.docfiles = []
         self.__md5s = None
         self.human_readable = human_readable
@@ -1610,11 +1662,17 @@ class BibDoc(object):
         self.doctype = initial_data["doctype"]
         self.storagename = initial_data["storagename"] # the old docname -> now used as a storage name for old records
 
-        self.more_info = BibDocMoreInfo(self.id)
-        self._build_file_list('init')
+        if "fsinfo" in initial_data:
+            # everything was retrieved together with the other documents
+            self.more_info = BibDocMoreInfo(self.id, database_data=initial_data["more_info"])
+            self.docfiles = []
+            self._build_file_list_from_fsinfo(initial_data["fsinfo"])
+        else:
+            self.more_info = BibDocMoreInfo(self.id)
+            self._build_file_list('init')
 
         # link with related_files
-        self._build_related_file_list()
+        self._build_related_file_list(initial_data.get("related_files"))
 
     @staticmethod
     def prepare_basedir(doc_id):
@@ -1675,9 +1733,94 @@ class BibDoc(object):
         container["extensions"] = [fname[len(fprefix):] for fname in filter(lambda x: x.startswith(fprefix),os.listdir(container["basedir"]))]
         return container
 
+    @staticmethod
+    def _retrieve_data_many(docids):
+        """
+        Retrieve the data of many documents (as L{_retrieve_data} does)
+        together with their attachments, their more info, their files
+        and their related documents, with a few queries for all of them.
+        The file list is read from the bibdocfsinfo table, when it is
+        enabled as reference for filesystem information.
+
+        @return: the dictionary of docid -> initial data for L{BibDoc}
+        @rtype: dict
+        """
+        data = {}
+        docids = set([int(docid) for docid in docids])
+        retrieved = set()
+        while docids:
+            retrieved.update(docids)
+            sqldocids = ','.join([str(docid) for docid in docids])
+            for docid, status, cd, md, td, doctype, storagename in run_sql(
+                    "SELECT id, status, creation_date, modification_date, text_extraction_date, "
+                    "doctype, docname FROM bibdoc WHERE id IN (%s)" % sqldocids):
+                data[docid] = {"id": docid,
+                               "basedir": _make_base_dir(docid),
+                               "status": status,
+                               "cd": cd,
+                               "md": md,
+                               "td": td,
+                               "doctype": doctype,
+                               "storagename": storagename,
+                               "bibrec_links": [],
+                               "bibrec_types": [],
+                               "related_files": []}
+            for recid, docid, doctype, docname in run_sql(
+                    "SELECT id_bibrec, id_bibdoc, type, docname FROM bibrec_bibdoc "
+                    "WHERE id_bibdoc IN (%s)" % sqldocids):
+                if docid in data:
+                    data[docid]["bibrec_types"].append((recid, doctype, docname))
+            for docid in docids:
+                if docid in data and data[docid]["bibrec_types"]:
+                    recid, doctype, docname = data[docid]["bibrec_types"][0]
+                    data[docid]["bibrec_links"].append({"recid": recid, "doctype": doctype, "docname": docname})
+            if CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE:
+                for docid in docids:
+                    if docid in data:
+                        data[docid]["more_info"] = {}
+                        data[docid]["fsinfo"] = []
+                for docid, namespace, data_key, data_value in run_sql(
+                        "SELECT id_bibdoc, namespace, data_key, data_value FROM bibdocmoreinfo "
+                        "WHERE id_bibdoc IN (%s) AND version IS NULL AND format IS NULL "
+                        "AND id_rel IS NULL" % sqldocids):
+                    if docid in data:
+                        data[docid]["more_info"].setdefault(namespace, {})[data_key] = cPickle.loads(data_value)
+                for docid, version, docformat, cd, md, checksum, size in run_sql(
+                        "SELECT id_bibdoc, version, format, cd, md, checksum, filesize FROM bibdocfsinfo "
+                        "WHERE id_bibdoc IN (%s)" % sqldocids):
+                    if docid in data:
+                        data[docid]["fsinfo"].append((version, docformat, cd, md, checksum, size))
+            for docid in docids:
+                if docid in data:
+                    if "fsinfo" in data[docid]:
+                        data[docid]["extensions"] = ["%s;%s" % (docformat, version)
+                                                     for version, docformat, dummy, dummy, dummy, dummy
+                                                     in data[docid]["fsinfo"]]
+                    else:
+                        fprefix = data[docid]["storagename"] or "content"
+                        data[docid]["extensions"] = [fname[len(fprefix):] for fname in
+                                                     os.listdir(data[docid]["basedir"])
+                                                     if fname.startswith(fprefix)]
+            # the related documents are retrieved in the next round
+            related_docids = set()
+            for docid1, docid2, rel_type, status in run_sql(
+                    "SELECT ln.id_bibdoc1, ln.id_bibdoc2, ln.rel_type, bibdoc.status "
+                    "FROM bibdoc_bibdoc AS ln, bibdoc WHERE bibdoc.id=ln.id_bibdoc2 "
+                    "AND ln.id_bibdoc1 IN (%s)" % sqldocids):
+                if docid1 in data:
+                    data[docid1]["related_files"].append((docid2, rel_type, status))
+                    if docid2 not in retrieved:
+                        related_docids.add(docid2)
+            docids = related_docids
+        for docid in data:
+            data[docid]["related_files"] = [(docid2, rel_type, status, data.get(docid2))
+                                            for docid2, rel_type, status in data[docid]["related_files"]]
+        return data
+
     @staticmethod
     def create_instance(docid=None, recid=None, docname=None,
-                        doctype='Fulltext', a_type = 'Main', human_readable=False):
+                        doctype='Fulltext', a_type = 'Main', human_readable=False,
+                        initial_data=None):
         """
         Parameters of an attachement to the record:
         a_type, recid, docname
@@ -1686,13 +1829,17 @@ class BibDoc(object):
 
         @param doctype Type of the document itself (by default Fulltext)
         @type doctype String
+
+        @param initial_data The data of the existing document C{docid},
+                            if it was already retrieved
+        @type initial_data dict
         """
 
         # first try to retrieve existing record based on obtained data
         data = None
         extensions = []
         if docid != None:
-            data = BibDoc._retrieve_data(docid)
+            data = initial_data or BibDoc._retrieve_data(docid)
             doctype = data["doctype"]
             extensions = data["extensions"]
 
@@ -2661,12 +2808,7 @@ class BibDoc(object):
         if CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE and context == 'init':
             ## In normal init context we read from DB
             res = run_sql("SELECT version, format, cd, md, checksum, filesize FROM bibdocfsinfo WHERE id_bibdoc=%s", (self.id, ))
-            for version, docformat, cd, md, checksum, size in res:
-                filepath = self.get_filepath(docformat, version)
-                self.docfiles.append(BibDocFile(
-                    filepath, self.bibrec_types,
-                    version, docformat,  self.id, self.status, checksum,
-                    self.more_info, human_readable=self.human_readable, cd=cd, md=md, size=size, bibdoc=self))
+            self._build_file_list_from_fsinfo(res)
         else:
             if os.path.exists(self.basedir):
                 files = os.listdir(self.basedir)
@@ -2702,6 +2844,18 @@ class BibDoc(object):
                     md = '' # No modification time
                 log_action(deletedstr, self.id, docname, docformat, version, size, checksum, md)
 
+    def _build_file_list_from_fsinfo(self, res):
+        """
+        Append to the list of files attached to the bibdoc the files
+        described by the rows C{res} of the bibdocfsinfo table.
+        """
+        for version, docformat, cd, md, checksum, size in res:
+            filepath = self.get_filepath(docformat, version)
+            self.docfiles.append(BibDocFile(
+                filepath, self.bibrec_types,
+                version, docformat,  self.id, self.status, checksum,
+                self.more_info, human_readable=self.human_readable, cd=cd, md=md, size=size, bibdoc=self))
+
     def _sync_to_db(self):
         """
         Update the content of the bibdocfile table by taking what is available on the filesystem.
@@ -2712,22 +2866,26 @@ class BibDoc(object):
             run_sql("INSERT INTO bibdocfsinfo(id_bibdoc, version, format, last_version, cd, md, checksum, filesize, mime) VALUES(%s, %s, %s, false, %s, %s, %s, %s, %s)", (self.id, afile.get_version(), afile.get_format(), afile.cd, afile.md, afile.get_checksum(), afile.get_size(), afile.mime))
             run_sql("UPDATE bibdocfsinfo SET last_version=true WHERE id_bibdoc=%s AND version=%s", (self.id, self.get_latest_version()))
 
-    def _build_related_file_list(self):
+    def _build_related_file_list(self, res=None):
         """Lists all files attached to the bibdoc. This function should be
         called everytime the bibdoc is modified within e.g. its icon.
+        @param res: the (docid, relation type, status, document data) of the
+            related documents, if they were already retrieved.
         @deprecated: use subformats instead.
         """
         self.related_files = {}
-        res = run_sql("SELECT ln.id_bibdoc2,ln.rel_type,bibdoc.status FROM "
-            "bibdoc_bibdoc AS ln,bibdoc WHERE bibdoc.id=ln.id_bibdoc2 AND "
-            "ln.id_bibdoc1=%s", (str(self.id),))
+        if res is None:
+            res = [row + (None, ) for row in run_sql("SELECT ln.id_bibdoc2,ln.rel_type,bibdoc.status FROM "
+                "bibdoc_bibdoc AS ln,bibdoc WHERE bibdoc.id=ln.id_bibdoc2 AND "
+                "ln.id_bibdoc1=%s", (str(self.id),))]
         for row in res:
             docid = row[0]
             doctype = row[1]
             if row[2] != 'DELETED':
                 if not self.related_files.has_key(doctype):
                     self.related_files[doctype] = []
-                cur_doc = BibDoc.create_instance(docid=docid, human_readable=self.human_readable)
+                cur_doc = BibDoc.create_instance(docid=docid, human_readable=self.human_readable,
+                                                 initial_data=row[3])
                 self.related_files[doctype].append(cur_doc)
 
     def get_total_size_latest_version(self):
@@ -3516,17 +3674,26 @@ def calculate_md5_external(filename):
     except Exception, e:
         raise InvenioBibDocFileError("Encountered an exception while calculating md5 for file '%s': '%s'" % (filename, e))
 
-def calculate_md5(filename, force_internal=False):
+def calculate_md5(filename, force_internal=False, max_rate=0):
     """Calculate the md5 of a physical file. This is suitable for files smaller
-    than 256Kb."""
-    if not CFG_PATH_MD5SUM or force_internal or os.path.getsize(filename) < CFG_BIBDOCFILE_MD5_THRESHOLD:
+    than 256Kb. If max_rate is given, the file is read internally at no
+    more than max_rate bytes per second."""
+    if not CFG_PATH_MD5SUM or force_internal or max_rate or os.path.getsize(filename) < CFG_BIBDOCFILE_MD5_THRESHOLD:
         try:
             to_be_read = open(filename, "rb")
             computed_md5 = md5()
+            start = time.time()
+            read_bytes = 0
             while True:
                 buf = to_be_read.read(CFG_BIBDOCFILE_MD5_BUFFER)
                 if buf:
                     computed_md5.update(buf)
+                    if max_rate:
+                        # sleep until we are back below the rate
+                        read_bytes += len(buf)
+                        delay = float(read_bytes) / max_rate - (time.time() - start)
+                        if delay > 0:
+                            time.sleep(delay)
                 else:
                     break
             to_be_read.close()
@@ -3923,7 +4090,8 @@ class MoreInfo(object):
        """
 
     def __init__(self, docid = None, version = None, docformat = None,
-                 relation = None, cache_only = False, cache_reads = True, initial_data = None):
+                 relation = None, cache_only = False, cache_reads = True, initial_data = None,
+                 database_data = None):
         """
         @param cache_only Determines if MoreInfo object should be created in
                           memory only or reflected in the database
@@ -3942,6 +4110,11 @@ class MoreInfo(object):
                              instance from serialised value
         @type initial_data string
 
+        @param database_data The content of the database for this object,
+                             if it was already retrieved (e.g. together
+                             with the one of other objects)
+        @type database_data dictionary
+
         """
         self.docid = docid
         self.version = version
@@ -3962,7 +4135,11 @@ class MoreInfo(object):
         self.cache_reads = cache_reads
 
         if not self.cache_only:
-            self.populate_from_database()
+            if database_data is None:
+                self.populate_from_database()
+            else:
+                for namespace, values in database_data.iteritems():
+                    self.cache.setdefault(namespace, {}).update(values)
 
     @staticmethod
     def create_from_serialised(ser_str, docid = None, version = None, docformat = None,
@@ -4256,10 +4433,11 @@ class BibDocMoreInfo(MoreInfo):
     @note: this class will be extended in the future to hold all the new auxiliary
     information about a document.
     """
-    def __init__(self, docid, cache_only = False, initial_data = None):
+    def __init__(self, docid, cache_only = False, initial_data = None, database_data = None):
         if not (type(docid) in (long, int) and docid > 0):
             raise ValueError("docid is not a positive integer, but %s." % docid)
-        MoreInfo.__init__(self, docid, cache_only = cache_only, initial_data = initial_data)
+        MoreInfo.__init__(self, docid, cache_only = cache_only, initial_data = initial_data,
+                          database_data = database_data)
 
         if 'descriptions' not in self:
             self['descriptions'] = {}
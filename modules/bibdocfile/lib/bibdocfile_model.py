@@ -49,6 +49,25 @@ class Bibdocfsinfo(db.Model):
     master_format = db.Column(db.String(50))
 
 
+class Bibdocfixity(db.Model):
+    """Represents a Bibdocfixity record."""
+    __tablename__ = 'bibdocfixity'
+
+    id_bibdoc = db.Column(db.MediumInteger(9, unsigned=True),
+                    db.ForeignKey(Bibdoc.id), primary_key=True,
+                    nullable=False, autoincrement=False)
+    version = db.Column(db.TinyInteger(4, unsigned=True), primary_key=True,
+                    nullable=False, autoincrement=False)
+    format = db.Column(db.String(50), primary_key=True, nullable=False)
+    filesize = db.Column(db.BigInteger(15, unsigned=True), nullable=False,
+                    server_default='0')
+    md = db.Column(db.DateTime, nullable=True)
+    checksum = db.Column(db.Char(32), nullable=False, server_default='')
+    status = db.Column(db.String(20), nullable=False, server_default='',
+                    index=True)
+    last_checked = db.Column(db.DateTime, nullable=False, index=True)
+
+
 class Bibdocmoreinfo(db.Model):
     """Represents a Bibdocmoreinfo record."""
     __tablename__ = 'bibdocmoreinfo'
@@ -68,4 +87,5 @@ class Bibdocmoreinfo(db.Model):
                       db.Model.__table_args__)
 
 __all__ = ['Bibdocfsinfo',
+           'Bibdocfixity',
            'Bibdocmoreinfo']
@@ -28,6 +28,8 @@ from invenio.testutils import make_test_suite, run_test_suite
 from invenio.bibdocfile import BibRecDocs, BibRelation, MoreInfo, \
     check_bibdoc_authorization, bibdocfile_url_p, guess_format_from_url, CFG_HAS_MAGIC, \
     Md5Folder, calculate_md5, calculate_md5_external
+from invenio.bibdocfilecli import audit_directory_fixity, \
+    get_fixity_results, store_fixity_results
 from invenio.dbquery import run_sql
 
 from invenio.access_control_config import CFG_WEBACCESS_WARNING_MSGS
@@ -210,6 +212,23 @@ class BibRecDocsTest(unittest.TestCase):
         my_bibrecdoc.delete_bibdoc('file')
         my_bibrecdoc.delete_bibdoc('test')
 
+    def test_load_many(self):
+        """bibdocfile - BibRecDocs.load_many same as BibRecDocs"""
+        recids = [2, 8, 10, 1000000]
+        loaded = BibRecDocs.load_many(recids)
+        self.assertEqual(recids, sorted(loaded.keys()))
+        for recid in recids:
+            expected = BibRecDocs(recid)
+            self.assertEqual(sorted(expected.get_bibdoc_names()),
+                             sorted(loaded[recid].get_bibdoc_names()))
+            for docname in expected.get_bibdoc_names():
+                self.assertEqual(
+                    [(docfile.get_full_path(), docfile.get_size(), docfile.get_checksum(), docfile.get_description())
+                     for docfile in expected.get_bibdoc(docname).list_all_files()],
+                    [(docfile.get_full_path(), docfile.get_size(), docfile.get_checksum(), docfile.get_description())
+                     for docfile in loaded[recid].get_bibdoc(docname).list_all_files()])
+        self.assertTrue(loaded[1000000].empty_p())
+
 class BibDocsTest(unittest.TestCase):
     """regression tests about BibDocs"""
 
@@ -597,7 +616,99 @@ class BibDocFileMd5FolderTests(unittest.TestCase):
             open(filepath, "w").write("test")
             self.assertEqual(calculate_md5(filepath, force_internal=True), calculate_md5_external(filepath))
 
+    def test_md5_max_rate(self):
+        """bibdocfile - md5 with a maximum reading rate"""
+        filepath = os.path.join(self.path, 'test.txt')
+        open(filepath, "w").write("test" * 1024)
+        self.assertEqual(calculate_md5(filepath, max_rate=1024 * 1024), calculate_md5(filepath, force_internal=True))
+
+class BibDocFileFixityTests(unittest.TestCase):
+    """Regression test class for the fixity audit of document directories"""
+    def setUp(self):
+        """Create a document directory with an OK, a corrupted, a
+        missing and an unknown file"""
+        self.path = os.path.join(CFG_TMPDIR, 'fixity_tests')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        for afile in ('paper.pdf;1', 'paper.pdf;2', 'paper.ps;1'):
+            open(os.path.join(self.path, afile), "w").write(afile)
+        Md5Folder(self.path)
+        open(os.path.join(self.path, 'paper.pdf;2'), "w").write("corrupted")
+        os.remove(os.path.join(self.path, 'paper.ps;1'))
+        open(os.path.join(self.path, 'paper.txt;1'), "w").write("unknown")
+        self.docid = 16777215
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        run_sql("DELETE FROM bibdocfixity WHERE id_bibdoc=%s", (self.docid, ))
+
+    def _get_statuses(self, results):
+        return dict([((version, docformat), status) for version, docformat, dummy, dummy, dummy, status in results])
+
+    def _get_previous_results(self, results):
+        return dict([((version, docformat), (filesize, md, status)) for version, docformat, filesize, md, dummy, status in results])
+
+    def test_fixity_statuses(self):
+        """bibdocfile - fixity audit statuses"""
+        results, skipped, read_bytes = audit_directory_fixity(self.path, {})
+        self.assertEqual({(1, '.pdf'): 'OK', (2, '.pdf'): 'CORRUPTED',
+                          (1, '.ps'): 'MISSING', (1, '.txt'): 'UNKNOWN'},
+                         self._get_statuses(results))
+        self.assertEqual([], skipped)
+        self.assertEqual(len('paper.pdf;1') + len('corrupted') + len('unknown'), read_bytes)
+
+    def test_fixity_incremental(self):
+        """bibdocfile - fixity audit skips the unchanged valid files"""
+        results = audit_directory_fixity(self.path, {})[0]
+        previous_results = self._get_previous_results(results)
+        results, skipped, read_bytes = audit_directory_fixity(self.path, previous_results)
+        self.assertEqual([(1, '.pdf')], skipped)
+        self.failIf((1, '.pdf') in self._get_statuses(results))
+        self.assertEqual(len('corrupted') + len('unknown'), read_bytes)
+        ## unless forced
+        results, skipped, read_bytes = audit_directory_fixity(self.path, previous_results, force=True)
+        self.assertEqual([], skipped)
+        self.assertEqual('OK', self._get_statuses(results)[(1, '.pdf')])
+        ## or modified
+        open(os.path.join(self.path, 'paper.pdf;1'), "w").write("modified")
+        results, skipped, read_bytes = audit_directory_fixity(self.path, previous_results)
+        self.assertEqual([], skipped)
+        self.assertEqual('CORRUPTED', self._get_statuses(results)[(1, '.pdf')])
+
+    def test_fixity_store_results(self):
+        """bibdocfile - fixity results of vanished files are forgotten"""
+        results, skipped, dummy = audit_directory_fixity(self.path, {})
+        store_fixity_results(self.docid, results, skipped, {})
+        previous_results = get_fixity_results([self.docid])[self.docid]
+        self.assertEqual(self._get_previous_results(results), previous_results)
+        os.remove(os.path.join(self.path, 'paper.txt;1'))
+        results, skipped, dummy = audit_directory_fixity(self.path, previous_results)
+        store_fixity_results(self.docid, results, skipped, previous_results)
+        self.assertEqual([(1, '.pdf'), (1, '.ps'), (2, '.pdf')],
+                         sorted(get_fixity_results([self.docid])[self.docid].keys()))
+
+    def test_fixity_removed_directory(self):
+        """bibdocfile - fixity audit of a removed document directory"""
+        results, skipped, dummy = audit_directory_fixity(self.path, {})
+        store_fixity_results(self.docid, results, skipped, {})
+        previous_results = get_fixity_results([self.docid])[self.docid]
+        shutil.rmtree(self.path)
+        results, skipped, read_bytes = audit_directory_fixity(self.path, previous_results,
+                                                              known_files=[(3, '.pdf')])
+        self.assertEqual({(1, '.pdf'): 'MISSING', (2, '.pdf'): 'MISSING',
+                          (1, '.ps'): 'MISSING', (1, '.txt'): 'MISSING',
+                          (3, '.pdf'): 'MISSING'},
+                         self._get_statuses(results))
+        self.assertEqual([], skipped)
+        self.assertEqual(0, read_bytes)
+        ## the results of the files are kept, not forgotten
+        store_fixity_results(self.docid, results, skipped, previous_results)
+        self.assertEqual([(1, '.pdf'), (1, '.ps'), (1, '.txt'), (2, '.pdf'), (3, '.pdf')],
+                         sorted(get_fixity_results([self.docid])[self.docid].keys()))
+
 TEST_SUITE = make_test_suite(BibDocFileMd5FolderTests,
+                             BibDocFileFixityTests,
                              BibRecDocsTest,
                              BibDocsTest,
                              BibDocFilesTest,
@@ -26,6 +26,7 @@ __revision__ = "$Id$"
 import sys
 import re
 import os
+import errno
 import time
 import fnmatch
 import time
@@ -36,11 +37,12 @@ from tempfile import mkstemp
 
 from invenio.errorlib import register_exception
 from invenio.config import CFG_SITE_URL, CFG_BIBDOCFILE_FILEDIR, \
-    CFG_SITE_RECORD, CFG_TMPSHAREDDIR
+    CFG_SITE_RECORD, CFG_TMPSHAREDDIR, CFG_BIBDOCFILE_FIXITY_MAX_RATE
 from invenio.bibdocfile import BibRecDocs, BibDoc, InvenioBibDocFileError, \
     nice_size, check_valid_url, clean_url, get_docname_from_url, \
     guess_format_from_url, KEEP_OLD_VALUE, decompose_bibdocfile_fullpath, \
-    bibdocfile_url_to_bibdoc, decompose_bibdocfile_url, CFG_BIBDOCFILE_AVAILABLE_FLAGS
+    bibdocfile_url_to_bibdoc, decompose_bibdocfile_url, CFG_BIBDOCFILE_AVAILABLE_FLAGS, \
+    Md5Folder, calculate_md5, decompose_file_with_version, _make_base_dir
 
 from invenio.intbitset import intbitset
 from invenio.search_engine import perform_request_search
@@ -50,6 +52,9 @@ from invenio.bibtask import task_low_level_submission
 from invenio.textutils import encode_for_xml
 from invenio.websubmit_file_converter import can_perform_ocr
 
+## number of docids whose files are audited between two progress reports:
+CFG_BIBDOCFILE_FIXITY_CHUNK_SIZE = 100
+
 def _xml_mksubfield(key, subfield, fft):
     return fft.get(key, None) is not None and '\t\t<subfield code="%s">%s</subfield>\n' % (subfield, encode_for_xml(str(fft[key]))) or ''
 
@@ -558,6 +563,9 @@ Examples:
     housekeeping_options.add_option("--check-format", action='store_const', const='check-format', dest='action', help='check if any format-related inconsistences exists')
     housekeeping_options.add_option("--check-duplicate-docnames", action='store_const', const='check-duplicate-docnames', dest='action', help='check for duplicate docnames associated with the same record')
     housekeeping_options.add_option("--update-md5", action='store_const', const='update-md5', dest='action', help='update md5 checksum of files')
+    housekeeping_options.add_option("--audit-fixity", action='store_const', const='audit-fixity', dest='action', help='check md5 checksum validity of files modified since they were last found valid (all files with --force) and store the results in the bibdocfixity table')
+    housekeeping_options.add_option("--with-workers", dest='workers', type='int', default=1, help='when auditing fixity, the number of files to check in parallel (default: 1)', metavar='N')
+    housekeeping_options.add_option("--with-max-rate", dest='max_rate', type='float', default=None, help='when auditing fixity, the maximum number of megabytes per second to read (default: %s, 0 for no limit)' % CFG_BIBDOCFILE_FIXITY_MAX_RATE, metavar='MB/s')
     housekeeping_options.add_option("--fix-all", action='store_const', const='fix-all', dest='action', help='fix inconsistences in filesystem vs database vs MARC')
     housekeeping_options.add_option("--fix-marc", action='store_const', const='fix-marc', dest='action', help='synchronize MARC after filesystem/database')
     housekeeping_options.add_option("--fix-format", action='store_const', const='fix-format', dest='action', help='fix format related inconsistences')
@@ -1106,6 +1114,196 @@ def cli_update_md5(options):
             bibdoc.md5s.update(only_new=False)
             bibdoc._sync_to_db()
 
+def get_fixity_results(docids):
+    """Return the dictionary docid -> {(version, format): (filesize, md,
+    status)} of the files of docids stored by the last fixity audits."""
+    out = {}
+    if docids:
+        for docid, version, docformat, filesize, md, status in run_sql(
+                "SELECT id_bibdoc, version, format, filesize, md, status "
+                "FROM bibdocfixity WHERE id_bibdoc IN (%s)" % ','.join([str(docid) for docid in docids])):
+            out.setdefault(docid, {})[(version, docformat)] = (filesize, md, status)
+    return out
+
+def audit_docid_fixity(docid, previous_results, force=False, max_rate=0):
+    """
+    Check the files of a docid against its .md5 file, see
+    audit_directory_fixity().
+    """
+    known_files = run_sql("SELECT version, format FROM bibdocfsinfo WHERE id_bibdoc=%s",
+                          (docid, ))
+    return audit_directory_fixity(_make_base_dir(docid), previous_results,
+                                  force, max_rate, known_files)
+
+def audit_directory_fixity(basedir, previous_results, force=False, max_rate=0,
+                           known_files=()):
+    """
+    Check the files of the document directory basedir against its .md5
+    file, reading at most max_rate bytes per second (0 for no limit).
+    The files whose size and modification time did not change since
+    previous_results (as returned by get_fixity_results()) found them
+    valid are skipped, unless force.  Files that cannot be accessed are
+    reported UNREADABLE, or MISSING if they disappeared.  When basedir
+    itself cannot be listed, the files known from previous_results,
+    from the .md5 file and from known_files (list of (version, format))
+    are all reported MISSING if basedir disappeared, or UNREADABLE.
+
+    @return: the tuple (list of (version, format, filesize, md, checksum,
+        status) of the checked files, list of (version, format) of the
+        skipped files, number of bytes read)
+    """
+    results = []
+    skipped = []
+    read_bytes = 0
+    md5s = {}
+    try:
+        if os.path.exists(os.path.join(basedir, '.md5')):
+            md5s = Md5Folder(basedir).md5s
+    except (IOError, OSError):
+        ## no checksum to compare with: the files will be UNKNOWN
+        pass
+    try:
+        afiles = sorted(os.listdir(basedir))
+    except OSError, err:
+        ## the files known from the previous audits, from the .md5
+        ## file or from the database cannot be checked
+        if err.errno == errno.ENOENT:
+            status = 'MISSING'
+        else:
+            status = 'UNREADABLE'
+        known = set(previous_results)
+        known.update([(version, docformat) for version, docformat in known_files])
+        for afile in md5s:
+            try:
+                dummy, dummy, docformat, version = decompose_file_with_version(afile)
+            except ValueError:
+                continue
+            known.add((version, docformat))
+        for version, docformat in sorted(known):
+            results.append((version, docformat, 0, None, '', status))
+        return results, skipped, read_bytes
+    for afile in afiles:
+        if afile.startswith('.'):
+            continue
+        try:
+            dummy, dummy, docformat, version = decompose_file_with_version(afile)
+        except ValueError:
+            continue
+        path = os.path.join(basedir, afile)
+        try:
+            stat = os.stat(path)
+        except OSError, err:
+            if err.errno == errno.ENOENT:
+                ## removed since the directory was listed
+                if afile in md5s:
+                    results.append((version, docformat, 0, None, '', 'MISSING'))
+            else:
+                results.append((version, docformat, 0, None, '', 'UNREADABLE'))
+            continue
+        md = datetime.fromtimestamp(stat.st_mtime).replace(microsecond=0)
+        if not force and previous_results.get((version, docformat)) == (stat.st_size, md, 'OK'):
+            skipped.append((version, docformat))
+            continue
+        try:
+            checksum = calculate_md5(path, force_internal=True, max_rate=max_rate)
+        except InvenioBibDocFileError:
+            results.append((version, docformat, stat.st_size, md, '', 'UNREADABLE'))
+            continue
+        read_bytes += stat.st_size
+        if afile not in md5s:
+            status = 'UNKNOWN'
+        elif md5s[afile] == checksum:
+            status = 'OK'
+        else:
+            status = 'CORRUPTED'
+        results.append((version, docformat, stat.st_size, md, checksum, status))
+    for afile in md5s:
+        if afile not in afiles:
+            try:
+                dummy, dummy, docformat, version = decompose_file_with_version(afile)
+            except ValueError:
+                continue
+            results.append((version, docformat, 0, None, '', 'MISSING'))
+    return results, skipped, read_bytes
+
+def _audit_docid_fixity_in_worker(args):
+    """Run audit_docid_fixity() in a worker process."""
+    return args[0], audit_docid_fixity(*args)
+
+def store_fixity_results(docid, results, skipped, previous_results):
+    """Store the results of audit_docid_fixity() for docid into
+    bibdocfixity, forgetting the files which disappeared."""
+    if results:
+        params = []
+        for version, docformat, filesize, md, checksum, status in results:
+            params.extend((docid, version, docformat, filesize, md, checksum, status))
+        run_sql("REPLACE INTO bibdocfixity (id_bibdoc, version, format, filesize, md, "
+                "checksum, status, last_checked) VALUES %s" % \
+                ', '.join(['(%s, %s, %s, %s, %s, %s, %s, NOW())'] * len(results)), params)
+    audited = set(skipped)
+    audited.update([(version, docformat) for version, docformat, dummy, dummy, dummy, dummy in results])
+    for version, docformat in previous_results:
+        if (version, docformat) not in audited:
+            run_sql("DELETE FROM bibdocfixity WHERE id_bibdoc=%s AND version=%s AND format=%s",
+                    (docid, version, docformat))
+
+def cli_audit_fixity(options):
+    """Check the md5 sums of a docid_set in parallel, skipping the files
+    unchanged since they were last found valid, and store the results."""
+    workers = max(getattr(options, 'workers', 1) or 1, 1)
+    max_rate = getattr(options, 'max_rate', None)
+    if max_rate is None:
+        max_rate = CFG_BIBDOCFILE_FIXITY_MAX_RATE
+    # every worker gets its share of the rate (0 means no limit, so
+    # never round a limit down to 0):
+    if max_rate > 0:
+        max_rate = max(int(max_rate * 1024 * 1024 / workers), 1)
+    else:
+        max_rate = 0
+    force = getattr(options, 'force', False)
+    docids = list(cli_docids_iterator(options))
+    pool = None
+    if workers > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes=workers)
+    start = time.time()
+    checked = skipped = failures = read_bytes = 0
+    try:
+        for i in xrange(0, len(docids), CFG_BIBDOCFILE_FIXITY_CHUNK_SIZE):
+            chunk = docids[i:i + CFG_BIBDOCFILE_FIXITY_CHUNK_SIZE]
+            previous_results = get_fixity_results(chunk)
+            args = [(docid, previous_results.get(docid, {}), force, max_rate) for docid in chunk]
+            if pool is not None:
+                audits = pool.imap_unordered(_audit_docid_fixity_in_worker, args)
+            else:
+                audits = (_audit_docid_fixity_in_worker(arg) for arg in args)
+            for docid, (results, doc_skipped, doc_read_bytes) in audits:
+                store_fixity_results(docid, results, doc_skipped, previous_results.get(docid, {}))
+                for version, docformat, dummy, dummy, dummy, status in results:
+                    if status != 'OK':
+                        failures += 1
+                        print_info(docid, 'version %s, format %s: %s' % (version, docformat, status))
+                checked += len(results)
+                skipped += len(doc_skipped)
+                read_bytes += doc_read_bytes
+            elapsed = max(time.time() - start, 1e-6)
+            print '%i/%i documents: %i files checked (%s at %s/s), %i unchanged files skipped, %i failures' % \
+                (i + len(chunk), len(docids), checked, nice_size(read_bytes),
+                 nice_size(read_bytes / elapsed), skipped, failures)
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    elapsed = max(time.time() - start, 1e-6)
+    summary = '%i files checked in %.0f seconds (%s at %s/s)\n\n%i unchanged files skipped' % \
+        (checked, elapsed, nice_size(read_bytes), nice_size(read_bytes / elapsed), skipped)
+    if failures:
+        print wrap_text_in_a_box('%s\n\n%i files failing' % (summary, failures), style='conclusion')
+    else:
+        print wrap_text_in_a_box('%s\n\nAll files are correct' % summary, style='conclusion')
+
 
 def cli_hide(options):
     """Hide the matched versions of documents."""
@@ -1214,6 +1412,8 @@ def main():
             cli_check_md5(options)
         elif getattr(options, 'action', None) == 'update-md5':
             cli_update_md5(options)
+        elif getattr(options, 'action', None) == 'audit-fixity':
+            cli_audit_fixity(options)
         elif getattr(options, 'action', None) == 'fix-all':
             cli_fix_all(options)
         elif getattr(options, 'action', None) == 'fix-marc':
@@ -23,6 +23,7 @@ Format records using chosen format.
 The main APIs are:
   - format_record
   - format_records
+  - prefetch_records
   - create_excel
   - get_output_format_content_type
 
@@ -50,7 +51,8 @@ from invenio.config import \
      CFG_SITE_RECORD, \
      CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS
 from invenio.bibformat_config import \
-     CFG_BIBFORMAT_USE_OLD_BIBFORMAT
+     CFG_BIBFORMAT_USE_OLD_BIBFORMAT, \
+     CFG_BIBFORMAT_PREFETCH_BATCH_SIZE
 from invenio.access_control_engine import acc_authorize_action
 from invenio.jinja2utils import render_template_to_string
 import getopt
@@ -60,7 +62,8 @@ import sys
 ##
 
 def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
-                  xml_record=None, user_info=None, on_the_fly=False):
+                  xml_record=None, user_info=None, on_the_fly=False,
+                  prefetched=None):
     """
     Format a record in given output format.
 
@@ -98,12 +101,16 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
     @param user_info: the information of the user who will view the formatted page (if applicable)
     @param on_the_fly: if False, try to return an already preformatted version of the record in the database
     @type on_the_fly: boolean
+    @param prefetched: the data of the record, as returned by prefetch_records()
+    @type prefetched: dict
     @return: formatted record
     @rtype: string
     """
     from invenio.search_engine import record_exists
     if search_pattern is None:
         search_pattern = []
+    if prefetched is None:
+        prefetched = {'exists': {}}
 
     out = ""
 
@@ -116,11 +123,9 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
         return bibformat_engine.call_old_bibformat(recID, of=of, on_the_fly=on_the_fly)
     ############################# END ##################################
     if not on_the_fly and \
-       (ln == CFG_SITE_LANG or \
-        of.lower() == 'xm' or \
-        CFG_BIBFORMAT_USE_OLD_BIBFORMAT or \
-        (of.lower() in CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS)) and \
-        record_exists(recID) != -1:
+       use_preformatted_record_p(of, ln) and \
+       prefetched['exists'].get(recID, None) != -1 and \
+       (recID in prefetched['exists'] or record_exists(recID) != -1):
         # Try to fetch preformatted record. Only possible for records
         # formatted in CFG_SITE_LANG language (other are never
         # stored), or of='xm' which does not depend on language.
@@ -129,7 +134,10 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
         # always served from the same cache for any language.  Also,
         # do not fetch from DB when record has been deleted: we want
         # to return an "empty" record in that case
-        res = bibformat_dblayer.get_preformatted_record(recID, of)
+        if 'preformatted' in prefetched:
+            res = prefetched['preformatted'].get(recID)
+        else:
+            res = bibformat_dblayer.get_preformatted_record(recID, of)
         if res is not None:
             # record 'recID' is formatted in 'of', so return it
             if verbose == 9:
@@ -171,7 +179,9 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                                               verbose=verbose,
                                               search_pattern=search_pattern,
                                               xml_record=xml_record,
-                                              user_info=user_info)
+                                              user_info=user_info,
+                                              record=prefetched.get('records', {}).get(recID),
+                                              bibrecdocs=prefetched.get('bibrecdocs', {}).get(recID))
         if of.lower() == 'xm':
             out = filter_hidden_fields(out, user_info)
         return out
@@ -203,6 +213,56 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                                                                  recID = recID,
                                                                  )
 
+def use_preformatted_record_p(of, ln):
+    """
+    Tell if records formatted in output format 'of' for language 'ln'
+    can be taken from the preformatted records in the database.
+
+    Only records formatted in CFG_SITE_LANG language are stored
+    (other are never stored), or of='xm' which does not depend on
+    language.  Exceptions are made for output formats defined in
+    CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS, which are always
+    served from the same cache for any language.
+    """
+    return ln == CFG_SITE_LANG or \
+           of.lower() == 'xm' or \
+           CFG_BIBFORMAT_USE_OLD_BIBFORMAT or \
+           (of.lower() in CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS)
+
+def prefetch_records(recIDs, of, ln=CFG_SITE_LANG, on_the_fly=False):
+    """
+    Fetch, with a few queries for all of them, the data that
+    format_record() needs for formatting records 'recIDs' in output
+    format 'of': the existence of the records, their preformatted
+    versions and, for the records that have to be formatted on the
+    fly, their record structures and, for HTML output formats, their
+    attached documents.
+
+    @param recIDs: a list of record IDs
+    @type recIDs: list(int)
+    @param of: an output format code (or short identifier for the output format)
+    @type of: string
+    @param ln: the language to use to format the records
+    @type ln: string
+    @param on_the_fly: if False, preformatted versions of the records will be used
+    @type on_the_fly: boolean
+    @return: the data to give as 'prefetched' argument to format_record()
+    @rtype: dict
+    """
+    from invenio.search_engine import records_exist, get_records
+    exists = records_exist(recIDs)
+    prefetched = {'exists': exists}
+    if not on_the_fly and use_preformatted_record_p(of, ln):
+        prefetched['preformatted'] = bibformat_dblayer.get_preformatted_records(
+            [recID for recID in recIDs if exists[recID] == 1], of)
+    preformatted = prefetched.get('preformatted', {})
+    prefetched['records'] = get_records([recID for recID in recIDs
+                                         if exists[recID] and recID not in preformatted])
+    if of.lower().startswith('h'):
+        from invenio.bibdocfile import BibRecDocs
+        prefetched['bibrecdocs'] = BibRecDocs.load_many(prefetched['records'].keys())
+    return prefetched
+
 def record_get_xml(recID, format='xm', decompress=zlib.decompress):
     """
     Returns an XML string of the record given by recID.
@@ -307,10 +367,18 @@ def format_records(recIDs, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
 
     total_rec = len(recIDs)
     last_iteration = False
+    prefetched = None
     for i in range(total_rec):
         if i == total_rec - 1:
             last_iteration = True
 
+        #Fetch the data of the next batch of records
+        if xml_records[i] is None and \
+               i % CFG_BIBFORMAT_PREFETCH_BATCH_SIZE == 0 and \
+               not (CFG_BIBFORMAT_USE_OLD_BIBFORMAT and CFG_PATH_PHP):
+            prefetched = prefetch_records(recIDs[i:i + CFG_BIBFORMAT_PREFETCH_BATCH_SIZE],
+                                          of, ln, on_the_fly)
+
         #Print prefix
         if record_prefix is not None:
             if isinstance(record_prefix, str):
@@ -326,7 +394,7 @@ def format_records(recIDs, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
         #Print formatted record
         formatted_record = format_record(recIDs[i], of, ln, verbose, \
                                          search_pattern, xml_records[i],\
-                                         user_info, on_the_fly)
+                                         user_info, on_the_fly, prefetched)
         formatted_records += formatted_record
         if req is not None:
             req.write(formatted_record)
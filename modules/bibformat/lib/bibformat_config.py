@@ -56,6 +56,9 @@ assert len(CFG_BIBFORMAT_FORMAT_JINJA_TEMPLATE_EXTENSION) == 3, \
 assert len(CFG_BIBFORMAT_FORMAT_OUTPUT_EXTENSION) == 3, \
     "CFG_BIBFORMAT_FORMAT_OUTPUT_EXTENSION must be 3 characters long"
 
+# Number of records whose data are fetched together by format_records()
+CFG_BIBFORMAT_PREFETCH_BATCH_SIZE = 100
+
 # Exceptions: errors
 
 
@@ -471,6 +471,31 @@ def get_preformatted_record(recID, of, decompress=zlib.decompress):
     else:
         return None
 
+def get_preformatted_records(recIDs, of, decompress=zlib.decompress):
+    """
+    Returns the preformatted records with ids 'recIDs' and format 'of'
+    with a single query.
+
+    @param recIDs: the list of ids of the records to fetch
+    @param of: the output format code
+    @param decompress: the method used to decompress the preformatted records in database
+    @return: dictionary recID -> formatted record as String, for the
+             records that exist in given output format
+    """
+    out = {}
+    if not recIDs:
+        return out
+    # Decide whether to use DB slave:
+    if of in ('xm', 'recstruct'):
+        run_on_slave = False # for master formats, use DB master
+    else:
+        run_on_slave = True # for other formats, we can use DB slave
+    query = "SELECT id_bibrec, value FROM bibfmt WHERE id_bibrec IN (%s) AND format=%%s" % \
+            ','.join([str(int(recID)) for recID in recIDs])
+    for recID, value in run_sql(query, (of,), run_on_slave=run_on_slave):
+        out[recID] = "%s" % decompress(value)
+    return out
+
 def get_preformatted_record_date(recID, of):
     """
     Returns the date of the last update of the cache for the considered
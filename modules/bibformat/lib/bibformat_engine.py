@@ -103,6 +103,7 @@ if CFG_PATH_PHP: #Remove when call_old_bibformat is removed
 format_templates_cache = {}
 format_elements_cache = {}
 format_outputs_cache = {}
+compiled_format_templates_cache = {} # (path, ln) -> (mtime, compiled template)
 
 html_field = '<!--HTML-->' # String indicating that field should be
                            # treated as HTML (and therefore no escaping of
@@ -371,7 +372,8 @@ def call_old_bibformat(recID, of="HD", on_the_fly=False, verbose=0):
         return out
 
 def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
-                  search_pattern=None, xml_record=None, user_info=None):
+                  search_pattern=None, xml_record=None, user_info=None,
+                  record=None, bibrecdocs=None):
     """
     Formats a record given output format. Main entry function of
     bibformat engine.
@@ -398,6 +400,8 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
     @param search_pattern: list of strings representing the user request in web interface
     @param xml_record: an xml string representing the record to format
     @param user_info: the information of the user who will view the formatted page
+    @param record: the record structure of recID, if it was already fetched
+    @param bibrecdocs: the BibRecDocs of recID, if it was already loaded
     @return: formatted record
     """
     if search_pattern is None:
@@ -414,6 +418,10 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
 
     #Create a BibFormat Object to pass that contain record and context
     bfo = BibFormatObject(recID, ln, search_pattern, xml_record, user_info, of)
+    if xml_record is None and record is not None:
+        bfo.record = record
+    if xml_record is None and bibrecdocs is not None:
+        bfo.bibrecdocs = bibrecdocs
 
     if of.lower() != 'xm' and \
            (not bfo.get_record() or len(bfo.get_record()) <= 1):
@@ -531,28 +539,25 @@ def format_with_format_template(format_template_filename, bfo,
                                                        9: errors and warnings, stop if error (debug mode ))
     @return: formatted text
     """
-    _ = gettext_set_language(bfo.lang)
-
-    def translate(match):
-        """
-        Translate matching values
-        """
-        word = match.group("word")
-        translated_word = _(word)
-        return translated_word
-
     if format_template_code is not None:
         format_content = str(format_template_code)
+    elif format_template_filename.endswith("." + CFG_BIBFORMAT_FORMAT_TEMPLATE_EXTENSION):
+        format_content = None # compiled template is taken from cache
     elif not format_template_filename.endswith("." + CFG_BIBFORMAT_FORMAT_JINJA_TEMPLATE_EXTENSION):
         format_content = get_format_template(format_template_filename)['code']
 
     if format_template_filename is None or \
             format_template_filename.endswith("." + CFG_BIBFORMAT_FORMAT_TEMPLATE_EXTENSION):
         # .bft
-        filtered_format = filter_languages(format_content, bfo.lang)
-        localized_format = translation_pattern.sub(translate, filtered_format)
-
-        evaluated_format = eval_format_template_elements(localized_format,
+        if format_content is None:
+            compiled_format = get_compiled_format_template(format_template_filename,
+                                                           bfo.lang,
+                                                           verbose)
+        else:
+            compiled_format = compile_format_template(format_content,
+                                                      bfo.lang,
+                                                      verbose)
+        evaluated_format = eval_compiled_format_template(compiled_format,
                                                          bfo,
                                                          verbose)
     elif format_template_filename.endswith("." + CFG_BIBFORMAT_FORMAT_JINJA_TEMPLATE_EXTENSION):
@@ -620,26 +625,145 @@ def eval_format_template_elements(format_template, bfo, verbose=0):
                     9: errors and warnings, stop if error (debug mode ))
     @return: tuple (result, errors)
     """
-    _ = gettext_set_language(bfo.lang)
-    # First define insert_element_code(match), used in re.sub() function
-    def insert_element_code(match):
-        """
-        Analyses 'match', interpret the corresponding code, and return the result of the evaluation.
+    return eval_compiled_format_template(
+        parse_format_template_elements(format_template, verbose),
+        bfo, verbose)
 
-        Called by substitution in 'eval_format_template_elements(...)'
 
-        @param match: a match object corresponding to the special tag that must be interpreted
-        """
+def parse_format_template_elements(format_template, verbose=0):
+    """
+    Splits the given template code into literal chunks and format
+    element calls, so that it can be evaluated for many records
+    without being parsed again.
+
+    Each element call is a tuple (function_name, params,
+    format_element, error), where 'params' are the parameters given
+    in the template code, 'format_element' is the element as returned
+    by get_format_element (or None if it could not be loaded) and
+    'error' the exception raised while loading it, if any.
+
+    @param format_template: the format template code
+    @param verbose: the level of verbosity from 0 to 9 (O: silent,
+                    5: errors, 7: errors and warnings,
+                    9: errors and warnings, stop if error (debug mode ))
+    @return: list of strings and element call tuples
+    """
+    compiled_format = []
+    position = 0
+    for match in pattern_tag.finditer(format_template):
+        if match.start() > position:
+            compiled_format.append(format_template[position:match.start()])
+        position = match.end()
 
         function_name = match.group("function_name")
+        error = None
         try:
             format_element = get_format_element(function_name, verbose)
         except Exception, e:
             format_element = None
+            error = e
+
+        params = {}
+        # Look for function parameters given in format template code
+        all_params = match.group('params')
+        if all_params is not None:
+            function_params_iterator = pattern_function_params.finditer(all_params)
+            for param_match in function_params_iterator:
+                name = param_match.group('param')
+                value = param_match.group('value')
+                params[name] = value
+
+        compiled_format.append((function_name, params, format_element, error))
+    if position < len(format_template):
+        compiled_format.append(format_template[position:])
+    return compiled_format
+
+
+def compile_format_template(format_template, ln, verbose=0):
+    """
+    Compiles the given format template code for language 'ln': filters
+    the <lang> tags, translates the _()_ strings and parses the format
+    elements (see parse_format_template_elements).
+
+    @param format_template: the format template code
+    @param ln: the language of the compiled template
+    @param verbose: the level of verbosity from 0 to 9 (O: silent,
+                    5: errors, 7: errors and warnings,
+                    9: errors and warnings, stop if error (debug mode ))
+    @return: list of strings and element call tuples
+    """
+    _ = gettext_set_language(ln)
+
+    def translate(match):
+        """
+        Translate matching values
+        """
+        word = match.group("word")
+        translated_word = _(word)
+        return translated_word
+
+    filtered_format = filter_languages(format_template, ln)
+    localized_format = translation_pattern.sub(translate, filtered_format)
+    return parse_format_template_elements(localized_format, verbose)
+
+
+def get_compiled_format_template(filename, ln, verbose=0):
+    """
+    Returns the compiled version of format template 'filename' for
+    language 'ln' (see compile_format_template).
+
+    Compiled templates are cached and compiled again only when the
+    modification time of the template file changes.
+
+    @param filename: the filename of a .bft format template
+    @param ln: the language of the compiled template
+    @param verbose: the level of verbosity from 0 to 9 (O: silent,
+                    5: errors, 7: errors and warnings,
+                    9: errors and warnings, stop if error (debug mode ))
+    @return: list of strings and element call tuples
+    """
+    path = "%s%s%s" % (CFG_BIBFORMAT_TEMPLATES_PATH, os.sep, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+
+    cached = compiled_format_templates_cache.get((path, ln))
+    if cached is not None and mtime is not None and cached[0] == mtime:
+        return cached[1]
+
+    compiled_format = compile_format_template(get_format_template(filename)['code'],
+                                              ln, verbose)
+    compiled_format_templates_cache[(path, ln)] = (mtime, compiled_format)
+    return compiled_format
+
+
+def eval_compiled_format_template(compiled_format, bfo, verbose=0):
+    """
+    Evaluates the given compiled format template (see
+    parse_format_template_elements) for the record of 'bfo'.
+
+    @param compiled_format: list of strings and element call tuples
+    @param bfo: the object containing parameters for the current formatting
+    @param verbose: the level of verbosity from 0 to 9 (O: silent,
+                    5: errors, 7: errors and warnings,
+                    9: errors and warnings, stop if error (debug mode ))
+    @return: formatted text
+    """
+    _ = gettext_set_language(bfo.lang)
+    out = []
+    for chunk in compiled_format:
+        if not isinstance(chunk, tuple):
+            out.append(chunk)
+            continue
+
+        function_name, params, format_element, error = chunk
+        if error is not None:
             if verbose >= 5:
-                return '<b><span style="color: rgb(255, 0, 0);">' + \
-                       cgi.escape(str(e)).replace('\n', '<br/>') + \
-                       '</span>'
+                out.append('<b><span style="color: rgb(255, 0, 0);">' + \
+                           cgi.escape(str(error)).replace('\n', '<br/>') + \
+                           '</span>')
+                continue
         if format_element is None:
             try:
                 raise InvenioBibFormatError(_('Could not find format element named %s.') % function_name)
@@ -647,30 +771,17 @@ def eval_format_template_elements(format_template, bfo, verbose=0):
                 register_exception(req=bfo.req)
 
             if verbose >= 5:
-                return '<b><span style="color: rgb(255, 0, 0);">' + \
-                       str(exc.message)+'</span></b>'
+                out.append('<b><span style="color: rgb(255, 0, 0);">' + \
+                           str(exc.message)+'</span></b>')
         else:
-            params = {}
-            # Look for function parameters given in format template code
-            all_params = match.group('params')
-            if all_params is not None:
-                function_params_iterator = pattern_function_params.finditer(all_params)
-                for param_match in function_params_iterator:
-                    name = param_match.group('param')
-                    value = param_match.group('value')
-                    params[name] = value
-
-            # Evaluate element with params and return (Do not return errors)
+            # Evaluate element with params (Do not return errors)
             (result, dummy) = eval_format_element(format_element,
                                                    bfo,
-                                                   params,
+                                                   dict(params),
                                                    verbose)
-            return result
-
-    # Substitute special tags in the format by our own text.
-    # Special tags have the form <BNE_format_element_name [param="value"]* />
-    format = pattern_tag.sub(insert_element_code, format_template)
-    return format
+            if result is not None:
+                out.append(result)
+    return ''.join(out)
 
 
 def eval_format_element(format_element, bfo, parameters=None, verbose=0):
@@ -1836,14 +1947,17 @@ def get_fresh_output_format_filename(code):
 
 def clear_caches():
     """
-    Clear the caches (Output Format, Format Templates and Format Elements)
+    Clear the caches (Output Format, Format Templates, Compiled Format
+    Templates and Format Elements)
 
     @return: None
     """
-    global format_templates_cache, format_elements_cache, format_outputs_cache
+    global format_templates_cache, format_elements_cache, format_outputs_cache, \
+           compiled_format_templates_cache
     format_templates_cache = {}
     format_elements_cache = {}
     format_outputs_cache = {}
+    compiled_format_templates_cache = {}
 
 class BibFormatObject:
     """
@@ -1858,6 +1972,9 @@ class BibFormatObject:
     # The record
     record = None
 
+    # The documents attached to the record
+    bibrecdocs = None
+
     # The language in which the formatting has to be done
     lang = CFG_SITE_LANG
 
@@ -1942,6 +2059,20 @@ class BibFormatObject:
 
         return self.record
 
+    def get_bibrecdocs(self):
+        """
+        Returns the BibRecDocs of the documents attached to the record
+        of this L{BibFormatObject} instance
+
+        @return: the BibRecDocs of the record
+        """
+        from invenio.bibdocfile import BibRecDocs
+
+        if self.bibrecdocs is None:
+            self.bibrecdocs = BibRecDocs(self.recID)
+
+        return self.bibrecdocs
+
     def control_field(self, tag, escape=0):
         """
         Returns the value of control field given by tag in record
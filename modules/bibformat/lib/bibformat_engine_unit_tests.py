@@ -796,6 +796,18 @@ class FormatTest(InvenioTestCase):
 
         self.assertEqual(result,'''<h1>hi</h1> this is my template\ntest<bfe_non_existing_element must disappear/><test_1  non prefixed element must stay as any normal tag/>tfrgarbage\n<br/>test me!&lt;b&gt;ok&lt;/b&gt;a default valueeditor\n<br/>test me!<b>ok</b>a default valueeditor\n<br/>test me!&lt;b&gt;ok&lt;/b&gt;a default valueeditor\n99999''')
 
+    def test_compiled_format_template(self):
+        """ bibformat - compiled format templates are cached and give the same output"""
+        compiled = bibformat_engine.get_compiled_format_template("Test3.bft", 'fr')
+        self.assert_(compiled is bibformat_engine.get_compiled_format_template("Test3.bft", 'fr'))
+        template = bibformat_engine.get_format_template("Test3.bft")
+        result = bibformat_engine.format_with_format_template(format_template_filename=None,
+                                                              bfo=self.bfo_1,
+                                                              verbose=0,
+                                                              format_template_code=template['code'])
+        self.assertEqual(bibformat_engine.eval_compiled_format_template(compiled, self.bfo_1),
+                         result)
+
 
 class MarcFilteringTest(InvenioTestCase):
     """ bibformat - MARC tag filtering tests"""
@@ -27,6 +27,7 @@ from invenio.testutils import InvenioTestCase, make_test_suite, \
     run_test_suite, test_web_page_content
 
 format_record = lazy_import('invenio.bibformat:format_record')
+format_records = lazy_import('invenio.bibformat:format_records')
 BibFormatObject = lazy_import('invenio.bibformat_engine:BibFormatObject')
 
 class BibFormatAPITest(InvenioTestCase):
@@ -47,6 +48,17 @@ class BibFormatAPITest(InvenioTestCase):
         result = test_web_page_content(pageurl,
                                        expected_text=result)
 
+    def test_batch_formatting(self):
+        """bibformat - formatting records in batch gives the same output as one by one"""
+        recids = [73, 74, 77, 10000]
+        for of in ('hb', 'hx', 'xm'):
+            for on_the_fly in (False, True):
+                expected = '\n'.join([format_record(recid, of, on_the_fly=on_the_fly)
+                                      for recid in recids])
+                self.assertEqual(format_records(recids, of, record_separator='\n',
+                                                on_the_fly=on_the_fly),
+                                 expected)
+
 class BibFormatObjectAPITest(InvenioTestCase):
     """Check BibFormatObject (bfo) APIs"""
 
@@ -44,7 +44,7 @@ try:
     from invenio.bibtask import task_init, write_message, task_set_option, \
             task_get_option, task_update_progress, task_has_option, \
             task_low_level_submission, task_sleep_now_if_required, \
-            task_get_task_param
+            task_get_task_param, task_add_processed_records, task_init_worker
     import os
     import time
     import zlib
@@ -53,6 +53,12 @@ except ImportError, e:
     print "Error: %s" % e
     sys.exit(1)
 
+CFG_BIBREFORMAT_CHUNK_SIZE = 100 # number of records formatted and
+                                 # written to bibfmt together
+CFG_BIBREFORMAT_MAX_QUERY_SIZE = 1000000 # maximum size in bytes of the
+                                         # formatted records written
+                                         # by one query
+
 
 def fetch_last_updated(format):
     select_sql = "SELECT last_updated FROM format WHERE code = %s"
@@ -260,39 +266,108 @@ def without_fmt(queries, chunk_size=2000):
 ### Bibreformat all selected records (using new python bibformat)
 ### (see iterate_over_old further down)
 
+def format_records_chunk(recids, fmt):
+    """
+    Format records given by the list of IDs 'recids' in output format
+    'fmt'.
+
+    @return: list of tuples (record ID, date of formatting,
+             compressed formatted record)
+    """
+    out = []
+    for recID in recids:
+        start_date = time.strftime('%Y-%m-%d %H:%M:%S')
+        formatted_record = format_record(recID, fmt, on_the_fly=True)
+        write_message(formatted_record, verbose=9)
+        out.append((recID, start_date, zlib.compress(formatted_record)))
+    return out
+
+
+@with_app_context()
+def _format_records_chunk_in_worker(args):
+    """Run format_records_chunk() in a worker process."""
+    return format_records_chunk(*args)
+
+
+def store_formatted_records(formatted_records, fmt):
+    """
+    Store the formatted records, as returned by
+    format_records_chunk(), into bibfmt with multi-row queries of at
+    most CFG_BIBREFORMAT_MAX_QUERY_SIZE bytes.
+    """
+    i = 0
+    while i < len(formatted_records):
+        params = []
+        size = 0
+        while i < len(formatted_records) and \
+                  (not params or size + len(formatted_records[i][2]) <= CFG_BIBREFORMAT_MAX_QUERY_SIZE):
+            recID, start_date, value = formatted_records[i]
+            params.extend((recID, fmt, start_date, value))
+            size += len(value)
+            i += 1
+        run_sql('REPLACE LOW_PRIORITY INTO bibfmt (id_bibrec, format, last_updated, value) VALUES %s' % \
+                ', '.join(['(%s, %s, %s, %s)'] * (len(params) / 4)), params)
+
+
 def iterate_over_new(list, fmt):
     """
     Iterate over list of IDs
 
+    The records are formatted by chunks of CFG_BIBREFORMAT_CHUNK_SIZE
+    records, in parallel if the task was given several --workers.
+
     @param list: the list of record IDs to format
     @param fmt: the output format to use
     @return: tuple (total number of records, time taken to format, time taken to insert)
     """
-    global total_rec
-
-    formatted_records = ''      # (string-)List of formatted record of an iteration
     tbibformat  = 0     # time taken up by external call
     tbibupload  = 0     # time taken up by external call
-    start_date = task_get_task_param('task_starting_time') # Time at which the record was formatted
 
-    tot = len(list)
+    recids = [recID for recID in list]
+    chunks = [recids[i:i + CFG_BIBREFORMAT_CHUNK_SIZE]
+              for i in xrange(0, len(recids), CFG_BIBREFORMAT_CHUNK_SIZE)]
+    workers = task_get_option('workers', 1)
+    pool = None
+    if workers > 1 and len(chunks) > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes=workers, initializer=task_init_worker)
+        # hand as many chunks to the workers as they can treat at
+        # once, so that the task can be put to sleep in between:
+        group_size = workers * 2
+    else:
+        group_size = 1
+
+    tot = len(recids)
     count = 0
-    for recID in list:
-        t1 = os.times()[4]
-        start_date = time.strftime('%Y-%m-%d %H:%M:%S')
-        write_message(format_record(recID, fmt, on_the_fly=True))
-        formatted_record = zlib.compress(format_record(recID, fmt, on_the_fly=True))
-        run_sql('REPLACE LOW_PRIORITY INTO bibfmt (id_bibrec, format, last_updated, value) VALUES (%s, %s, %s, %s)',
-                (recID, fmt, start_date, formatted_record))
-        t2 = os.times()[4]
-        tbibformat += (t2 - t1)
-        count += 1
-        if (count % 100) == 0:
+    try:
+        for i in xrange(0, len(chunks), group_size):
+            group = chunks[i:i + group_size]
+            t1 = os.times()[4]
+            if pool is not None:
+                results = pool.imap(_format_records_chunk_in_worker,
+                                    [(chunk, fmt) for chunk in group])
+            else:
+                results = [format_records_chunk(chunk, fmt) for chunk in group]
+            for formatted_records in results:
+                t2 = os.times()[4]
+                tbibformat += (t2 - t1)
+                store_formatted_records(formatted_records, fmt)
+                t1 = os.times()[4]
+                tbibupload += (t1 - t2)
+                count += len(formatted_records)
+                task_add_processed_records(len(formatted_records))
             write_message("   ... formatted %s records out of %s" % (count, tot))
             task_update_progress('Formatted %s out of %s' % (count, tot))
             task_sleep_now_if_required(can_stop_too=True)
-    if (tot % 100) != 0:
-        write_message("   ... formatted %s records out of %s" % (count, tot))
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
     return (tot, tbibformat, tbibupload)
 
 
@@ -531,6 +606,7 @@ Examples:
   bibreformat -i 15              Force reformatting record 15 (in HB).
   bibreformat -i 15:20           Force reformatting records 15 to 20 (in HB).
   bibreformat -i 15,16,17        Force reformatting records 15, 16 and 17 (in HB).
+  bibreformat -a --workers=4     Force reformatting all records (in HB) with 4 processes.
 
   bibreformat -n                 Show how many records are to be (re)formatted.
   bibreformat -n -c 'Articles'   Show how many records are to be (re)formatted in 'Articles' collection.
@@ -544,6 +620,7 @@ Reformatting options:
   -f,  --field          \t Force reformatting records by field
   -p,  --pattern        \t Force reformatting records by pattern
   -i,  --id             \t Force reformatting records by record id(s)
+       --workers=N      \t Format the records with N parallel processes (1)
 Pattern options:
   -m,  --matching       \t Specify if pattern is exact (e), regular expression (r),
                         \t partial (p), any of the words (o) or all of the words (a)
@@ -557,7 +634,8 @@ Pattern options:
                  "pattern=",
                  "format=",
                  "noprocess",
-                 "id="]),
+                 "id=",
+                 "workers="]),
             task_submit_check_options_fnc=task_submit_check_options,
             task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
             task_run_fnc=task_run_core)
@@ -609,6 +687,11 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
             task_set_option("format", value)
     elif key in ("-i", "--id"):
         task_set_option("recids", value)
+    elif key in ("--workers",):
+        workers = int(value)
+        if workers < 1:
+            raise StandardError("The number of workers must be at least 1")
+        task_set_option("workers", workers)
     else:
         return False
     return True
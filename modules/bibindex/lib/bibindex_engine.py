@@ -42,7 +42,9 @@ from invenio.config import \
      CFG_XAPIAN_ENABLED
 from invenio.bibindex_engine_config import CFG_MAX_MYSQL_THREADS, \
     CFG_MYSQL_THREAD_TIMEOUT, \
-    CFG_CHECK_MYSQL_THREADS
+    CFG_CHECK_MYSQL_THREADS, \
+    CFG_BIBINDEX_FLUSH_CHUNK_SIZE, \
+    CFG_BIBINDEX_FLUSH_MAX_QUERY_SIZE
 from invenio.bibindex_engine_tokenizer import \
      BibIndexFuzzyNameTokenizer, BibIndexExactNameTokenizer, \
      BibIndexPairTokenizer, BibIndexWordTokenizer, \
@@ -56,12 +58,14 @@ from invenio.websubmit_file_converter import convert_file, get_file_converter_lo
 from invenio.search_engine import perform_request_search, \
      get_index_stemming_language, \
      get_synonym_terms
+from invenio.websearch_cache import invalidate_search_results_cache
 from invenio.dbquery import run_sql, DatabaseError, serialize_via_marshal, \
      deserialize_via_marshal, wash_table_column_name
 from invenio.bibindex_engine_washer import wash_index_term
 from invenio.bibtask import task_init, write_message, get_datetime, \
     task_set_option, task_get_option, task_get_task_param, \
-    task_update_progress, task_sleep_now_if_required
+    task_update_progress, task_sleep_now_if_required, \
+    task_add_processed_records, task_init_worker
 from invenio.intbitset import intbitset
 from invenio.errorlib import register_exception
 from invenio.htmlutils import get_links_in_html_page
@@ -103,6 +107,7 @@ nb_char_in_line = 50  # for verbose pretty printing
 chunksize = 1000 # default size of chunks that the records will be treated by
 base_process_size = 4500 # process base size
 _last_word_table = None
+_parallel_word_table = None # word table shared with the worker processes
 
 fulltext_added = intbitset() # stores ids of records whose fulltexts have been added
 
@@ -680,6 +685,14 @@ def get_percentage_completed(num_done, num_total):
         percentage_display = ""
     return percentage_display
 
+## worker function of WordTable.add_recIDs_in_parallel():
+def get_words_from_recID_range_in_worker(arange):
+    """Extract the words of the records in ARANGE=(low, high) using the
+    word table the worker processes were forked with.  Return the
+    tuple (low, high, wlist)."""
+    low, high = arange
+    return low, high, _parallel_word_table.get_words_from_recID_range(low, high)
+
 #def update_text_extraction_date(first_recid, last_recid):
     #"""for all the bibdoc connected to the specified recid, set
     #the text_extraction_date to the task_starting_time."""
@@ -711,6 +724,7 @@ class WordTable:
         self.stemming_language = get_index_stemming_language(index_id)
         self.is_fulltext_index = is_fulltext_index
         self.wash_index_terms = wash_index_terms
+        self._unique_term_key = None
 
         # tagToFunctions mapping. It offers an indirection level necessary for
         # indexing fulltext. The default is get_words_from_phrase
@@ -761,10 +775,14 @@ class WordTable:
         nb_words_total = len(self.value)
         nb_words_report = int(nb_words_total / 10.0)
         nb_words_done = 0
-        for word in self.value.keys():
-            self.put_word_into_db(word)
-            nb_words_done += 1
-            if nb_words_report != 0 and ((nb_words_done % nb_words_report) == 0):
+        nb_words_reported = 0
+        words = self.value.keys()
+        for i in xrange(0, nb_words_total, CFG_BIBINDEX_FLUSH_CHUNK_SIZE):
+            chunk = words[i:i + CFG_BIBINDEX_FLUSH_CHUNK_SIZE]
+            self.put_words_into_db(chunk)
+            nb_words_done += len(chunk)
+            if nb_words_report != 0 and nb_words_done - nb_words_reported >= nb_words_report:
+                nb_words_reported = nb_words_done
                 write_message('......processed %d/%d words' % (nb_words_done, nb_words_total))
                 percentage_display = get_percentage_completed(nb_words_done, nb_words_total)
                 task_update_progress("(%s:%s) flushed %d/%d words %s" % (self.tablename, self.humanname, nb_words_done, nb_words_total, percentage_display))
@@ -853,6 +871,126 @@ class WordTable:
 
         del self.value[word]
 
+    def load_old_recIDs_of_words(self, words):
+        """Load existing hitlists for the list of WORDS with one query.
+        Return dictionary term -> hitlist, holding the terms as they
+        are stored in the database."""
+        query = "SELECT term,hitlist FROM %s WHERE term IN (%s)" % \
+                (wash_table_column_name(self.tablename), ','.join(['%s'] * len(words))) # kwalitee: disable=sql
+        old_recIDs = {}
+        for term, hitlist in run_sql(query, words):
+            old_recIDs[term] = intbitset(hitlist)
+        return old_recIDs
+
+    def has_unique_term_key(self):
+        """Return True if the table has a unique key on its terms, as
+        the idxWORD and idxPAIR tables do.  The terms of the idxPHRASE
+        tables are only indexed by a prefix, so they are not unique."""
+        if self._unique_term_key is None:
+            self._unique_term_key = False
+            for row in run_sql("SHOW INDEX FROM %s" % wash_table_column_name(self.tablename), with_dict=True): # kwalitee: disable=sql
+                if row['Column_name'] == 'term' and not int(row['Non_unique']) \
+                       and row['Sub_part'] is None:
+                    self._unique_term_key = True
+        return self._unique_term_key
+
+    def write_hitlists_into_db(self, rows):
+        """Write ROWS, a list of (term, hitlist dump) of already
+        existing terms, using multi-row INSERT ... ON DUPLICATE KEY
+        UPDATE queries of at most CFG_BIBINDEX_FLUSH_MAX_QUERY_SIZE
+        bytes.  Tables without a unique key on their terms are updated
+        term by term, since the INSERT would add duplicate rows."""
+        if not self.has_unique_term_key():
+            query = "UPDATE %s SET hitlist=%%s WHERE term=%%s" % \
+                    wash_table_column_name(self.tablename) # kwalitee: disable=sql
+            for term, hitlist in rows:
+                run_sql(query, (hitlist, term))
+            return
+        query = "INSERT INTO %s (term, hitlist) VALUES %%s ON DUPLICATE KEY UPDATE hitlist=VALUES(hitlist)" % \
+                wash_table_column_name(self.tablename) # kwalitee: disable=sql
+        i = 0
+        while i < len(rows):
+            params = []
+            size = 0
+            while i < len(rows) and (not params or size + len(rows[i][1]) <= CFG_BIBINDEX_FLUSH_MAX_QUERY_SIZE):
+                params.extend(rows[i])
+                size += len(rows[i][1])
+                i += 1
+            run_sql(query % ','.join(['(%s,%s)'] * (len(params) / 2)), params)
+
+    def insert_hitlists_into_db(self, rows):
+        """Insert ROWS, a list of (term, hitlist dump) of new terms,
+        using multi-row INSERT queries.  Return the list of terms
+        that could not be inserted this way (e.g. because a term that
+        the database collation considers to be equal was inserted in
+        the meantime); they have to be flushed one by one."""
+        query = "INSERT INTO %s (term, hitlist) VALUES %%s" % \
+                wash_table_column_name(self.tablename) # kwalitee: disable=sql
+        failed = []
+        i = 0
+        while i < len(rows):
+            params = []
+            size = 0
+            while i < len(rows) and (not params or size + len(rows[i][1]) <= CFG_BIBINDEX_FLUSH_MAX_QUERY_SIZE):
+                params.extend(rows[i])
+                size += len(rows[i][1])
+                i += 1
+            try:
+                run_sql(query % ','.join(['(%s,%s)'] * (len(params) / 2)), params)
+            except DatabaseError:
+                failed.extend(params[::2])
+        return failed
+
+    def put_words_into_db(self, words):
+        """Flush the list of WORDS to the database and delete them from
+        memory.  This is the bulk version of put_word_into_db(): the
+        old hitlists are read and the new ones are written with a few
+        queries per chunk of words instead of two queries per word."""
+        old_recIDs = self.load_old_recIDs_of_words(words)
+        # the terms that are stored differently from the words of
+        # memory but match them (collation) are left to the one by
+        # one flush, which merges them the way it always did:
+        unmatched_terms = len([term for term in old_recIDs if not self.value.has_key(term)])
+        rows_to_update = []
+        rows_to_insert = []
+        words_to_delete = []
+        words_left = []
+        for word in words:
+            hitset = old_recIDs.get(word)
+            if hitset is not None: # merge the word recIDs found in memory:
+                if not self.merge_with_old_recIDs(word, hitset):
+                    # nothing to update:
+                    write_message("......... unchanged hitlist for ``%s''" % word, verbose=9)
+                elif hitset:
+                    write_message("......... updating hitlist for ``%s''" % word, verbose=9)
+                    rows_to_update.append((word, hitset.fastdump()))
+                if not hitset: # never store empty words
+                    words_to_delete.append(word)
+            elif unmatched_terms:
+                words_left.append(word)
+                continue
+            else: # the word is new, will create new set:
+                hitset = intbitset(self.value[word].keys())
+                if hitset:
+                    write_message("......... inserting hitlist for ``%s''" % word, verbose=9)
+                    rows_to_insert.append((word, hitset.fastdump()))
+                    # kept in memory until it is inserted:
+                    continue
+            del self.value[word]
+
+        self.write_hitlists_into_db(rows_to_update)
+        words_left.extend(self.insert_hitlists_into_db(rows_to_insert))
+        if words_to_delete:
+            run_sql("DELETE FROM %s WHERE term IN (%s)" % \
+                    (wash_table_column_name(self.tablename), ','.join(['%s'] * len(words_to_delete))),
+                    words_to_delete) # kwalitee: disable=sql
+        failed_words = set(words_left)
+        for word, dummy in rows_to_insert:
+            if word not in failed_words:
+                del self.value[word]
+        for word in words_left:
+            self.put_word_into_db(word)
+
     def display(self):
         "Displays the word table."
         keys = self.value.keys()
@@ -893,6 +1031,9 @@ class WordTable:
         [[i1_low,i1_high],[i2_low,i2_high], ..., [iN_low,iN_high]].
         """
         global chunksize, _last_word_table
+        workers = task_get_option("workers", 1)
+        if workers > 1:
+            return self.add_recIDs_in_parallel(recIDs, opt_flush, workers)
         flush_count = 0
         records_done = 0
         records_to_go = 0
@@ -928,6 +1069,7 @@ class WordTable:
                 flush_count = flush_count + i_high - i_low + 1
                 chunksize_count = chunksize_count + i_high - i_low + 1
                 records_done = records_done + just_processed
+                task_add_processed_records(just_processed)
                 write_message("%s adding records #%d-#%d ended  " % \
                         (self.tablename, i_low, i_high))
 
@@ -950,6 +1092,78 @@ class WordTable:
                 solr_commit()
             self.log_progress(time_started, records_done, records_to_go)
 
+    def add_recIDs_in_parallel(self, recIDs, opt_flush, workers):
+        """Same as add_recIDs(), but the words of the records are
+        extracted by a pool of WORKERS processes, each one treating
+        chunks of CHUNKSIZE records.  The partial word lists of the
+        chunks are merged into the in-memory word table, which is
+        written once per term at every flush, as usual.  Only the
+        parent process writes into the index tables.
+        """
+        global _parallel_word_table
+        from multiprocessing import Pool
+
+        # split the ranges into chunks, grouped by flush:
+        flush_groups = [[]]
+        flush_count = 0
+        records_to_go = 0
+        for arange in recIDs:
+            i_low = arange[0]
+            while i_low <= arange[1]:
+                i_high = min(i_low + chunksize - 1, arange[1])
+                flush_groups[-1].append((i_low, i_high))
+                flush_count += i_high - i_low + 1
+                records_to_go += i_high - i_low + 1
+                if flush_count >= opt_flush:
+                    flush_groups.append([])
+                    flush_count = 0
+                i_low = i_high + 1
+        if not flush_groups[-1]:
+            flush_groups.pop()
+
+        records_done = 0
+        time_started = time.time() # will measure profile time
+        write_message("%s adding records using %d worker processes" % \
+                (self.tablename, workers))
+        # the workers are forked with the table as it is now:
+        _parallel_word_table = self
+        pool = Pool(processes=workers, initializer=task_init_worker)
+        try:
+            for chunks in flush_groups:
+                task_sleep_now_if_required()
+                for i_low, i_high in chunks:
+                    try:
+                        self.chk_recID_range(i_low, i_high)
+                    except StandardError:
+                        if self.index_name == 'fulltext' and CFG_SOLR_URL:
+                            solr_commit()
+                        raise
+                if CFG_CHECK_MYSQL_THREADS:
+                    kill_sleepy_mysql_threads()
+                for i_low, i_high in chunks:
+                    self.del_recID_range(i_low, i_high)
+                # fetch the results in order, while the workers go on:
+                for i_low, i_high, wlist in pool.imap(get_words_from_recID_range_in_worker, chunks):
+                    just_processed = self.add_recID_range(i_low, i_high, wlist)
+                    records_done += just_processed
+                    task_add_processed_records(just_processed)
+                    percentage_display = get_percentage_completed(records_done, records_to_go)
+                    task_update_progress("(%s:%s) adding recs %d-%d %s" % (self.tablename, self.humanname, i_low, i_high, percentage_display))
+                    write_message("%s adding records #%d-#%d ended  " % \
+                            (self.tablename, i_low, i_high))
+                self.put_into_db()
+                self.clean()
+                if self.index_name == 'fulltext' and CFG_SOLR_URL:
+                    solr_commit()
+                self.log_progress(time_started, records_done, records_to_go)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _parallel_word_table = None
+
     def add_recIDs_by_date(self, dates, opt_flush):
         """Add records that were modified between DATES[0] and DATES[1].
            If DATES is not set, then add records that were modified since
@@ -1001,10 +1215,12 @@ class WordTable:
             else:
                 self.add_recIDs(alist, opt_flush)
 
-    def add_recID_range(self, recID1, recID2):
-        """Add records from RECID1 to RECID2."""
+    def get_words_from_recID_range(self, recID1, recID2):
+        """Return dictionary recID -> list of words of the records from
+        RECID1 to RECID2.  Only reads from the database, so that it can
+        be run in worker processes (see add_recIDs_in_parallel()).
+        """
         wlist = {}
-        self.recIDs_in_mem.append([recID1, recID2])
         # special case of author indexes where we also add author
         # canonical IDs:
         if self.index_name in ('author', 'firstauthor', 'exactauthor', 'exactfirstauthor'):
@@ -1057,7 +1273,7 @@ class WordTable:
 
         # lookup index-time synonyms:
         if CFG_BIBINDEX_SYNONYM_KBRS.has_key(self.index_name):
-            if len(wlist) == 0: return 0
+            if len(wlist) == 0: return wlist
             recIDs = wlist.keys()
             for recID in recIDs:
                 for word in wlist[recID]:
@@ -1068,15 +1284,25 @@ class WordTable:
                     if word_synonyms:
                         wlist[recID] = list_union(word_synonyms, wlist[recID])
 
-        # were there some words for these recIDs found?
-        if len(wlist) == 0: return 0
-        recIDs = wlist.keys()
-        for recID in recIDs:
+        for recID in wlist.keys():
             # was this record marked as deleted?
             if "DELETED" in self.get_field(recID, "980__c"):
                 wlist[recID] = []
                 write_message("... record %d was declared deleted, removing its word list" % recID, verbose=9)
             write_message("... record %d, termlist: %s" % (recID, wlist[recID]), verbose=9)
+        return wlist
+
+    def add_recID_range(self, recID1, recID2, wlist=None):
+        """Add records from RECID1 to RECID2.  WLIST is the dictionary
+        recID -> list of words of these records; it is computed here
+        unless it was already extracted by a worker process."""
+        if wlist is None:
+            wlist = self.get_words_from_recID_range(recID1, recID2)
+        self.recIDs_in_mem.append([recID1, recID2])
+
+        # were there some words for these recIDs found?
+        if len(wlist) == 0: return 0
+        recIDs = wlist.keys()
 
         # put words into reverse index table with FUTURE status:
         for recID in recIDs:
@@ -1365,6 +1591,7 @@ def main():
   -w, --windex=w1[,w2]\tword/phrase indexes to consider (all)
   -M, --maxmem=XXX\tmaximum memory usage in kB (no limit)
   -f, --flush=NNN\t\tfull consistent table flush after NNN records (10000)
+  --workers=N\t\textract the words using N parallel processes (1)
 """,
             version=__revision__,
             specific_params=("adi:m:c:w:krRM:f:", [
@@ -1379,6 +1606,7 @@ def main():
                 "reindex",
                 "maxmem=",
                 "flush=",
+                "workers=",
             ]),
             task_stop_helper_fnc=task_stop_table_close_fnc,
             task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
@@ -1431,6 +1659,10 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
                 (base_process_size + 1000))
     elif key in ("-f", "--flush"):
         task_set_option("flush", int(value))
+    elif key in ("--workers",):
+        task_set_option("workers", int(value))
+        if task_get_option("workers") < 1:
+            raise StandardError("Number of workers should be at least 1")
     else:
         return False
     return True
@@ -1725,6 +1957,8 @@ def task_run_core():
         task_sleep_now_if_required(can_stop_too=True)
 
     _last_word_table = None
+    # cached search results may not reflect the new indexes anymore:
+    invalidate_search_results_cache()
     return True
 
 
@@ -35,3 +35,10 @@ CFG_MAX_MYSQL_THREADS = 50 # how many threads (connections) we
                            # consider as still safe
 CFG_MYSQL_THREAD_TIMEOUT = 20 # we'll kill threads that were sleeping
                               # for more than X seconds
+
+## bulk flushing of word tables:
+CFG_BIBINDEX_FLUSH_CHUNK_SIZE = 500 # how many terms are read and
+                                    # written per query
+CFG_BIBINDEX_FLUSH_MAX_QUERY_SIZE = 1000000 # maximum size in bytes of
+                                            # the hitlists written by
+                                            # one query
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""BibIndex Regression Test Suite."""
+
+__revision__ = "$Id$"
+
+import unittest
+
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.dbquery import run_sql, deserialize_via_marshal
+from invenio.intbitset import intbitset
+from invenio.bibindex_engine import WordTable, get_index_id_from_index_name, \
+     get_phrases_from_phrase, get_words_from_phrase, get_pairs_from_phrase, \
+     get_index_tags
+
+
+class BibIndexFlushTest(unittest.TestCase):
+    """Check the bulk flush of word tables into the database."""
+
+    term = 'bibindex regression test term'
+
+    def setUp(self):
+        self.index_id = get_index_id_from_index_name('title')
+
+    def _flush_twice(self, table_name_pattern, get_words_fnc):
+        """Flush the test term into the table with recID 1, then with
+        recID 2 instead, and return the rows of the term."""
+        table = WordTable('title', self.index_id, [], table_name_pattern,
+                          get_words_fnc, {}, wash_index_terms=0)
+        self.tablename = table.tablename
+        table.value = {self.term: {1: 1}}
+        table.put_words_into_db([self.term])
+        table.value = {self.term: {1: -1, 2: 1}}
+        table.put_words_into_db([self.term])
+        return run_sql("SELECT hitlist FROM %s WHERE term=%%s" % self.tablename,
+                       (self.term,))
+
+    def tearDown(self):
+        run_sql("DELETE FROM %s WHERE term=%%s" % self.tablename, (self.term,))
+
+    def test_flush_phrase_twice(self):
+        """bibindex - flushing the same phrase term twice"""
+        res = self._flush_twice('idxPHRASE%02dF', get_phrases_from_phrase)
+        self.assertEqual(1, len(res))
+        self.assertEqual(intbitset([2]), intbitset(res[0][0]))
+
+    def test_flush_word_twice(self):
+        """bibindex - flushing the same word term twice"""
+        res = self._flush_twice('idxWORD%02dF', get_words_from_phrase)
+        self.assertEqual(1, len(res))
+        self.assertEqual(intbitset([2]), intbitset(res[0][0]))
+
+
+class BibIndexParallelTest(unittest.TestCase):
+    """Check that indexing with worker processes gives the same
+    tables as indexing serially."""
+
+    recids = intbitset(range(1, 21))
+
+    def _get_table(self, table_name_pattern, get_words_fnc, wash_index_terms):
+        """Return a title table of the given kind, set up as bibindex
+        does, so that the demo site index is left unchanged."""
+        return WordTable('title', get_index_id_from_index_name('title'),
+                         get_index_tags('title'), table_name_pattern,
+                         get_words_fnc, {}, wash_index_terms=wash_index_terms)
+
+    def _get_contents(self, table):
+        """Return the forward and reverse table contents for the test
+        records."""
+        forward = {}
+        for term, hitlist in run_sql("SELECT term, hitlist FROM %s" % table.tablename):
+            hitlist = intbitset(hitlist) & self.recids
+            if hitlist:
+                forward[term] = hitlist.tolist()
+        reverse = {}
+        for recid, termlist, termlist_type in run_sql(
+            "SELECT id_bibrec, termlist, type FROM %sR WHERE id_bibrec BETWEEN %%s AND %%s" % \
+            table.tablename[:-1], (self.recids.min(), self.recids.max())):
+            reverse[(recid, termlist_type)] = sorted(deserialize_via_marshal(termlist))
+        return forward, reverse
+
+    def _check_parallel(self, table_name_pattern, get_words_fnc, wash_index_terms):
+        """Index the test records serially, then in parallel, also with
+        a failing worker, and compare the table contents."""
+        recid_ranges = [[self.recids.min(), self.recids.max()]]
+        table = self._get_table(table_name_pattern, get_words_fnc, wash_index_terms)
+        table.add_recIDs(recid_ranges, 10000)
+        expected = self._get_contents(table)
+        self.failUnless(expected[0])
+
+        table = self._get_table(table_name_pattern, get_words_fnc, wash_index_terms)
+        table.add_recIDs_in_parallel(recid_ranges, 10000, 2)
+        self.assertEqual(expected, self._get_contents(table))
+
+        ## a failing worker aborts the run before anything is written
+        def get_words_from_recID_range(low, high):
+            raise ValueError("worker failure")
+        table = self._get_table(table_name_pattern, get_words_fnc, wash_index_terms)
+        table.get_words_from_recID_range = get_words_from_recID_range
+        self.assertRaises(ValueError, table.add_recIDs_in_parallel,
+                          recid_ranges, 10000, 2)
+        self.assertEqual(expected, self._get_contents(table))
+
+    def test_parallel_words(self):
+        """bibindex - parallel indexing of words"""
+        self._check_parallel('idxWORD%02dF', get_words_from_phrase, 50)
+
+    def test_parallel_pairs(self):
+        """bibindex - parallel indexing of pairs"""
+        self._check_parallel('idxPAIR%02dF', get_pairs_from_phrase, 100)
+
+    def test_parallel_phrases(self):
+        """bibindex - parallel indexing of phrases"""
+        self._check_parallel('idxPHRASE%02dF', get_phrases_from_phrase, 0)
+
+
+TEST_SUITE = make_test_suite(BibIndexFlushTest,
+                             BibIndexParallelTest, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
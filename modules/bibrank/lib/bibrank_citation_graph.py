@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+On-disk, memory-mapped citation graphs.
+
+The citation indexer stores its dictionaries (recid -> list of recids)
+as marshalled blobs in rnkCITATIONDATA.  Loading them means that every
+web worker holds its own private copy of all of them.  This module
+stores the same dictionaries in a compressed sparse row layout:
+
+    header | offsets[0..max_recid+1] | targets[0..nb_edges-1]
+
+where the list of recid R is targets[offsets[R]:offsets[R+1]].  All
+integers are 32-bit little-endian ones.  The header holds the
+last_updated date of the dictionary in rnkCITATIONDATA, so that the
+searchers can tell a graph file left over by an older run (e.g. on
+another node) from the current one.  The files are mapped
+read-only, so that their pages are shared by all the processes of the
+node through the operating system page cache, and they are replaced
+by an atomic rename, so that readers always see either the old or the
+new graph.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import sys
+import mmap
+import struct
+import tempfile
+from array import array
+
+try:
+    ## import optional module:
+    import numpy
+    CFG_NUMPY_IMPORTABLE = True
+except ImportError:
+    CFG_NUMPY_IMPORTABLE = False
+
+from invenio.config import CFG_CACHEDIR
+from invenio.intbitset import intbitset
+
+CFG_BIBRANK_CITATION_GRAPH_DIR = os.path.join(CFG_CACHEDIR, 'citations')
+
+CFG_BIBRANK_CITATION_GRAPH_NAMES = ('citationdict', 'reversedict',
+                                    'selfcitdict', 'selfcitedbydict')
+
+CFG_BIBRANK_CITATION_GRAPH_MAGIC = 'INVCITG2'
+# magic, last_updated, padding, max_recid, nb_edges:
+CFG_BIBRANK_CITATION_GRAPH_HEADER = '<8s19sxxxxxII'
+CFG_BIBRANK_CITATION_GRAPH_HEADER_SIZE = struct.calcsize(CFG_BIBRANK_CITATION_GRAPH_HEADER)
+
+# array typecode of 32-bit integers (recids fit in 31 bits and plain
+# Python ints are nicer to hand out than longs):
+CFG_BIBRANK_CITATION_GRAPH_TYPECODE = 'i'
+
+
+class InvenioBibRankCitationGraphError(Exception):
+    """Error raised for missing or corrupted citation graph files."""
+    pass
+
+
+def get_citation_graph_path(name):
+    """Return the path of the citation graph file of dictionary 'name'."""
+    return os.path.join(CFG_BIBRANK_CITATION_GRAPH_DIR, name + '.cgr')
+
+
+def _to_little_endian(arr):
+    """Swap bytes of array 'arr' in place if we are on a big-endian box."""
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+
+def write_citation_graph(dic, path, last_updated=''):
+    """
+    Write citation dictionary 'dic' (recid -> list of recids) into the
+    graph file 'path', recording 'last_updated', the date the
+    dictionary was stored in rnkCITATIONDATA at.  The file is first written under a temporary
+    name in the same directory and then renamed over 'path', so that
+    the readers that have the old file mapped keep using it and the
+    new readers get the new one.
+    """
+    typecode = CFG_BIBRANK_CITATION_GRAPH_TYPECODE
+    max_recid = 0
+    if dic:
+        max_recid = max(dic.keys())
+    offsets = array(typecode, [0]) * (max_recid + 2)
+    targets = array(typecode)
+    for recid in xrange(max_recid + 1):
+        offsets[recid] = len(targets)
+        recids = dic.get(recid)
+        if recids:
+            targets.extend(recids)
+    offsets[max_recid + 1] = len(targets)
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp', dir=directory)
+    try:
+        tmp_file = os.fdopen(fd, 'wb')
+        try:
+            tmp_file.write(struct.pack(CFG_BIBRANK_CITATION_GRAPH_HEADER,
+                                       CFG_BIBRANK_CITATION_GRAPH_MAGIC,
+                                       last_updated, max_recid, len(targets)))
+            tmp_file.write(_to_little_endian(offsets).tostring())
+            tmp_file.write(_to_little_endian(targets).tostring())
+        finally:
+            tmp_file.close()
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CitationGraph(object):
+    """
+    Read-only, memory-mapped citation graph.  It quacks like the
+    citation dictionaries it replaces (get(), has_key(), keys(), ...)
+    so that the citation searcher can use either of them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        graph_file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(graph_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        finally:
+            graph_file.close()
+        if len(self._map) < CFG_BIBRANK_CITATION_GRAPH_HEADER_SIZE:
+            raise InvenioBibRankCitationGraphError("%s is truncated" % path)
+        magic, self.last_updated, self.max_recid, self.nb_edges = struct.unpack(
+            CFG_BIBRANK_CITATION_GRAPH_HEADER,
+            self._map[:CFG_BIBRANK_CITATION_GRAPH_HEADER_SIZE])
+        if magic != CFG_BIBRANK_CITATION_GRAPH_MAGIC:
+            raise InvenioBibRankCitationGraphError("%s is not a citation graph" % path)
+        self.last_updated = self.last_updated.rstrip('\0')
+        self._offsets_start = CFG_BIBRANK_CITATION_GRAPH_HEADER_SIZE
+        self._targets_start = self._offsets_start + 4 * (self.max_recid + 2)
+        if len(self._map) != self._targets_start + 4 * self.nb_edges:
+            raise InvenioBibRankCitationGraphError("%s is truncated" % path)
+        self._keys = None
+
+    def _get_range(self, recid):
+        """Return (start, end) positions of the list of 'recid'."""
+        if recid < 0 or recid > self.max_recid:
+            return 0, 0
+        return struct.unpack('<II', self._map[self._offsets_start + 4 * recid:
+                                              self._offsets_start + 4 * recid + 8])
+
+    def get_count(self, recid):
+        """Return the length of the list of 'recid' without decoding it."""
+        start, end = self._get_range(recid)
+        return end - start
+
+    def get(self, recid, default=None):
+        start, end = self._get_range(recid)
+        if start == end:
+            return default
+        recids = array(CFG_BIBRANK_CITATION_GRAPH_TYPECODE)
+        recids.fromstring(self._map[self._targets_start + 4 * start:
+                                    self._targets_start + 4 * end])
+        return _to_little_endian(recids).tolist()
+
+    def __getitem__(self, recid):
+        recids = self.get(recid)
+        if recids is None:
+            raise KeyError(recid)
+        return recids
+
+    def has_key(self, recid):
+        return self.get_count(recid) > 0
+
+    __contains__ = has_key
+
+    def get_offsets(self):
+        """Return the whole offsets array (max_recid + 2 items)."""
+        offsets = array(CFG_BIBRANK_CITATION_GRAPH_TYPECODE)
+        offsets.fromstring(self._map[self._offsets_start:self._targets_start])
+        return _to_little_endian(offsets)
+
+    def get_counts(self):
+        """Return the list lengths of recids 0..max_recid as a numpy
+        array, computed straight from the mapped offsets."""
+        offsets = numpy.frombuffer(self._map, dtype='<i4',
+                                   count=self.max_recid + 2,
+                                   offset=self._offsets_start)
+        return numpy.diff(offsets).astype(numpy.int32)
+
+    def keys(self):
+        """Return the list of recids having a non-empty list."""
+        if self._keys is None:
+            if CFG_NUMPY_IMPORTABLE:
+                self._keys = numpy.nonzero(self.get_counts())[0].tolist()
+            else:
+                offsets = self.get_offsets()
+                self._keys = [recid for recid in xrange(self.max_recid + 1)
+                              if offsets[recid] != offsets[recid + 1]]
+        return self._keys
+
+    def keys_intbitset(self):
+        """Return the recids having a non-empty list as an intbitset."""
+        return intbitset(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def iteritems(self):
+        for recid in self.keys():
+            yield recid, self.get(recid)
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __nonzero__(self):
+        return self.nb_edges > 0
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the memory-mapped citation graphs."""
+
+__revision__ = "$Id$"
+
+import os
+import shutil
+import tempfile
+
+from invenio.importutils import lazy_import
+from invenio.testutils import make_test_suite, run_test_suite, InvenioTestCase
+
+bibrank_citation_graph = lazy_import('invenio.bibrank_citation_graph')
+
+
+class TestCitationGraph(InvenioTestCase):
+    """Test writing and reading of citation graph files."""
+
+    def setUp(self):
+        """Write a small citation graph"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'citationdict.cgr')
+        self.dic = {1: [5, 3], 4: [1], 7: [2, 3, 1]}
+        bibrank_citation_graph.write_citation_graph(self.dic, self.path)
+        self.graph = bibrank_citation_graph.CitationGraph(self.path)
+
+    def tearDown(self):
+        """Remove the citation graph"""
+        self.graph.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_lists(self):
+        """bibrank citation graph - lists are kept in order"""
+        for recid, recids in self.dic.items():
+            self.assertEqual(recids, self.graph[recid])
+        self.assertEqual([], self.graph.get(2, []))
+        self.assertEqual(None, self.graph.get(100))
+        self.assertRaises(KeyError, self.graph.__getitem__, 3)
+
+    def test_keys_and_counts(self):
+        """bibrank citation graph - keys and counts"""
+        self.assertEqual([1, 4, 7], self.graph.keys())
+        self.assertEqual(3, self.graph.get_count(7))
+        self.assertEqual(0, self.graph.get_count(8))
+        self.failUnless(self.graph.has_key(4))
+        self.failIf(5 in self.graph)
+
+    def test_counts(self):
+        """bibrank citation graph - dense count array"""
+        if not bibrank_citation_graph.CFG_NUMPY_IMPORTABLE:
+            return
+        self.assertEqual([0, 2, 0, 0, 1, 0, 0, 3],
+                         self.graph.get_counts().tolist())
+
+    def test_atomic_replacement(self):
+        """bibrank citation graph - replacement keeps old mapping valid"""
+        bibrank_citation_graph.write_citation_graph({2: [9]}, self.path)
+        self.assertEqual([5, 3], self.graph[1])
+        new_graph = bibrank_citation_graph.CitationGraph(self.path)
+        self.assertEqual([2], new_graph.keys())
+        self.assertEqual(['citationdict.cgr'], os.listdir(self.tmpdir))
+        new_graph.close()
+
+    def test_empty_graph(self):
+        """bibrank citation graph - empty dictionary"""
+        bibrank_citation_graph.write_citation_graph({}, self.path)
+        graph = bibrank_citation_graph.CitationGraph(self.path)
+        self.failIf(graph)
+        self.assertEqual([], graph.keys())
+        graph.close()
+
+    def test_last_updated(self):
+        """bibrank citation graph - last_updated date in the header"""
+        self.assertEqual('', self.graph.last_updated)
+        bibrank_citation_graph.write_citation_graph(self.dic, self.path,
+                                                    '2013-07-04 10:20:30')
+        graph = bibrank_citation_graph.CitationGraph(self.path)
+        self.assertEqual('2013-07-04 10:20:30', graph.last_updated)
+        self.assertEqual(self.dic[7], graph[7])
+        graph.close()
+
+TEST_SUITE = make_test_suite(TestCitationGraph,)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
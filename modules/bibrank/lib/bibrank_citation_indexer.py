@@ -38,6 +38,8 @@ from invenio.bibtask import write_message, task_get_option, \
                      task_update_progress, task_sleep_now_if_required, \
                      task_get_task_param
 from invenio.errorlib import register_exception
+from invenio.bibrank_citation_graph import write_citation_graph, \
+    get_citation_graph_path, CFG_BIBRANK_CITATION_GRAPH_NAMES
 from invenio.bibindex_engine import get_field_tags
 from invenio.bibindex_engine import CFG_JOURNAL_PUBINFO_STANDARD_FORM_REGEXP_CHECK
 
@@ -902,6 +904,19 @@ def insert_into_cit_db(dic, name):
     # check that this column really exists
     run_sql("""REPLACE INTO rnkCITATIONDATA(object_name, object_value,
                last_updated) VALUES (%s, %s, %s)""", (name, s, ndate))
+    if name in CFG_BIBRANK_CITATION_GRAPH_NAMES:
+        # publish the dictionary also as a memory-mappable graph file
+        # for the searchers:
+        path = get_citation_graph_path(name)
+        try:
+            write_citation_graph(dic, path, ndate)
+        except (IOError, OSError):
+            register_exception(prefix="could not write citation graph %s" % path,
+                               alert_admin=True)
+            # do not leave a stale graph behind; the searchers will
+            # fall back to rnkCITATIONDATA
+            if os.path.exists(path):
+                os.remove(path)
 
 
 def get_cit_dict(name):
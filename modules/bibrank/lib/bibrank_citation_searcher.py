@@ -20,11 +20,23 @@
 __revision__ = "$Id$"
 
 import re
+import os
+import time
+
+try:
+    ## import optional module:
+    import numpy
+    CFG_NUMPY_IMPORTABLE = True
+except ImportError:
+    CFG_NUMPY_IMPORTABLE = False
 
 from invenio.dbquery import run_sql, get_table_update_time, OperationalError, \
         deserialize_via_marshal
 from invenio.intbitset import intbitset
 from invenio.data_cacher import DataCacher
+from invenio.bibrank_citation_graph import CitationGraph, \
+    InvenioBibRankCitationGraphError, get_citation_graph_path, \
+    CFG_BIBRANK_CITATION_GRAPH_NAMES
 
 class CitationDictsDataCacher(DataCacher):
     """
@@ -63,7 +75,56 @@ class CitationDictsDataCacher(DataCacher):
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
+class CitationGraphsDataCacher(DataCacher):
+    """
+    Cache holding the memory-mapped citation graphs written by the
+    citation indexer next to rnkCITATIONDATA.  Only the mappings are
+    held by the worker; the graph data itself lives in the page cache
+    shared by all the processes.  The database stays authoritative: a
+    graph whose last_updated date differs from the one of its
+    dictionary in rnkCITATIONDATA (e.g. left over on this node by an
+    older run of the indexer on another node) is not used.
+    """
+    def __init__(self):
+        def get_last_updated_dates():
+            try:
+                return dict(run_sql("""SELECT object_name,
+                                       DATE_FORMAT(last_updated, '%Y-%m-%d %H:%i:%s')
+                                       FROM rnkCITATIONDATA"""))
+            except OperationalError:
+                return {}
+        def cache_filler():
+            graphs = {}
+            last_updated_dates = get_last_updated_dates()
+            for name in CFG_BIBRANK_CITATION_GRAPH_NAMES:
+                try:
+                    graph = CitationGraph(get_citation_graph_path(name))
+                except (IOError, OSError, InvenioBibRankCitationGraphError):
+                    # graph not written yet or being replaced; fall
+                    # back to rnkCITATIONDATA for this dictionary
+                    continue
+                if graph.last_updated == last_updated_dates.get(name):
+                    graphs[name] = graph
+            if graphs.has_key('citationdict'):
+                graphs['citationdict_keys'] = graphs['citationdict'].keys()
+                graphs['citationdict_keys_intbitset'] = graphs['citationdict'].keys_intbitset()
+            return graphs
+        def timestamp_verifier():
+            mtimes = ['0000-00-00 00:00:00']
+            mtimes.extend([last_updated for last_updated in get_last_updated_dates().values()
+                           if last_updated])
+            for name in CFG_BIBRANK_CITATION_GRAPH_NAMES:
+                try:
+                    mtime = os.stat(get_citation_graph_path(name)).st_mtime
+                except OSError:
+                    continue
+                mtimes.append(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime)))
+            return max(mtimes)
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
 CACHE_CITATION_DICTS = None
+CACHE_CITATION_GRAPHS = None
 
 def get_citation_dict(dictname):
     """
@@ -71,6 +132,10 @@ def get_citation_dict(dictname):
     loading, i.e. loads the dictionary the first time it is actually
     used.
 
+    If the citation indexer has published the dictionary as a citation
+    graph file, the memory-mapped graph is returned instead; it offers
+    the same read-only dictionary interface.
+
     @param dictname: the name of the citation dictionary to return. Can
             be citationdict, reversedict, selfcitdict, selfcitedbydict.
     @type dictname: string
@@ -78,7 +143,13 @@ def get_citation_dict(dictname):
             { recid -> [list of recids] }.
     @rtype: dictionary
     """
-    global CACHE_CITATION_DICTS
+    global CACHE_CITATION_DICTS, CACHE_CITATION_GRAPHS
+    if CACHE_CITATION_GRAPHS is None:
+        CACHE_CITATION_GRAPHS = CitationGraphsDataCacher()
+    else:
+        CACHE_CITATION_GRAPHS.recreate_cache_if_needed()
+    if CACHE_CITATION_GRAPHS.cache.has_key(dictname):
+        return CACHE_CITATION_GRAPHS.cache[dictname]
     if CACHE_CITATION_DICTS is None:
         CACHE_CITATION_DICTS = CitationDictsDataCacher()
     else:
@@ -104,14 +175,77 @@ def get_cited_by(recordid):
 def get_cited_by_count(recordid):
     """Return how many records cite given RECORDID."""
     cache_cited_by_dictionary = get_citation_dict("citationdict")
+    if isinstance(cache_cited_by_dictionary, CitationGraph):
+        return cache_cited_by_dictionary.get_count(recordid)
     return len(cache_cited_by_dictionary.get(recordid, []))
 
+CACHE_CITATION_COUNTS = None
+
+def get_citation_counts():
+    """
+    Return a dense numpy array of citation counts indexed by recid,
+    covering recids up to the highest cited one.  The array is
+    computed once per citation dictionary reload, straight from the
+    graph offsets when the citation graph file is available.
+    """
+    global CACHE_CITATION_COUNTS
+    citationdict = get_citation_dict("citationdict")
+    if CACHE_CITATION_COUNTS is None or \
+           CACHE_CITATION_COUNTS[0] is not citationdict:
+        if isinstance(citationdict, CitationGraph):
+            counts = citationdict.get_counts()
+        else:
+            recids = citationdict.keys()
+            counts = numpy.zeros(max(recids + [0]) + 1, dtype=numpy.int32)
+            counts[recids] = [len(citationdict[recid]) for recid in recids]
+        CACHE_CITATION_COUNTS = (citationdict, counts)
+    return CACHE_CITATION_COUNTS[1]
+
+def get_citation_counts_of(recids):
+    """
+    Return numpy arrays (recids, counts) of the given records, in
+    the given order, and of their citation counts.
+    """
+    counts = get_citation_counts()
+    if isinstance(recids, intbitset):
+        recids = recids.tolist()
+    recids = numpy.array(recids, dtype=numpy.int32)
+    recids_counts = numpy.zeros(len(recids), dtype=numpy.int32)
+    known = recids < len(counts)
+    recids_counts[known] = counts[recids[known]]
+    return recids, recids_counts
+
+def get_recids_with_citation_counts(first, last=None):
+    """
+    Return intbitset of records cited at least FIRST and at most LAST
+    times (no upper bound if LAST is None).  Never cited records are
+    not part of the array, hence FIRST is expected to be at least 1.
+    """
+    counts = get_citation_counts()
+    selection = counts >= first
+    if last is not None:
+        selection &= counts <= last
+    return intbitset(numpy.nonzero(selection)[0].tolist())
+
+def rank_by_citation_count(recids):
+    """
+    Return list of [recid, number_of_citing_records] for the given
+    records, sorted by ascending number of citations, records with the
+    same number of citations keeping their original order, as the
+    citation ranking expects.
+    """
+    recids, counts = get_citation_counts_of(recids)
+    order = numpy.argsort(counts, kind='mergesort')
+    return numpy.column_stack((recids[order], counts[order])).tolist()
+
 def get_records_with_num_cites(numstr, allrecs = intbitset([])):
     """Return an intbitset of record IDs that are cited X times,
        X defined in numstr.
        Warning: numstr is string and may not be numeric! It can
        be 10,0->100 etc
     """
+    if CFG_NUMPY_IMPORTABLE:
+        return get_records_with_num_cites_vectorized(numstr, allrecs)
     cache_cited_by_dictionary = get_citation_dict("citationdict")
     cache_cited_by_dictionary_keys = get_citation_dict("citationdict_keys")
     cache_cited_by_dictionary_keys_intbitset = get_citation_dict("citationdict_keys_intbitset")
@@ -166,6 +300,42 @@ def get_records_with_num_cites(numstr, allrecs = intbitset([])):
                 matches.add(k)
     return matches
 
+def get_records_with_num_cites_vectorized(numstr, allrecs=intbitset([])):
+    """Same as get_records_with_num_cites(), but selecting the records
+       on the dense citation count array instead of iterating over
+       the citation dictionary."""
+    if not (type(numstr) == type("thisisastring")):
+        return intbitset([])
+    numstr = numstr.replace(" ", '')
+    numstr = numstr.replace('"', '')
+
+    singlenum = re.findall("(^\d+$)", numstr)
+    if singlenum:
+        num = int(singlenum[0])
+        if num == 0:
+            #we return recids that are not in keys
+            return allrecs - get_citation_dict("citationdict_keys_intbitset")
+        return get_recids_with_citation_counts(num, num)
+
+    firstsec = re.findall("(\d+)->(\d+)", numstr)
+    if firstsec:
+        try:
+            first = int(firstsec[0][0])
+            sec = int(firstsec[0][1])
+        except ValueError:
+            return intbitset([])
+        matches = intbitset([])
+        if first == 0:
+            #start with those that have no cites..
+            matches = allrecs - get_citation_dict("citationdict_keys_intbitset")
+        if first <= sec:
+            return matches | get_recids_with_citation_counts(max(first, 1), sec)
+
+    firstsec = re.findall("(\d+)\+", numstr)
+    if firstsec:
+        return get_recids_with_citation_counts(int(firstsec[0]) + 1)
+    return intbitset([])
+
 def get_cited_by_list(recordlist):
     """Return a tuple of ([recid,list_of_citing_records],...) for all the
        records in recordlist.
@@ -213,6 +383,9 @@ def get_cited_by_weight(recordlist):
     """Return a tuple of ([recid,number_of_citing_records],...) for all the
        records in recordlist.
     """
+    if CFG_NUMPY_IMPORTABLE:
+        recids, counts = get_citation_counts_of(recordlist)
+        return numpy.column_stack((recids, counts)).tolist()
     cache_cited_by_dictionary = get_citation_dict("citationdict")
     result = []
     for recid in recordlist:
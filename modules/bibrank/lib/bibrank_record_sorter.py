@@ -37,7 +37,8 @@ from invenio.errorlib import register_exception
 from invenio.webpage import adderrorbox
 from invenio.bibindex_engine_stemmer import stem
 from invenio.bibindex_engine_stopwords import is_stopword
-from invenio.bibrank_citation_searcher import get_cited_by, get_cited_by_weight
+from invenio.bibrank_citation_searcher import get_cited_by, get_cited_by_weight, \
+     rank_by_citation_count, CFG_NUMPY_IMPORTABLE
 from invenio.intbitset import intbitset
 from invenio.bibrank_word_searcher import find_similar
 # Do not remove these lines, it is necessary for func_object = globals().get(function)
@@ -426,10 +427,14 @@ def find_citations(rank_method_code, recID, hitset, verbose):
     ret = []
     if recisint:
         myrecords = get_cited_by(recidint) #this is a simple list
-        ret = get_cited_by_weight(myrecords)
     else:
-        ret = get_cited_by_weight(hitset)
-    ret.sort(lambda x,y:cmp(x[1],y[1]))      #ascending by the second member of the tuples
+        myrecords = hitset
+    if CFG_NUMPY_IMPORTABLE:
+        #gather the counts from the dense citation count array and sort them at once
+        ret = rank_by_citation_count(myrecords)
+    else:
+        ret = get_cited_by_weight(myrecords)
+        ret.sort(lambda x,y:cmp(x[1],y[1]))      #ascending by the second member of the tuples
 
     if verbose > 0:
         voutput = voutput+"\nrecID "+str(recID)+" is int: "+str(recisint)+" hitset "+str(hitset)+"\n"+"find_citations retlist "+str(ret)
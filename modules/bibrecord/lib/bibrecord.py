@@ -116,6 +116,60 @@ def create_records(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
     return [create_record(record_xml, verbose=verbose, correct=correct,
             parser=parser, keep_singletons=keep_singletons) for record_xml in record_xmls]
 
+def create_records_from_stream(stream,
+    verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
+    correct=CFG_BIBRECORD_DEFAULT_CORRECT, parser='',
+    keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
+    """Generates the records of the MARCXML document read from stream
+    (a file object or a file name) one by one.  Every record is
+    generated as a tuple (record, status_code, list_of_errors), like
+    create_record() returns.
+
+    Unlike create_records(), the document is parsed incrementally and
+    the elements of the records already generated are freed, so that
+    the memory used does not depend on the size of the document.
+
+    The document has to be well-formed.  It is parsed with lxml if
+    available (or if parser is 'lxml') and with ElementTree otherwise
+    (or if parser is 'elementtree').  Records in the MARC21 slim
+    namespace are supported.  Only the innermost <record> elements are
+    considered, so that the MARCXML records wrapped in the <record>
+    elements of an OAI-PMH response are generated, but not the
+    wrappers.
+
+    @param stream: file object or file name of the MARCXML document
+    @param verbose: if > 3, raise an exception for records that are
+        not valid according to the MARC21 DTD
+    @param correct: 1 to validate the records against the MARC21 DTD
+        and to enable correction of the records structure.
+    @raise InvenioBibRecordParserError: if the document is not
+        well-formed"""
+    for element in _iterparse_record_elements(stream, parser):
+        errs = []
+        if correct:
+            errs = _get_record_element_validity_errors(element)
+            if errs and verbose > 3:
+                raise InvenioBibRecordParserError('; '.join(errs))
+        rec = _create_record_from_element(element,
+            keep_singletons=keep_singletons)
+        if correct:
+            # Correct the structure of the record.
+            errs.extend(_correct_record(rec))
+        yield (rec, int(not errs), errs)
+
+def count_records_in_stream(stream, parser=''):
+    """Returns the number of records of the MARCXML document read from
+    stream (a file object or a file name), that create_records_from_stream()
+    would generate.  The document is parsed incrementally, but the
+    records are not created.
+
+    @raise InvenioBibRecordParserError: if the document is not
+        well-formed"""
+    nb_records = 0
+    for dummy in _iterparse_record_elements(stream, parser):
+        nb_records += 1
+    return nb_records
+
 def create_record(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
     correct=CFG_BIBRECORD_DEFAULT_CORRECT, parser='',
     sort_fields_by_indicators=False,
@@ -1447,6 +1501,154 @@ def _create_record_lxml(marcxml,
 
     return record
 
+def _iterparse_record_elements(stream, parser=''):
+    """Generates the innermost <record> elements of the XML document
+    read from stream, which is parsed incrementally with lxml or
+    ElementTree (see create_records_from_stream()).  The <record>
+    elements containing other records are not generated.  Every
+    <record> element is removed from the tree once it has been
+    consumed, so that the parsed document does not grow in memory."""
+    if parser == 'lxml' or \
+           (parser != 'elementtree' and 'lxml' in AVAILABLE_PARSERS):
+        iterparse = etree.iterparse
+    else:
+        try:
+            from xml.etree.cElementTree import iterparse
+        except ImportError:
+            from xml.etree.ElementTree import iterparse
+
+    context = iterparse(stream, events=('start', 'end'))
+    open_elements = []
+    # for every open <record> element, whether it contains records:
+    open_records = []
+    while True:
+        try:
+            event, element = context.next()
+        except StopIteration:
+            return
+        except SyntaxError, ex1:
+            raise InvenioBibRecordParserError(str(ex1))
+
+        is_record = _get_local_name(element) == 'record'
+        if event == 'start':
+            if is_record:
+                if open_records:
+                    open_records[-1] = True
+                open_records.append(False)
+            open_elements.append(element)
+            continue
+
+        open_elements.pop()
+        if not is_record:
+            continue
+        if not open_records.pop():
+            yield element
+        # Free the record.
+        element.clear()
+        if open_elements:
+            open_elements[-1].remove(element)
+
+_MARC21_DTD = []
+
+def _get_record_element_validity_errors(element):
+    """Returns the list of the errors of the ElementTree (or lxml)
+    <record> element according to the MARC21 DTD, ignoring its
+    namespace.  The record is validated with lxml, or with pyRXP if
+    lxml is not available; it is not validated if neither is."""
+    if 'lxml' in AVAILABLE_PARSERS:
+        if not _MARC21_DTD:
+            try:
+                _MARC21_DTD.append(etree.DTD(CFG_MARC21_DTD))
+            except (IOError, etree.DTDParseError), ex1:
+                raise InvenioBibRecordParserError(str(ex1))
+        dtd = _MARC21_DTD[0]
+        collection = etree.Element('collection')
+        collection.append(_copy_element_without_namespace(element,
+            etree.Element))
+        if dtd.validate(collection):
+            return []
+        return ['DTD: %s' % error.message for error in dtd.error_log]
+    elif 'pyrxp' in AVAILABLE_PARSERS:
+        from xml.etree.ElementTree import Element, tostring
+        marcxml = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<!DOCTYPE collection SYSTEM "file://%s">\n'
+            '<collection>\n%s\n</collection>' % (CFG_MARC21_DTD,
+            tostring(_copy_element_without_namespace(element, Element))))
+        pyrxp_parser = pyRXP.Parser(ErrorOnValidityErrors=1, ProcessDTD=1,
+            srcName='string input')
+        try:
+            pyrxp_parser.parse(marcxml)
+        except pyRXP.error, ex1:
+            return ['DTD: %s' % ex1]
+    return []
+
+def _copy_element_without_namespace(element, element_factory):
+    """Returns a copy of the ElementTree (or lxml) element and of its
+    children, without namespace, made with element_factory (the
+    Element class of lxml or ElementTree)."""
+    copy = element_factory(_get_local_name(element), dict(element.attrib))
+    copy.text = element.text
+    for child in element:
+        if _get_local_name(child) is not None:
+            child_copy = _copy_element_without_namespace(child,
+                element_factory)
+            child_copy.tail = child.tail
+            copy.append(child_copy)
+    return copy
+
+def _get_local_name(element):
+    """Returns the tag name of the ElementTree (or lxml) element without
+    its namespace, or None for comments and processing instructions."""
+    tag = element.tag
+    if not isinstance(tag, basestring):
+        return None
+    return tag.rsplit('}', 1)[-1]
+
+def _get_child_elements(element, name):
+    """Returns the children of the ElementTree (or lxml) element with
+    tag name 'name', whatever their namespace."""
+    return [child for child in element if _get_local_name(child) == name]
+
+def _create_record_from_element(element,
+        keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
+    """Creates a record object from an ElementTree (or lxml) <record>
+    element, the same way _create_record_lxml() does from a tree."""
+    record = {}
+    field_position_global = 0
+
+    for controlfield in _get_child_elements(element, 'controlfield'):
+        tag = controlfield.attrib.get('tag', '!').encode("UTF-8")
+        text = controlfield.text
+        if text is None:
+            text = ''
+        else:
+            text = text.encode("UTF-8")
+        if text or keep_singletons:
+            field_position_global += 1
+            record.setdefault(tag, []).append(([], ' ', ' ', text, field_position_global))
+
+    for datafield in _get_child_elements(element, 'datafield'):
+        tag = datafield.attrib.get('tag', '!').encode("UTF-8")
+        ind1 = datafield.attrib.get('ind1', '!').encode("UTF-8")
+        ind2 = datafield.attrib.get('ind2', '!').encode("UTF-8")
+        if ind1 in ('', '_'): ind1 = ' '
+        if ind2 in ('', '_'): ind2 = ' '
+        subfields = []
+        for subfield in _get_child_elements(datafield, 'subfield'):
+            code = subfield.attrib.get('code', '!').encode("UTF-8")
+            text = subfield.text
+            if text is None:
+                text = ''
+            else:
+                text = text.encode("UTF-8")
+            if text or keep_singletons:
+                subfields.append((code, text))
+        if subfields or keep_singletons:
+            field_position_global += 1
+            record.setdefault(tag, []).append((subfields, ind1, ind2, '', field_position_global))
+
+    return record
+
 def _create_record_rxp(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
     correct=CFG_BIBRECORD_DEFAULT_CORRECT,
     keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
@@ -47,6 +47,43 @@ def reset(split_by=1000):
     reset_rec_cache('recstruct', get_recstruct_record, split_by=split_by)
 
 
+@manager.command
+def benchmark(path):
+    """Compare the MARCXML parsers on the records of file PATH."""
+    import time
+    from invenio.bibrecord import AVAILABLE_PARSERS, create_records, \
+        create_records_from_stream
+
+    def run(name, parse):
+        start = time.time()
+        nb_records = parse()
+        print "%-24s %8d records %10.2f s" % (name, nb_records,
+                                              time.time() - start)
+
+    def parse_whole(parser):
+        marcxml_file = open(path)
+        try:
+            return len(create_records(marcxml_file.read(), parser=parser))
+        finally:
+            marcxml_file.close()
+
+    def parse_stream(parser):
+        marcxml_file = open(path)
+        try:
+            return len([1 for dummy in create_records_from_stream(
+                        marcxml_file, parser=parser)])
+        finally:
+            marcxml_file.close()
+
+    for parser in AVAILABLE_PARSERS:
+        run("create_records/%s" % parser, lambda: parse_whole(parser))
+    stream_parsers = ['elementtree']
+    if 'lxml' in AVAILABLE_PARSERS:
+        stream_parsers.insert(0, 'lxml')
+    for parser in stream_parsers:
+        run("stream/%s" % parser, lambda: parse_stream(parser))
+
+
 def main():
     from invenio.webinterface_handler_flask import create_invenio_flask_app
     app = create_invenio_flask_app()
@@ -22,6 +22,7 @@ The BibRecord test suite.
 """
 
 
+from cStringIO import StringIO
 
 from invenio.config import CFG_TMPDIR, \
      CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG
@@ -112,6 +113,12 @@ class BibRecordSuccessTest(InvenioTestCase):
             ret.append(rec)
         self.assertEqual(fields, cr, "\n%s\n!=\n%s" % (fields, cr))
 
+    def test_records_created_from_stream(self):
+        """ bibrecord - demo file parsed incrementally gives the same records"""
+        recs = [rec[0] for rec in bibrecord.create_records_from_stream(
+                    CFG_TMPDIR + '/demobibdata.xml')]
+        self.assertEqual(self.recs, recs)
+
     def test_create_record_with_collection_tag(self):
         """ bibrecord - create_record() for single record in collection"""
         xmltext = """
@@ -174,6 +181,55 @@ class BibRecordParsersTest(InvenioTestCase):
             record = bibrecord._create_record_minidom(self.xmltext)
             self.assertEqual(record, self.expected_record)
 
+    def test_stream(self):
+        """ bibrecord - create_records_from_stream() with ElementTree """
+        records = list(bibrecord.create_records_from_stream(
+            StringIO(self.xmltext), parser='elementtree'))
+        self.assertEqual(records, [(self.expected_record, 1, [])])
+
+    if parser_lxml_available:
+        def test_stream_lxml(self):
+            """ bibrecord - create_records_from_stream() with lxml """
+            records = list(bibrecord.create_records_from_stream(
+                StringIO(self.xmltext), parser='lxml'))
+            self.assertEqual(records, [(self.expected_record, 1, [])])
+
+    def test_stream_namespace(self):
+        """ bibrecord - create_records_from_stream() with MARC21 slim namespace """
+        xmltext = self.xmltext.replace('<collection>',
+            '<collection xmlns="http://www.loc.gov/MARC21/slim">')
+        records = list(bibrecord.create_records_from_stream(StringIO(xmltext)))
+        self.assertEqual(records, [(self.expected_record, 1, [])])
+
+    def test_stream_oai_pmh(self):
+        """ bibrecord - create_records_from_stream() with OAI-PMH wrappers """
+        xmltext = self.xmltext.replace('<collection>',
+            '<OAI-PMH><ListRecords><record><header/><metadata>')
+        xmltext = xmltext.replace('</collection>',
+            '</metadata></record></ListRecords></OAI-PMH>')
+        records = list(bibrecord.create_records_from_stream(StringIO(xmltext)))
+        self.assertEqual(records, [(self.expected_record, 1, [])])
+        self.assertEqual(1, bibrecord.count_records_in_stream(StringIO(xmltext)))
+
+    if parser_lxml_available:
+        def test_stream_validation(self):
+            """ bibrecord - create_records_from_stream() validates records """
+            xmltext = self.xmltext.replace('</record>', '<foo/></record>')
+            records = list(bibrecord.create_records_from_stream(
+                StringIO(xmltext), correct=1))
+            self.assertEqual(1, len(records))
+            self.assertEqual(0, records[0][1])
+            self.assertRaises(bibrecord_config.InvenioBibRecordParserError,
+                list, bibrecord.create_records_from_stream(
+                    StringIO(xmltext), verbose=4, correct=1))
+
+    def test_stream_not_well_formed(self):
+        """ bibrecord - create_records_from_stream() with bad XML """
+        records = bibrecord.create_records_from_stream(
+            StringIO("<collection><record></collection>"))
+        self.assertRaises(bibrecord_config.InvenioBibRecordParserError,
+                          list, records)
+
 class BibRecordBadInputTreatmentTest(InvenioTestCase):
     """ bibrecord - testing for bad input treatment """
     def test_empty_collection(self):
@@ -28,6 +28,8 @@ import time
 import re
 import marshal
 import getopt
+import select
+import socket
 from itertools import chain
 from socket import gethostname
 from subprocess import Popen
@@ -36,11 +38,14 @@ import signal
 from invenio.bibtask_config import \
     CFG_BIBTASK_VALID_TASKS, \
     CFG_BIBTASK_MONOTASKS, \
-    CFG_BIBTASK_FIXEDTIMETASKS
+    CFG_BIBTASK_FIXEDTIMETASKS, \
+    CFG_BIBTASK_RESOURCE_CLASSES, \
+    CFG_BIBTASK_DEFAULT_RESOURCE_CLASS
 
 from invenio.config import \
      CFG_PREFIX, \
      CFG_BIBSCHED_REFRESHTIME, \
+     CFG_BIBSCHED_MAX_IDLE_TIME, \
      CFG_BIBSCHED_LOG_PAGER, \
      CFG_BIBSCHED_EDITOR, \
      CFG_BINDIR, \
@@ -51,6 +56,7 @@ from invenio.config import \
      CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS, \
      CFG_SITE_URL, \
      CFG_BIBSCHED_NODE_TASKS, \
+     CFG_BIBSCHED_RESOURCE_SLOTS, \
      CFG_BIBSCHED_MAX_ARCHIVED_ROWS_DISPLAY
 from invenio.dbquery import run_sql, real_escape_string
 from invenio.textutils import wrap_text_in_a_box
@@ -63,6 +69,14 @@ CFG_VALID_STATUS = ('WAITING', 'SCHEDULED', 'RUNNING', 'CONTINUING',
 
 CFG_MOTD_PATH = os.path.join(CFG_PREFIX, "var", "run", "bibsched.motd")
 
+## Local socket on which BibSched listens to notifications of changes
+## of the task queue, see bibsched_notify_queue_change():
+CFG_BIBSCHED_NOTIFICATION_SOCKET = os.path.join(CFG_PREFIX, "var", "run", "bibsched.sock")
+
+CFG_BIBSCHED_ACTIVE_STATUSES = ('RUNNING', 'CONTINUING', 'SCHEDULED',
+                                'ABOUT TO STOP', 'ABOUT TO SLEEP')
+CFG_BIBSCHED_ERROR_STATUSES = ('ERROR', 'DONE WITH ERRORS', 'CERROR')
+
 SHIFT_RE = re.compile("([-\+]{0,1})([\d]+)([dhms])")
 
 
@@ -157,6 +171,7 @@ def get_last_taskid():
 def delete_task(task_id):
     """Delete the corresponding task."""
     run_sql("DELETE FROM schTASK WHERE id=%s", (task_id, ))
+    bibsched_notify_queue_change()
 
 def is_task_scheduled(task_name):
     """Check if a certain task_name is due for execution (WAITING or RUNNING)"""
@@ -255,11 +270,14 @@ def bibsched_get_status(task_id):
 def bibsched_set_status(task_id, status, when_status_is=None):
     """Update the status of task_id."""
     if when_status_is is None:
-        return run_sql("UPDATE schTASK SET status=%s WHERE id=%s",
-                       (status, task_id))
+        res = run_sql("UPDATE schTASK SET status=%s WHERE id=%s",
+                      (status, task_id))
     else:
-        return run_sql("UPDATE schTASK SET status=%s WHERE id=%s AND status=%s",
-                       (status, task_id, when_status_is))
+        res = run_sql("UPDATE schTASK SET status=%s WHERE id=%s AND status=%s",
+                      (status, task_id, when_status_is))
+    if res:
+        bibsched_notify_queue_change()
+    return res
 
 
 def bibsched_set_progress(task_id, progress):
@@ -269,7 +287,44 @@ def bibsched_set_progress(task_id, progress):
 
 def bibsched_set_priority(task_id, priority):
     """Update the priority of task_id."""
-    return run_sql("UPDATE schTASK SET priority=%s WHERE id=%s", (priority, task_id))
+    res = run_sql("UPDATE schTASK SET priority=%s WHERE id=%s", (priority, task_id))
+    if res:
+        bibsched_notify_queue_change()
+    return res
+
+
+def bibsched_notify_queue_change():
+    """Notify the schedulers that the task queue has changed: increase
+    the queue version, that the schedulers of all the nodes check, and
+    wake up the scheduler of this node."""
+    run_sql("""INSERT INTO schNOTIFY (name, version, last_updated)
+               VALUES ('queue', 1, NOW())
+               ON DUPLICATE KEY UPDATE version=version+1, last_updated=NOW()""")
+    bibsched_wake_up()
+
+
+def bibsched_wake_up():
+    """Wake up the scheduler of this node, for changes of the task
+    queue that do not concern the schedulers of the other nodes."""
+    try:
+        notification_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            notification_socket.setblocking(0)
+            notification_socket.sendto('queue', CFG_BIBSCHED_NOTIFICATION_SOCKET)
+        finally:
+            notification_socket.close()
+    except socket.error:
+        ## BibSched is not running on this node, or it has not read the
+        ## previous notifications yet: it will see the new version anyway.
+        pass
+
+
+def bibsched_get_queue_version():
+    """Return the current version of the task queue."""
+    res = run_sql("SELECT version FROM schNOTIFY WHERE name='queue'")
+    if res:
+        return res[0][0]
+    return 0
 
 
 def bibsched_send_signal(proc, task_id, sig):
@@ -291,6 +346,39 @@ def is_monotask(task_id, proc, runtime, status, priority, host, sequenceid): # p
     return procname in CFG_BIBTASK_MONOTASKS
 
 
+def get_task_metrics(proc=None, task_id=None, limit=20):
+    """Return the runtime metrics of the last limit runs of the tasks,
+    possibly only those of task proc (with or without its specific name)
+    or of task task_id, most recent first, as a list of dictionaries.
+    The throughput of the run is computed in 'records_per_second'."""
+    query = """SELECT id_schTASK, proc, host, started, status, wall_time,
+                      cpu_time, records, db_queries, db_time, sleep_time,
+                      rss_peak
+               FROM schTASKMETRICS"""
+    params = []
+    if task_id:
+        query += " WHERE id_schTASK=%s"
+        params.append(task_id)
+    elif proc:
+        query += " WHERE proc=%s OR proc LIKE %s"
+        params += [proc, proc + ':%']
+    query += " ORDER BY started DESC LIMIT %s"
+    params.append(limit)
+    metrics = run_sql(query, params, with_dict=True)
+    for run in metrics:
+        if run['wall_time'] > run['sleep_time']:
+            run['records_per_second'] = run['records'] / (run['wall_time'] - run['sleep_time'])
+        else:
+            run['records_per_second'] = 0.0
+    return metrics
+
+
+def get_task_resource_class(proc):
+    """Return the resource class (cpu, io, dbwrite...) of task proc."""
+    procname = proc.split(':')[0]
+    return CFG_BIBTASK_RESOURCE_CLASSES.get(procname, CFG_BIBTASK_DEFAULT_RESOURCE_CLASS)
+
+
 def stop_task(other_task_id, other_proc, other_priority, other_status, other_sequenceid): # pylint: disable=W0613
     Log("Send STOP signal to #%d (%s) which was in status %s" % (other_task_id, other_proc, other_status))
     bibsched_set_status(other_task_id, 'ABOUT TO STOP', other_status)
@@ -310,8 +398,8 @@ class Manager(object):
         self.curses = curses
         self.helper_modules = CFG_BIBTASK_VALID_TASKS
         self.running = 1
-        self.footer_auto_mode = "Automatic Mode [A Manual] [1/2/3 Display] [P Purge] [l/L Log] [O Opts] [E Edit motd] [Q Quit]"
-        self.footer_select_mode = "Manual Mode [A Automatic] [1/2/3 Display Type] [P Purge] [l/L Log] [O Opts] [E Edit motd] [Q Quit]"
+        self.footer_auto_mode = "Automatic Mode [A Manual] [1/2/3 Display] [P Purge] [l/L Log] [O Opts] [M Metrics] [E Edit motd] [Q Quit]"
+        self.footer_select_mode = "Manual Mode [A Automatic] [1/2/3 Display Type] [P Purge] [l/L Log] [O Opts] [M Metrics] [E Edit motd] [Q Quit]"
         self.footer_waiting_item = "[R Run] [D Delete] [N Priority]"
         self.footer_running_item = "[S Sleep] [T Stop] [K Kill]"
         self.footer_stopped_item = "[I Initialise] [D Delete] [K Acknowledge]"
@@ -356,6 +444,7 @@ class Manager(object):
                                            ord("q"), ord("Q"), ord("a"),
                                            ord("A"), ord("1"), ord("2"), ord("3"),
                                            ord("p"), ord("P"), ord("o"), ord("O"),
+                                           ord("m"), ord("M"),
                                            ord("l"), ord("L"), ord("e"), ord("E"))):
             self.display_in_footer("in automatic mode")
         else:
@@ -415,6 +504,8 @@ class Manager(object):
                 self.purge_done()
             elif char in (ord("o"), ord("O")):
                 self.display_task_options()
+            elif char in (ord("m"), ord("M")):
+                self.display_task_metrics()
             elif char in (ord("e"), ord("E")):
                 self.edit_motd()
                 self.read_motd()
@@ -518,7 +609,32 @@ class Manager(object):
             msg += 'executable : %s\n\n' % arguments[0]
             msg += ' arguments : %s\n\n' % ' '.join(arguments[1:])
         msg += '\n\nPress q to quit this panel...'
-        msg = wrap_text_in_a_box(msg, style='no_border')
+        self._display_panel(msg)
+
+    def display_task_metrics(self):
+        """Display the runtime metrics of the last runs of the current
+        task type."""
+        proc = self.currentrow[1]
+        metrics = get_task_metrics(proc=proc.split(':')[0], limit=10)
+        msg = 'Last runs of %s\n\n' % proc.split(':')[0]
+        msg += '%-16s %8s %8s %8s %8s %8s %8s %8s %7s\n' % (
+            'started', 'id', 'wall(s)', 'cpu(s)', 'rec/s',
+            'queries', 'db(s)', 'sleep(s)', 'rss(MB)')
+        for run in metrics:
+            msg += '%-16s %8s %8.1f %8.1f %8.1f %8d %8.1f %8.1f %7d\n' % (
+                run['started'].strftime("%Y-%m-%d %H:%M"),
+                run['id_schTASK'], run['wall_time'], run['cpu_time'],
+                run['records_per_second'], run['db_queries'],
+                run['db_time'], run['sleep_time'], run['rss_peak'] / 1024)
+        if not metrics:
+            msg += 'No metrics recorded yet.\n'
+        msg += '\n\nPress q to quit this panel...'
+        self._display_panel(msg, max_col=self.width - 4)
+
+    def _display_panel(self, msg, **args):
+        """Display msg in a panel until q is pressed.  Extra arguments
+        are passed to wrap_text_in_a_box()."""
+        msg = wrap_text_in_a_box(msg, style='no_border', **args)
         rows = msg.split('\n')
         height = len(rows) + 2
         width = max([len(row) for row in rows]) + 4
@@ -699,6 +815,7 @@ order to let this task run. The current priority is %s. New value:"
                 if run_sql("""UPDATE schTASK SET status='SCHEDULED', host=%s
                               WHERE id=%s and status='WAITING'""",
                            (self.hostname, task_id)):
+                    bibsched_notify_queue_change()
                     program = os.path.join(CFG_BINDIR, process)
                     command = "%s %s" % (program, str(task_id))
                     spawn_task(command)
@@ -1033,6 +1150,12 @@ class BibSched(object):
         self.active_tasks_all_nodes = ()
         self.mono_tasks_all_nodes = ()
         self.allowed_task_types = CFG_BIBSCHED_NODE_TASKS.get(self.hostname, CFG_BIBTASK_VALID_TASKS)
+        ## Number of tasks of each resource class this node can run
+        self.resource_slots = CFG_BIBSCHED_RESOURCE_SLOTS.get(self.hostname,
+                                    CFG_BIBSCHED_RESOURCE_SLOTS.get('*', {}))
+        ## Seconds until the runtime of the next waiting task is reached
+        self.next_runtime_delay = None
+        self.notification_socket = None
         os.environ['BIBSCHED_MODE'] = 'automatic'
 
     def tie_task_to_host(self, task_id):
@@ -1044,12 +1167,61 @@ class BibSched(object):
                           AND status='WAITING'""", (task_id, )):
             ## The task was already tied?
             return False
-        run_sql("""UPDATE schTASK SET host=%s, status='SCHEDULED'
-                   WHERE id=%s AND host='' AND status='WAITING'""",
-                (self.hostname, task_id))
+        if run_sql("""UPDATE schTASK SET host=%s, status='SCHEDULED'
+                      WHERE id=%s AND host='' AND status='WAITING'""",
+                   (self.hostname, task_id)):
+            bibsched_notify_queue_change()
         return bool(run_sql("SELECT id FROM schTASK WHERE id=%s AND host=%s",
                             (task_id, self.hostname)))
 
+    def open_notification_socket(self):
+        """Listen to the notifications of changes of the task queue sent
+        by bibsched_notify_queue_change() on this node."""
+        try:
+            if os.path.exists(CFG_BIBSCHED_NOTIFICATION_SOCKET):
+                os.remove(CFG_BIBSCHED_NOTIFICATION_SOCKET)
+            notification_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            notification_socket.bind(CFG_BIBSCHED_NOTIFICATION_SOCKET)
+            notification_socket.setblocking(0)
+            self.notification_socket = notification_socket
+        except (socket.error, OSError), err:
+            Log("Cannot listen to notifications on %s (%s), checking the queue every %s seconds" %
+                (CFG_BIBSCHED_NOTIFICATION_SOCKET, err, CFG_BIBSCHED_REFRESHTIME))
+
+    def close_notification_socket(self):
+        """Stop listening to the notifications and remove the socket."""
+        if self.notification_socket is None:
+            return
+        self.notification_socket.close()
+        self.notification_socket = None
+        try:
+            os.remove(CFG_BIBSCHED_NOTIFICATION_SOCKET)
+        except OSError:
+            pass
+
+    def wait_for_notification(self, timeout):
+        """Wait at most timeout seconds for a notification of change of
+        the task queue.  Return True if one was received."""
+        if timeout <= 0:
+            return False
+        if self.notification_socket is None:
+            time.sleep(timeout)
+            return False
+        try:
+            ready = select.select([self.notification_socket], [], [], timeout)[0]
+        except select.error:
+            ## Interrupted by a signal
+            return False
+        if not ready:
+            return False
+        ## Read all the pending notifications at once
+        try:
+            while True:
+                self.notification_socket.recv(64)
+        except socket.error:
+            pass
+        return True
+
     def filter_for_allowed_tasks(self):
         """ Removes all tasks that are not allowed in this Invenio instance
         """
@@ -1111,6 +1283,37 @@ class BibSched(object):
         else:
             return [], []
 
+    def get_used_resource_slots(self, resource_class):
+        """Return the active tasks of this node of the given resource
+        class."""
+        return [t for t in self.node_relevant_active_tasks
+                if t[5] == self.hostname and
+                    get_task_resource_class(t[1]) == resource_class]
+
+    def has_free_resource_slot(self, proc):
+        """Return True if this node has a free slot for the resource
+        class of task proc."""
+        resource_class = get_task_resource_class(proc)
+        slots = self.resource_slots.get(resource_class)
+        if slots is None:
+            return True
+        return len(self.get_used_resource_slots(resource_class)) < slots
+
+    def get_tasks_to_sleep_for_resource(self, proc, task_set):
+        """Among the task_set of lower priority tasks, return the list
+        of tasks to put to sleep to free a slot for the resource class
+        of task proc."""
+        resource_class = get_task_resource_class(proc)
+        candidates = [t for t in task_set
+                      if get_task_resource_class(t[1]) == resource_class]
+        if [t for t in candidates if t[3] == 'ABOUT TO SLEEP']:
+            ## A slot is already being freed
+            return []
+        candidates = [t for t in candidates if t[3] != 'SLEEPING']
+        if not candidates:
+            return []
+        return [min(candidates, key=lambda t: t[2])]
+
     def split_active_tasks_by_priority(self, task_id, priority):
         """Return two lists: the list of task_ids with lower priority and
         those with higher or equal priority."""
@@ -1186,6 +1389,7 @@ class BibSched(object):
                 if run_sql("""UPDATE schTASK SET priority=%s
                               WHERE status='WAITING' AND sequenceid=%s""",
                            (max_priority, sequenceid)):
+                    bibsched_notify_queue_change()
                     Log("Raised all waiting tasks with sequenceid "
                         "%s to the max priority %s" % (sequenceid, max_priority))
                     ## Some priorities where raised
@@ -1207,6 +1411,7 @@ class BibSched(object):
                         last_runtime = runtime
                 if runtimes_adjusted:
                     ## Some runtime have been adjusted
+                    bibsched_notify_queue_change()
                     return True
 
             if sequenceid is not None:
@@ -1249,6 +1454,20 @@ class BibSched(object):
                     Log("Cannot run because there are task to stop: %s and priority < 100" % tasks_to_stop)
                 return False
 
+            if not tasks_to_stop and not self.has_free_resource_slot(proc):
+                ## All the slots of the resource class of the task are
+                ## used: a lower priority task of the same class has to
+                ## make room, otherwise we wait.
+                tasks_to_sleep = self.get_tasks_to_sleep_for_resource(proc, lower)
+                if not tasks_to_sleep:
+                    if debug:
+                        Log("Cannot run because all the %s slots are used" % get_task_resource_class(proc))
+                    return False
+                for t in tasks_to_sleep:
+                    sleep_task(*t)
+                self.wait_for_notification(CFG_BIBSCHED_REFRESHTIME)
+                return True
+
             procname = proc.split(':')[0]
             if not tasks_to_stop and (not tasks_to_sleep or (proc not in CFG_BIBTASK_MONOTASKS and len(self.node_relevant_active_tasks) < CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS)):
                 if proc in CFG_BIBTASK_MONOTASKS and self.active_tasks_all_nodes:
@@ -1306,7 +1525,7 @@ class BibSched(object):
                             ## in order to avoid race conditions.
                             if count <= 0:
                                 raise StandardError("Process %s (task_id: %s) was launched but seems not to be able to reach RUNNING status." % (proc, task_id))
-                            time.sleep(CFG_BIBSCHED_REFRESHTIME)
+                            self.wait_for_notification(CFG_BIBSCHED_REFRESHTIME)
                             count -= 1
                     return True
                 else:
@@ -1320,14 +1539,17 @@ class BibSched(object):
                 for t in tasks_to_sleep:
                     sleep_task(*t)
 
-                time.sleep(CFG_BIBSCHED_REFRESHTIME)
+                self.wait_for_notification(CFG_BIBSCHED_REFRESHTIME)
                 return True
 
-    def check_errors(self):
-        errors = run_sql("""SELECT id,proc,status FROM schTASK
-                            WHERE status = 'ERROR'
-                            OR status = 'DONE WITH ERRORS'
-                            OR status = 'CERROR'""")
+    def check_errors(self, errors=None):
+        """Report the tasks in error, given as a list of (id, proc,
+        status), or read from the task queue if errors is None."""
+        if errors is None:
+            errors = run_sql("""SELECT id,proc,status FROM schTASK
+                                WHERE status = 'ERROR'
+                                OR status = 'DONE WITH ERRORS'
+                                OR status = 'CERROR'""")
         if errors:
             error_msgs = []
             error_recoverable = True
@@ -1348,22 +1570,34 @@ class BibSched(object):
                 else:
                     raise StandardError(msg)
 
+    def get_task_queue(self):
+        """Return the tasks BibSched has to care about, with a single
+        query: (id, proc, runtime, status, priority, host, sequenceid,
+        seconds until runtime) sorted by priority."""
+        return run_sql("""SELECT id, proc, runtime, status, priority, host, sequenceid,
+                                 UNIX_TIMESTAMP(runtime) - UNIX_TIMESTAMP()
+                          FROM schTASK WHERE status IN (%s)
+                          ORDER BY priority DESC, runtime ASC, id ASC""" %
+                       ', '.join(["'%s'" % status for status in
+                                  ('WAITING', 'SLEEPING') +
+                                  CFG_BIBSCHED_ACTIVE_STATUSES +
+                                  CFG_BIBSCHED_ERROR_STATUSES]))
+
     def calculate_rows(self):
         """Return all the node_relevant_active_tasks to work on."""
+        rows = self.get_task_queue()
         try:
-            self.check_errors()
+            self.check_errors([(row[0], row[1], row[3]) for row in rows
+                               if row[3] in CFG_BIBSCHED_ERROR_STATUSES])
         except RecoverableError, msg:
             register_emergency('Light emergency from %s: BibTask failed: %s' % (CFG_SITE_URL, msg))
 
-        max_bibupload_priority, min_bibupload_priority = run_sql(
-                    """SELECT MAX(priority), MIN(priority)
-                        FROM schTASK
-                        WHERE status IN ('WAITING', 'RUNNING', 'SLEEPING',
-                                'ABOUT TO STOP', 'ABOUT TO SLEEP',
-                                'SCHEDULED', 'CONTINUING')
-                        AND proc = 'bibupload'
-                        AND runtime <= NOW()""")[0]
-        if max_bibupload_priority > min_bibupload_priority:
+        bibupload_priorities = [row[4] for row in rows
+                                if row[1] == 'bibupload' and row[7] <= 0 and
+                                row[3] not in CFG_BIBSCHED_ERROR_STATUSES]
+        if bibupload_priorities and \
+                max(bibupload_priorities) > min(bibupload_priorities):
+            max_bibupload_priority = max(bibupload_priorities)
             run_sql(
                 """UPDATE schTASK SET priority = %s
                    WHERE status IN ('WAITING', 'RUNNING', 'SLEEPING',
@@ -1373,30 +1607,31 @@ class BibSched(object):
                    AND runtime <= NOW()
                    AND priority < %s""", (max_bibupload_priority,
                                           max_bibupload_priority))
+            bibsched_notify_queue_change()
+            rows = self.get_task_queue()
+
         ## The bibupload tasks are sorted by id, which means by the order they were scheduled
-        self.node_relevant_bibupload_tasks = run_sql(
-            """SELECT id, proc, runtime, status, priority, host, sequenceid
-               FROM schTASK WHERE status IN ('WAITING', 'SLEEPING')
-               AND proc = 'bibupload'
-               AND runtime <= NOW()
-               ORDER BY id ASC LIMIT 1""", n=1)
+        bibupload_tasks = [row[:7] for row in rows
+                           if row[3] in ('WAITING', 'SLEEPING') and
+                           row[1] == 'bibupload' and row[7] <= 0]
+        bibupload_tasks.sort()
+        self.node_relevant_bibupload_tasks = tuple(bibupload_tasks[:1])
         ## The other tasks are sorted by priority
-        self.node_relevant_waiting_tasks = run_sql(
-            """SELECT id, proc, runtime, status, priority, host, sequenceid
-               FROM schTASK WHERE (status='WAITING' AND runtime <= NOW())
-               OR status = 'SLEEPING'
-               ORDER BY priority DESC, runtime ASC, id ASC""")
-        self.node_relevant_sleeping_tasks = run_sql(
-            """SELECT id, proc, runtime, status, priority, host, sequenceid
-               FROM schTASK WHERE status = 'SLEEPING'
-               ORDER BY priority DESC, runtime ASC, id ASC""")
-        self.node_relevant_active_tasks = run_sql(
-            """SELECT id, proc, runtime, status, priority, host, sequenceid
-               FROM schTASK WHERE status IN ('RUNNING', 'CONTINUING',
-                                             'SCHEDULED', 'ABOUT TO STOP',
-                                             'ABOUT TO SLEEP')""")
+        self.node_relevant_waiting_tasks = tuple(
+            [row[:7] for row in rows
+             if (row[3] == 'WAITING' and row[7] <= 0) or row[3] == 'SLEEPING'])
+        self.node_relevant_sleeping_tasks = tuple(
+            [row[:7] for row in rows if row[3] == 'SLEEPING'])
+        self.node_relevant_active_tasks = tuple(
+            [row[:7] for row in rows if row[3] in CFG_BIBSCHED_ACTIVE_STATUSES])
         self.active_tasks_all_nodes = tuple(self.node_relevant_active_tasks)
         self.mono_tasks_all_nodes = tuple(t for t in self.node_relevant_waiting_tasks if is_monotask(*t))
+        ## When will the next waiting task be due?
+        delays = [row[7] for row in rows if row[3] == 'WAITING' and row[7] > 0]
+        if delays:
+            self.next_runtime_delay = float(min(delays))
+        else:
+            self.next_runtime_delay = None
         ## Remove tasks that can not be executed on this host
         self.filter_for_allowed_tasks()
 
@@ -1408,14 +1643,36 @@ class BibSched(object):
                    WHERE status = 'SCHEDULED'
                    AND host = %s""", (self.hostname, ))
 
+        self.open_notification_socket()
+        ## The queues are only recomputed when a change of the task
+        ## queue is notified, when a waiting task becomes due, every
+        ## CFG_BIBSCHED_REFRESHTIME seconds while tasks are running on
+        ## this node (to notice the ones that died) and at least every
+        ## CFG_BIBSCHED_MAX_IDLE_TIME seconds.
+        queue_version = None
+        next_cycle = 0
         try:
             while True:
+                if queue_version is not None:
+                    notified = self.wait_for_notification(
+                        min(CFG_BIBSCHED_REFRESHTIME, next_cycle - time.time()))
+                    if not notified and time.time() < next_cycle and \
+                            bibsched_get_queue_version() == queue_version:
+                        continue
                 if self.debug:
                     Log("New bibsched cycle")
+                queue_version = bibsched_get_queue_version()
                 self.calculate_rows()
+                next_cycle = time.time() + CFG_BIBSCHED_MAX_IDLE_TIME
+                if self.next_runtime_delay is not None:
+                    next_cycle = min(next_cycle, time.time() + self.next_runtime_delay)
+                if self.node_relevant_active_tasks:
+                    next_cycle = min(next_cycle, time.time() + CFG_BIBSCHED_REFRESHTIME)
                 ## Let's first handle running node_relevant_active_tasks.
                 for task in self.node_relevant_active_tasks:
                     if self.handle_task(*task):
+                        ## Something has changed
+                        queue_version = None
                         break
                 else:
                     # If nothing has changed we can go on to run tasks.
@@ -1425,12 +1682,12 @@ class BibSched(object):
                             ## which means we execute the first next bibupload.
                             if self.handle_task(*self.node_relevant_bibupload_tasks[0]):
                                 ## Something has changed
+                                queue_version = None
                                 break
                         elif self.handle_task(*task):
                             ## Something has changed
+                            queue_version = None
                             break
-                    else:
-                        time.sleep(CFG_BIBSCHED_REFRESHTIME)
         except Exception, err:
             register_exception(alert_admin=True)
             try:
@@ -1438,6 +1695,8 @@ class BibSched(object):
             except NotImplementedError:
                 pass
             raise
+        finally:
+            self.close_notification_socket()
 
 
 class TimedOutExc(Exception):
@@ -1631,6 +1890,11 @@ def halt(verbose=True, soft=False, debug=False): # pylint: disable=W0613
     if verbose:
         print "stopping bibsched: pid %d" % pid
     os.unlink(pidfile)
+    ## the killed bibsched could not remove its notification socket:
+    try:
+        os.remove(CFG_BIBSCHED_NOTIFICATION_SOCKET)
+    except OSError:
+        pass
 
 
 def monitor(verbose=True, debug=False): # pylint: disable=W0613
@@ -65,6 +65,43 @@ class SchTASK(db.Model):
                 server_default='0', index=True)
     sequenceid = db.Column(db.Integer(8), db.ForeignKey(SeqSTORE.id))
 
+class SchNOTIFY(db.Model):
+    """Represents a SchNOTIFY record."""
+    def __init__(self):
+        pass
+    __tablename__ = 'schNOTIFY'
+    name = db.Column(db.String(50), nullable=False, primary_key=True)
+    version = db.Column(db.Integer(15, unsigned=True), nullable=False,
+                server_default='0')
+    last_updated = db.Column(db.DateTime, nullable=False,
+                server_default='1900-01-01 00:00:00')
+
+class SchTASKMETRICS(db.Model):
+    """Represents a SchTASKMETRICS record."""
+    def __init__(self):
+        pass
+    __tablename__ = 'schTASKMETRICS'
+    id_schTASK = db.Column(db.Integer(15, unsigned=True), nullable=False,
+                primary_key=True, autoincrement=False)
+    proc = db.Column(db.String(255), nullable=False)
+    host = db.Column(db.String(255), nullable=False,
+                server_default='')
+    started = db.Column(db.DateTime, nullable=False, primary_key=True)
+    status = db.Column(db.String(50), nullable=True)
+    wall_time = db.Column(db.Float, nullable=False, server_default='0')
+    cpu_time = db.Column(db.Float, nullable=False, server_default='0')
+    records = db.Column(db.Integer(15, unsigned=True), nullable=False,
+                server_default='0')
+    db_queries = db.Column(db.Integer(15, unsigned=True), nullable=False,
+                server_default='0')
+    db_time = db.Column(db.Float, nullable=False, server_default='0')
+    sleep_time = db.Column(db.Float, nullable=False, server_default='0')
+    rss_peak = db.Column(db.Integer(15, unsigned=True), nullable=False,
+                server_default='0')
+    __table_args__ = (db.Index('proc', proc, started),
+                      db.Model.__table_args__)
 
 __all__ = ['HstTASK',
-           'SchTASK']
+           'SchTASK',
+           'SchNOTIFY',
+           'SchTASKMETRICS']
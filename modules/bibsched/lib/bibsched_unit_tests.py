@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for BibSched."""
+
+__revision__ = "$Id$"
+
+import os
+import shutil
+import tempfile
+import time
+
+from invenio.importutils import lazy_import
+from invenio.testutils import make_test_suite, run_test_suite, InvenioTestCase
+
+bibsched = lazy_import('invenio.bibsched')
+
+
+class TestNotifications(InvenioTestCase):
+    """Test the wake-up of BibSched on task queue notifications."""
+
+    def setUp(self):
+        """Listen to notifications on a temporary socket"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_socket_path = bibsched.CFG_BIBSCHED_NOTIFICATION_SOCKET
+        bibsched.CFG_BIBSCHED_NOTIFICATION_SOCKET = os.path.join(self.tmpdir, 'bibsched.sock')
+        self.sched = bibsched.BibSched.__new__(bibsched.BibSched)
+        self.sched.notification_socket = None
+        self.sched.open_notification_socket()
+
+    def tearDown(self):
+        """Remove the socket"""
+        self.sched.close_notification_socket()
+        bibsched.CFG_BIBSCHED_NOTIFICATION_SOCKET = self.old_socket_path
+        shutil.rmtree(self.tmpdir)
+
+    def test_wake_up(self):
+        """bibsched - wake-up by a notification"""
+        bibsched.bibsched_wake_up()
+        started = time.time()
+        self.failUnless(self.sched.wait_for_notification(10))
+        self.failUnless(time.time() - started < 5)
+
+    def test_notifications_are_read_at_once(self):
+        """bibsched - pending notifications wake up only once"""
+        for dummy in range(5):
+            bibsched.bibsched_wake_up()
+        self.failUnless(self.sched.wait_for_notification(10))
+        self.failIf(self.sched.wait_for_notification(0.1))
+
+    def test_timeout(self):
+        """bibsched - no wake-up without notification"""
+        self.failIf(self.sched.wait_for_notification(0.1))
+        self.failIf(self.sched.wait_for_notification(0))
+
+    def test_socket_removed(self):
+        """bibsched - notification socket removed when closed"""
+        self.failUnless(os.path.exists(bibsched.CFG_BIBSCHED_NOTIFICATION_SOCKET))
+        self.sched.close_notification_socket()
+        self.failIf(os.path.exists(bibsched.CFG_BIBSCHED_NOTIFICATION_SOCKET))
+        ## nobody is listening anymore, but notifying must not fail
+        bibsched.bibsched_wake_up()
+
+
+class TestResourceSlots(InvenioTestCase):
+    """Test the accounting of the resource slots of the tasks."""
+
+    def setUp(self):
+        """Create a scheduler running a bibupload"""
+        self.sched = bibsched.BibSched.__new__(bibsched.BibSched)
+        self.sched.hostname = 'node1'
+        self.sched.resource_slots = {'dbwrite': 1, 'io': 2}
+        self.sched.node_relevant_active_tasks = (
+            (1, 'bibupload', None, 'RUNNING', 0, 'node1', None),
+            (2, 'oaiharvest', None, 'RUNNING', 0, 'node1', None),
+            (3, 'oaiharvest:arxiv', None, 'RUNNING', 0, 'node2', None),
+            (4, 'bibindex', None, 'RUNNING', 0, 'node1', None))
+
+    def test_resource_classes(self):
+        """bibsched - resource class of the tasks"""
+        self.assertEqual('dbwrite', bibsched.get_task_resource_class('bibupload'))
+        self.assertEqual('io', bibsched.get_task_resource_class('oaiharvest:arxiv'))
+        self.assertEqual('cpu', bibsched.get_task_resource_class('bibindex:fulltext'))
+
+    def test_used_slots(self):
+        """bibsched - used resource slots of the node"""
+        self.assertEqual([1], [t[0] for t in self.sched.get_used_resource_slots('dbwrite')])
+        ## the task of the other node does not count
+        self.assertEqual([2], [t[0] for t in self.sched.get_used_resource_slots('io')])
+
+    def test_free_slots(self):
+        """bibsched - free resource slots of the node"""
+        self.failIf(self.sched.has_free_resource_slot('inveniogc'))
+        self.failUnless(self.sched.has_free_resource_slot('dbdump'))
+        ## no limit for the classes without slots
+        self.failUnless(self.sched.has_free_resource_slot('bibrank'))
+
+    def test_no_slots(self):
+        """bibsched - no resource class is limited by default"""
+        self.sched.resource_slots = {}
+        self.failUnless(self.sched.has_free_resource_slot('inveniogc'))
+
+    def test_tasks_to_sleep(self):
+        """bibsched - lower priority task put to sleep for a slot"""
+        ## (id, proc, priority, status, sequenceid)
+        task_set = [(1, 'bibupload', 3, 'RUNNING', None),
+                    (5, 'inveniogc', 1, 'RUNNING', None),
+                    (4, 'bibindex', 0, 'RUNNING', None)]
+        self.assertEqual([(5, 'inveniogc', 1, 'RUNNING', None)],
+                         self.sched.get_tasks_to_sleep_for_resource('bibupload', task_set))
+        ## a slot is already being freed
+        task_set[0] = (1, 'bibupload', 3, 'ABOUT TO SLEEP', None)
+        self.assertEqual([], self.sched.get_tasks_to_sleep_for_resource('bibupload', task_set))
+        ## sleeping tasks do not use their slot
+        task_set[0] = (1, 'bibupload', 3, 'SLEEPING', None)
+        task_set[1] = (5, 'inveniogc', 1, 'SLEEPING', None)
+        self.assertEqual([], self.sched.get_tasks_to_sleep_for_resource('bibupload', task_set))
+
+
+TEST_SUITE = make_test_suite(TestNotifications, TestResourceSlots, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
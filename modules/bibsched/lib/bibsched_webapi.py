@@ -20,6 +20,7 @@
 
 from invenio.config import CFG_SITE_URL, CFG_BINDIR, CFG_PREFIX
 from invenio.dbquery import run_sql
+from invenio.bibsched import get_task_metrics
 
 import os
 import subprocess
@@ -91,6 +92,16 @@ def get_bibsched_tasks():
                            'ABOUT TO SLEEP', 'DONE WITH ERRORS')")
     return waiting_tasks + other_tasks
 
+def get_bibsched_task_metrics(proc=None, task_id=None, limit=20):
+    """
+    Get the runtime metrics of the last runs of the tasks, ready to be
+    serialized in JSON
+    """
+    metrics = get_task_metrics(proc=proc, task_id=task_id, limit=limit)
+    for run in metrics:
+        run['started'] = run['started'].strftime("%Y-%m-%d %H:%M:%S")
+    return metrics
+
 def get_bibsched_mode():
     """
     Gets bibsched running mode: AUTOMATIC or MANUAL
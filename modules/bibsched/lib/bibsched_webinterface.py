@@ -33,11 +33,12 @@ else:
 
 from invenio.config import CFG_SITE_URL
 from invenio.access_control_engine import acc_authorize_action
-from invenio.webinterface_handler import WebInterfaceDirectory
+from invenio.webinterface_handler import WebInterfaceDirectory, wash_urlargd
 from invenio.bibrankadminlib import tupletotable
 from invenio.webpage import page
 from invenio.bibsched_webapi import get_javascript, get_bibsched_tasks, \
-                                    get_bibsched_mode, get_css, get_motd_msg
+                                    get_bibsched_mode, get_css, get_motd_msg, \
+                                    get_bibsched_task_metrics
 from invenio.webuser import page_not_authorized
 
 import time
@@ -45,7 +46,7 @@ import time
 class WebInterfaceBibSchedPages(WebInterfaceDirectory):
     """Defines the set of /bibsched pages."""
 
-    _exports = ['',]
+    _exports = ['', 'metrics']
 
     def __init__(self):
         """Initialize."""
@@ -104,3 +105,23 @@ class WebInterfaceBibSchedPages(WebInterfaceDirectory):
                         warnings    = [],
                         metaheaderadd = get_javascript() + get_css(),
                         req         = req)
+
+    def metrics(self, req, form):
+        """ Return in JSON the runtime metrics of the last task runs,
+        possibly only those of one task type (proc) or of one task (id)
+        """
+        argd = wash_urlargd(form, {'proc': (str, ''),
+                                   'id': (int, 0),
+                                   'limit': (int, 20)})
+        referer = '/admin2/bibsched/metrics'
+        navtrail = (' <a class="navtrail" href=\"%s/help/admin\">Admin Area</a> '
+            ) % CFG_SITE_URL
+        auth_code, auth_message = acc_authorize_action(req, 'cfgbibsched')
+        if auth_code != 0:
+            return page_not_authorized(req=req, referer=referer,
+                                       text=auth_message, navtrail=navtrail)
+        metrics = get_bibsched_task_metrics(proc=argd['proc'],
+                                            task_id=argd['id'],
+                                            limit=min(max(argd['limit'], 1), 1000))
+        req.content_type = 'application/json'
+        return json.dumps(metrics)
@@ -49,6 +49,7 @@ import marshal
 import os
 import pwd
 import re
+import resource
 import signal
 import sys
 import time
@@ -57,10 +58,12 @@ import traceback
 import logging
 import logging.handlers
 import random
+import multiprocessing
+from multiprocessing.util import Finalize
 
 from socket import gethostname
 
-from invenio.dbquery import run_sql, _db_login
+from invenio.dbquery import run_sql, _db_login, get_db_statistics
 from invenio.access_control_engine import acc_authorize_action
 from invenio.config import CFG_PREFIX, CFG_BINDIR, CFG_LOGDIR, \
     CFG_BIBSCHED_PROCESS_USER, CFG_TMPDIR, CFG_SITE_SUPPORT_EMAIL
@@ -70,14 +73,32 @@ from invenio.access_control_config import CFG_EXTERNAL_AUTH_USING_SSO, \
     CFG_EXTERNAL_AUTHENTICATION
 from invenio.webuser import get_user_preferences, get_email
 from invenio.bibtask_config import CFG_BIBTASK_VALID_TASKS, \
-    CFG_BIBTASK_DEFAULT_TASK_SETTINGS, CFG_BIBTASK_FIXEDTIMETASKS
+    CFG_BIBTASK_DEFAULT_TASK_SETTINGS, CFG_BIBTASK_FIXEDTIMETASKS, \
+    CFG_BIBTASK_STATUS_CHECK_INTERVAL, CFG_BIBTASK_LOCAL_STATUSES
 from invenio.dateutils import parse_runtime_limit
 from invenio.shellutils import escape_shell_arg
 from invenio.mailutils import send_email
 from invenio.bibsched import bibsched_set_host, \
-                             bibsched_get_host
+                             bibsched_get_host, \
+                             bibsched_notify_queue_change, \
+                             bibsched_wake_up
 
 
+# Time at which the task was last seen running by
+# task_sleep_now_if_required().
+_TASK_STATUS_CHECKED_AT = 0
+
+# Runtime metrics of the task that cannot be measured from outside,
+# stored in schTASKMETRICS by _task_run().
+_TASK_METRICS = {
+        'records': 0,
+        'sleep_time': 0.0,
+        }
+
+# Number of SQL queries run and seconds spent running them by the
+# worker processes of the task, shared with them, see task_init_worker().
+_TASK_WORKERS_DB_STATS = None
+
 # Global _TASK_PARAMS dictionary.
 _TASK_PARAMS = {
         'version': '',
@@ -281,6 +302,7 @@ def task_low_level_submission(name, user, *argv):
             runtime,sleeptime,status,progress,arguments,priority,sequenceid)
             VALUES (%s,%s,%s,%s,'WAITING',%s,%s,%s,%s)""",
             (name, user, runtime, sleeptime, verbose_argv[:254], marshal.dumps(argv), priority, sequenceid))
+        bibsched_notify_queue_change()
 
     except Exception:
         register_exception(alert_admin=True)
@@ -641,8 +663,14 @@ def task_update_status(val):
     """Updates status information in the BibSched task table."""
     write_message("Updating task status to %s." % val, verbose=9)
     if "task_id" in _TASK_PARAMS:
-        return run_sql("UPDATE schTASK SET status=%s where id=%s",
+        res = run_sql("UPDATE schTASK SET status=%s where id=%s",
             (val, _TASK_PARAMS["task_id"]))
+        if res:
+            if val in CFG_BIBTASK_LOCAL_STATUSES:
+                bibsched_wake_up()
+            else:
+                bibsched_notify_queue_change()
+        return res
 
 def task_read_status():
     """Read status information in the BibSched task table."""
@@ -699,11 +727,33 @@ def get_datetime(var, format_string="%Y-%m-%d %H:%M:%S", now=None):
     return date
 
 
+def task_add_processed_records(nb_records=1):
+    """Count nb_records more records processed by the task, in order to
+    report its throughput in schTASKMETRICS."""
+    _TASK_METRICS['records'] += nb_records
+
 def task_sleep_now_if_required(can_stop_too=False):
     """This function should be called during safe state of BibTask,
     e.g. after flushing caches or outside of run_sql calls.
     """
-    status = task_read_status()
+    started = time.time()
+    try:
+        _task_sleep_now_if_required(can_stop_too)
+    finally:
+        _TASK_METRICS['sleep_time'] += time.time() - started
+
+def _task_sleep_now_if_required(can_stop_too):
+    """Check the task status and sleep or stop if BibSched asked so."""
+    global _TASK_STATUS_CHECKED_AT
+    if time.time() - _TASK_STATUS_CHECKED_AT < CFG_BIBTASK_STATUS_CHECK_INTERVAL:
+        ## The task was running a moment ago: no need to ask again.
+        status = 'RUNNING'
+    else:
+        status = task_read_status()
+        if status in ('RUNNING', 'CONTINUING'):
+            _TASK_STATUS_CHECKED_AT = time.time()
+        else:
+            _TASK_STATUS_CHECKED_AT = 0
     write_message('Entering task_sleep_now_if_required with status=%s' % status, verbose=9)
     if status == 'ABOUT TO SLEEP':
         write_message("sleeping...")
@@ -843,6 +893,7 @@ def _task_submit(argv, authorization_action, authorization_msg):
                                          VALUES (%s,%s,%s,%s,'WAITING',%s,%s,%s,%s)""",
         (task_name, _TASK_PARAMS['user'], _TASK_PARAMS["runtime"],
          _TASK_PARAMS["sleeptime"], verbose_argv, marshal.dumps(argv), _TASK_PARAMS['priority'], _TASK_PARAMS['sequence-id']))
+    bibsched_notify_queue_change()
 
     ## update task number:
     write_message("Task #%d submitted." % _TASK_PARAMS['task_id'])
@@ -945,6 +996,7 @@ def _task_run(task_run_fnc):
                 ## Also postponing other dependent tasks.
                 run_sql("UPDATE schTASK SET runtime=%s, progress=%s WHERE sequenceid=%s AND status='WAITING'", (new_runtime, 'Postponed as task %s' % _TASK_PARAMS['task_id'], _TASK_PARAMS['sequence-id'])) # kwalitee: disable=sql
             run_sql("UPDATE schTASK SET runtime=%s, status='WAITING', progress=%s, host='' WHERE id=%s", (new_runtime, 'Postponed %d time(s)' % (postponed_times + 1), _TASK_PARAMS['task_id'])) # kwalitee: disable=sql
+            bibsched_notify_queue_change()
             write_message("Task #%d postponed because outside of runtime limit" % _TASK_PARAMS['task_id'])
             return True
 
@@ -973,6 +1025,11 @@ def _task_run(task_run_fnc):
     _TASK_PARAMS['task_starting_time'] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
     sleeptime = _TASK_PARAMS['sleeptime']
+    global _TASK_WORKERS_DB_STATS
+    _TASK_WORKERS_DB_STATS = multiprocessing.Array('d', 2)
+    metrics_started = (time.time(), resource.getrusage(resource.RUSAGE_SELF),
+                       resource.getrusage(resource.RUSAGE_CHILDREN),
+                       get_db_statistics())
     try:
         try:
             if callable(task_run_fnc) and task_run_fnc():
@@ -990,6 +1047,7 @@ def _task_run(task_run_fnc):
                 task_update_status("CERROR")
     finally:
         task_status = task_read_status()
+        _task_store_metrics(task_status, *metrics_started)
         if sleeptime:
             argv = _task_get_options(_TASK_PARAMS['task_id'], _TASK_PARAMS['task_name'])
             verbose_argv = 'Will execute: %s' % ' '.join([escape_shell_arg(str(arg)) for arg in argv])
@@ -1006,9 +1064,11 @@ def _task_run(task_run_fnc):
             if task_status == 'DONE':
                 ## It has finished in a good way. We recycle the database row
                 run_sql("UPDATE schTASK SET runtime=%s, status='WAITING', progress=%s, host='' WHERE id=%s", (new_runtime, verbose_argv, _TASK_PARAMS['task_id']))
+                bibsched_notify_queue_change()
                 write_message("Task #%d finished and resubmitted." % _TASK_PARAMS['task_id'])
             elif task_status == 'STOPPED':
                 run_sql("UPDATE schTASK SET status='WAITING', progress=%s, host='' WHERE id=%s", (verbose_argv, _TASK_PARAMS['task_id'], ))
+                bibsched_notify_queue_change()
                 write_message("Task #%d stopped and resubmitted." % _TASK_PARAMS['task_id'])
             else:
                 ## We keep the bad result and we resubmit with another id.
@@ -1039,6 +1099,64 @@ def _task_run(task_run_fnc):
             _TASKLETS[aux_tasklet.group(1)](**eval("dict(%s)" % (aux_tasklet.group(2))))
     return True
 
+def _task_store_metrics(status, started, usage_started, children_usage_started,
+                        db_stats_started):
+    """Store in schTASKMETRICS the runtime metrics of the task run that
+    started at the given time, resource usage of the task and of its
+    terminated child processes, and database statistics.  The metrics
+    of the worker processes are included provided they were started
+    with task_init_worker() and have exited."""
+    try:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        db_stats = get_db_statistics()
+        if _TASK_WORKERS_DB_STATS is not None:
+            db_stats['queries'] += int(_TASK_WORKERS_DB_STATS[0])
+            db_stats['time'] += _TASK_WORKERS_DB_STATS[1]
+        cpu_time = usage.ru_utime + usage.ru_stime - \
+            usage_started.ru_utime - usage_started.ru_stime + \
+            children_usage.ru_utime + children_usage.ru_stime - \
+            children_usage_started.ru_utime - children_usage_started.ru_stime
+        proc = _TASK_PARAMS['task_name']
+        if _TASK_PARAMS['task_specific_name']:
+            proc += ':' + _TASK_PARAMS['task_specific_name']
+        run_sql("""INSERT INTO schTASKMETRICS (id_schTASK, proc, host,
+                   started, status, wall_time, cpu_time, records, db_queries,
+                   db_time, sleep_time, rss_peak)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                (_TASK_PARAMS['task_id'], proc, gethostname(),
+                 time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+                 status, time.time() - started, cpu_time,
+                 _TASK_METRICS['records'],
+                 db_stats['queries'] - db_stats_started['queries'],
+                 db_stats['time'] - db_stats_started['time'],
+                 _TASK_METRICS['sleep_time'],
+                 max(usage.ru_maxrss, children_usage.ru_maxrss)))
+    except Exception:
+        ## Metrics are not worth failing the task.
+        register_exception()
+
+def task_init_worker():
+    """Initializer of the worker processes of the multiprocessing pools
+    of a task, e.g. Pool(processes=workers, initializer=task_init_worker):
+    the database statistics of a worker are added to the ones of the
+    task when the worker exits, so that they are stored in
+    schTASKMETRICS too.  The pool has to be closed and joined, not
+    terminated, for its workers to report."""
+    if _TASK_WORKERS_DB_STATS is None:
+        return
+    db_stats_started = get_db_statistics()
+    def report_db_statistics():
+        db_stats = get_db_statistics()
+        lock = _TASK_WORKERS_DB_STATS.get_lock()
+        lock.acquire()
+        try:
+            _TASK_WORKERS_DB_STATS[0] += db_stats['queries'] - db_stats_started['queries']
+            _TASK_WORKERS_DB_STATS[1] += db_stats['time'] - db_stats_started['time']
+        finally:
+            lock.release()
+    Finalize(None, report_db_statistics, exitpriority=10)
+
 def _usage(exitcode=1, msg="", help_specific_usage="", description=""):
     """Prints usage info."""
     if msg:
@@ -1086,6 +1204,7 @@ def _task_sig_sleep(sig, frame):
     write_message("sleeping as soon as possible...")
     _db_login(relogin=1)
     task_update_status("ABOUT TO SLEEP")
+    _reset_task_status_check()
 
 def _task_sig_stop(sig, frame):
     """Signal handler for the 'stop' signal sent by BibSched."""
@@ -1094,6 +1213,12 @@ def _task_sig_stop(sig, frame):
     write_message("stopping as soon as possible...")
     _db_login(relogin=1) # To avoid concurrency with an interrupted run_sql call
     task_update_status("ABOUT TO STOP")
+    _reset_task_status_check()
+
+def _reset_task_status_check():
+    """Make the next task_sleep_now_if_required() read the task status."""
+    global _TASK_STATUS_CHECKED_AT
+    _TASK_STATUS_CHECKED_AT = 0
 
 def _task_sig_suicide(sig, frame):
     """Signal handler for the 'suicide' signal sent by BibSched."""
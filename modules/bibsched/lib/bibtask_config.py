@@ -36,9 +36,40 @@ CFG_BIBTASK_VALID_TASKS = ("bibindex", "bibupload", "bibreformat",
 # Tasks that should be run as standalone task
 CFG_BIBTASK_MONOTASKS = ("bibupload", "dbdump", "inveniogc")
 
+# Resource class of each task: BibSched runs at most
+# CFG_BIBSCHED_RESOURCE_SLOTS[class] tasks of the same class at the
+# same time on a node.  'cpu' tasks mostly compute, 'io' tasks mostly
+# wait for files or for the network and 'dbwrite' tasks write heavily
+# into the database.
+CFG_BIBTASK_RESOURCE_CLASSES = {
+    'bibupload': 'dbwrite',
+    'batchuploader': 'dbwrite',
+    'oairepositoryupdater': 'dbwrite',
+    'inveniogc': 'dbwrite',
+    'bibauthorid': 'dbwrite',
+    'oaiharvest': 'io',
+    'dbdump': 'io',
+    'bibexport': 'io',
+    'bibcircd': 'io',
+    'bibtasklet': 'io',
+    'webstatadmin': 'io',
+}
+
+# Resource class of the tasks not listed above
+CFG_BIBTASK_DEFAULT_RESOURCE_CLASS = 'cpu'
+
 # Tasks that should be run during fixed times
 CFG_BIBTASK_FIXEDTIMETASKS = ("oaiharvest", )
 
+# Minimum number of seconds between two reads of the task status by
+# task_sleep_now_if_required()
+CFG_BIBTASK_STATUS_CHECK_INTERVAL = 1
+
+# Task statuses that only matter to the scheduler of the node running
+# the task (the task stays active): changing to them wakes it up, but
+# does not notify the schedulers of the other nodes
+CFG_BIBTASK_LOCAL_STATUSES = ('RUNNING', 'ABOUT TO SLEEP', 'ABOUT TO STOP')
+
 # Task that should not be reinstatiated
 CFG_BIBTASK_NON_REPETITIVE_TASK = ('bibupload', )
 
@@ -19,6 +19,7 @@
 
 """BibSort Engine"""
 
+import os
 import sys
 import time
 from invenio.dateutils import datetime, strftime
@@ -31,6 +32,7 @@ task_sleep_now_if_required
 from invenio.config import CFG_BIBSORT_BUCKETS, CFG_CERN_SITE
 from invenio.bibsort_washer import BibSortWasher, \
 InvenioBibSortWasherNotImplementedError
+from invenio.bibsort_rank_array import write_rank_array, get_rank_array_path
 
 import invenio.template
 websearch_templates = invenio.template.load('websearch')
@@ -38,6 +40,11 @@ websearch_templates = invenio.template.load('websearch')
 #The space distance between elements, to make inserts faster
 CFG_BIBSORT_WEIGHT_DISTANCE = 8
 
+#The method data is stored in bsrMETHODDATACHUNK by chunks of
+#this many consecutive recids, so that updates only rewrite the
+#chunks of the records that changed
+CFG_BIBSORT_DATA_CHUNK_SIZE = 100000
+
 
 def get_bibsort_methods_details(method_list = None):
     """Returns the id, definition, and washer for the methods in method_list.
@@ -287,7 +294,7 @@ def run_sorting_method(recids, method_name, method_id, definition, washer):
     sorted_data_list, sorted_data_dict = \
                 sort_dict(field_data_dictionary, CFG_BIBSORT_WEIGHT_DISTANCE, run_sorting_for_rnk, sorting_locale)
     executed = write_to_methoddata_table(method_id, field_data_dictionary, \
-                                         sorted_data_dict, sorted_data_list)
+                                         sorted_data_dict)
     if not executed:
         return False
     if CFG_BIBSORT_BUCKETS > 1:
@@ -305,30 +312,95 @@ def run_sorting_method(recids, method_name, method_id, definition, washer):
     return True
 
 
-def write_to_methoddata_table(id_method, data_dict, data_dict_ordered, data_list_sorted, update_timestamp=True):
-    """Serialize the date and write it to the bsrMETHODDATA"""
+def get_chunk_no(recid):
+    """Returns the number of the method data chunk of recid"""
+    return recid // CFG_BIBSORT_DATA_CHUNK_SIZE
+
+
+def split_into_chunks(data_dict, data_dict_ordered, chunk_numbers=None):
+    """Splits data_dict and data_dict_ordered into chunks of consecutive
+    recids. Returns a dictionary chunk_no: (data_dict, data_dict_ordered)
+    containing only the chunks in chunk_numbers, if given"""
+    chunks = {}
+    if chunk_numbers is not None:
+        for chunk_no in chunk_numbers:
+            chunks[chunk_no] = ({}, {})
+    for recid, value in data_dict.iteritems():
+        chunk_no = get_chunk_no(recid)
+        if chunk_numbers is None:
+            chunk = chunks.setdefault(chunk_no, ({}, {}))
+        elif chunk_no in chunks:
+            chunk = chunks[chunk_no]
+        else:
+            continue
+        chunk[0][recid] = value
+        chunk[1][recid] = data_dict_ordered[recid]
+    return chunks
+
+
+def get_methoddata(id_method):
+    """Returns the data_dict and data_dict_ordered of method id_method,
+    reassembled from its chunks, or (None, None) if the method has
+    no data"""
+    if not run_sql("SELECT id_bsrMETHOD FROM bsrMETHODDATA WHERE id_bsrMETHOD = %s", \
+                   (id_method, )):
+        return None, None
+    data_dict = {}
+    data_dict_ordered = {}
+    for chunk_dict, chunk_dict_ordered in run_sql("SELECT data_dict, data_dict_ordered \
+                                                  FROM bsrMETHODDATACHUNK \
+                                                  WHERE id_bsrMETHOD = %s", (id_method, )):
+        data_dict.update(deserialize_via_marshal(chunk_dict))
+        data_dict_ordered.update(deserialize_via_marshal(chunk_dict_ordered))
+    return data_dict, data_dict_ordered
+
+
+def write_to_methoddata_table(id_method, data_dict, data_dict_ordered, update_timestamp=True, chunk_numbers=None):
+    """Serialize the date and write it to the bsrMETHODDATACHUNK
+    (only the chunks in chunk_numbers, if given) and the timestamp to
+    bsrMETHODDATA"""
     write_message('Starting serializing the data..', verbose=5)
-    serialized_data_dict = serialize_via_marshal(data_dict)
-    serialized_data_dict_ordered = serialize_via_marshal(data_dict_ordered)
-    serialized_data_list_sorted = serialize_via_marshal(data_list_sorted)
+    serialized_chunks = {}
+    for chunk_no, (chunk_dict, chunk_dict_ordered) in \
+            split_into_chunks(data_dict, data_dict_ordered, chunk_numbers).iteritems():
+        if chunk_dict:
+            serialized_chunks[chunk_no] = (serialize_via_marshal(chunk_dict), \
+                                           serialize_via_marshal(chunk_dict_ordered))
+        else:
+            serialized_chunks[chunk_no] = None
     write_message('Serialization completed.', verbose=5)
     date = strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     if not update_timestamp:
         try:
-            date = run_sql('SELECT last_update from bsrMETHODDATA WHERE id_bsrMETHOD = %s', (id_method, ))[0][0]
-        except IndexError:
+            date = run_sql('SELECT last_updated from bsrMETHODDATA WHERE id_bsrMETHOD = %s', (id_method, ))[0][0]
+        except (IndexError, Error):
             pass # keep the generated date
+    write_message("Writing the rank array for method_id=%s" %id_method, verbose=5)
+    try:
+        write_rank_array(data_dict_ordered, get_rank_array_path(id_method), date)
+    except (IOError, OSError), err:
+        write_message("The error [%s] occured when writing the rank array " \
+                      "for method_id=%s" %(err, id_method), sys.stderr)
+        # the searches will read the weights from the database instead:
+        delete_rank_array(id_method)
     write_message("Starting writing the data for method_id=%s " \
-                  "to the database (table bsrMETHODDATA)" %id_method, verbose=5)
+                  "to the database (table bsrMETHODDATACHUNK)" %id_method, verbose=5)
     try:
-        write_message('Deleting old data..', verbose=5)
-        run_sql("DELETE FROM bsrMETHODDATA WHERE id_bsrMETHOD = %s", (id_method, ))
-        write_message('Inserting new data..', verbose=5)
-        run_sql("INSERT into bsrMETHODDATA \
-            (id_bsrMETHOD, data_dict, data_dict_ordered, data_list_sorted, last_updated) \
-            VALUES (%s, %s, %s, %s, %s)", \
-            (id_method, serialized_data_dict, serialized_data_dict_ordered, \
-             serialized_data_list_sorted, date, ))
+        if chunk_numbers is None:
+            write_message('Deleting old data..', verbose=5)
+            run_sql("DELETE FROM bsrMETHODDATACHUNK WHERE id_bsrMETHOD = %s", (id_method, ))
+        write_message('Writing %s chunks..' %len(serialized_chunks), verbose=5)
+        for chunk_no, serialized_chunk in serialized_chunks.iteritems():
+            if serialized_chunk is None:
+                run_sql("DELETE FROM bsrMETHODDATACHUNK \
+                        WHERE id_bsrMETHOD = %s AND chunk_no = %s", (id_method, chunk_no))
+            else:
+                run_sql("REPLACE into bsrMETHODDATACHUNK \
+                    (id_bsrMETHOD, chunk_no, data_dict, data_dict_ordered, last_updated) \
+                    VALUES (%s, %s, %s, %s, %s)", \
+                    (id_method, chunk_no, serialized_chunk[0], serialized_chunk[1], date))
+        run_sql("REPLACE into bsrMETHODDATA \
+            (id_bsrMETHOD, last_updated) VALUES (%s, %s)", (id_method, date))
     except Error, err:
         write_message("The error [%s] occured when inserting new bibsort data "\
                       "into bsrMETHODATA table" %err, sys.stderr)
@@ -348,9 +420,9 @@ def write_to_buckets_table(id_method, bucket_no, bucket_data, bucket_last_value,
     date = strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     if not update_timestamp:
         try:
-            date = run_sql('SELECT last_update from bsrMETHODDATABUCKET WHERE id_bsrMETHOD = %s and bucket_no = %s', \
+            date = run_sql('SELECT last_updated from bsrMETHODDATABUCKET WHERE id_bsrMETHOD = %s and bucket_no = %s', \
                            (id_method, bucket_no))[0][0]
-        except IndexError:
+        except (IndexError, Error):
             pass # keep the generated date
     try:
         write_message('Deleting old data.', verbose=5)
@@ -523,12 +595,21 @@ def get_modified_rnk_methods(rnk_method_list, bibsort_methods):
     return updated_ranking_methods, deleted_ranking_methods
 
 
+def delete_rank_array(method_id):
+    """Delete the rank array file of a method, if any."""
+    try:
+        os.remove(get_rank_array_path(method_id))
+    except OSError:
+        pass
+
 def delete_bibsort_data_for_method(method_id):
     """This method will delete all data asociated with a method
     from bibsort tables (except bsrMETHOD).
     Returns False in case some error occured, True otherwise"""
+    delete_rank_array(method_id)
     try:
         run_sql("DELETE FROM bsrMETHODDATA WHERE id_bsrMETHOD = %s", (method_id, ))
+        run_sql("DELETE FROM bsrMETHODDATACHUNK WHERE id_bsrMETHOD = %s", (method_id, ))
         run_sql("DELETE FROM bsrMETHODDATABUCKET WHERE id_bsrMETHOD = %s", (method_id, ))
     except:
         return False
@@ -539,8 +620,10 @@ def delete_all_data_for_method(method_id):
     from bibsort tables.
     Returns False in case some error occured, True otherwise"""
     method_name = 'method name'
+    delete_rank_array(method_id)
     try:
         run_sql("DELETE FROM bsrMETHODDATA WHERE id_bsrMETHOD = %s", (method_id, ))
+        run_sql("DELETE FROM bsrMETHODDATACHUNK WHERE id_bsrMETHOD = %s", (method_id, ))
         run_sql("DELETE FROM bsrMETHODDATABUCKET WHERE id_bsrMETHOD = %s", (method_id, ))
         run_sql("DELETE FROM bsrMETHODNAME WHERE id_bsrMETHOD = %s", (method_id, ))
         run_sql("DELETE FROM bsrMETHOD WHERE id = %s", (method_id, ))
@@ -577,13 +660,8 @@ def update_bibsort_tables(recids, method, update_timestamp = True):
         write_message('No sorting method called %s could be found ' \
                       'in bsrMETHOD table.' %method, sys.stderr)
         return False
-    res = run_sql("SELECT data_dict, data_dict_ordered, data_list_sorted \
-                  FROM bsrMETHODDATA where id_bsrMETHOD = %s", (method_id, ))
-    if res and res[0]:
-        data_dict = deserialize_via_marshal(res[0][0])
-        data_dict_ordered = {}
-        data_list_sorted = []
-    else:
+    data_dict, data_dict_ordered = get_methoddata(method_id)
+    if data_dict is None:
         write_message('No data could be found for the sorting method %s.' \
                       %method)
         return False #since this case should have been treated earlier
@@ -616,35 +694,49 @@ def update_bibsort_tables(recids, method, update_timestamp = True):
     recids_old_ordered = {}
 
     if recids_to_insert or recids_to_modify or recids_to_delete:
-        data_dict_ordered = deserialize_via_marshal(res[0][1])
-        data_list_sorted = deserialize_via_marshal(res[0][2])
+        data_list_sorted = sorted(data_dict_ordered, key=data_dict_ordered.__getitem__)
+        #old weights of the records moved to make space for the new ones
+        shifted_weights = {}
         if recids_to_modify:
             write_message("%s records have been modified." \
                           %len(recids_to_modify), verbose=5)
             for recid in recids_to_modify:
                 recids_old_ordered[recid] = data_dict_ordered[recid]
                 perform_modify_record(data_dict, data_dict_ordered, \
-                                data_list_sorted, field_data[recid], recid)
+                                data_list_sorted, field_data[recid], recid, \
+                                shifted_weights=shifted_weights)
         if recids_to_insert:
             write_message("%s records have been inserted." \
                           %len(recids_to_insert), verbose=5)
             for recid in recids_to_insert:
                 perform_insert_record(data_dict, data_dict_ordered, \
-                                data_list_sorted, field_data[recid], recid)
+                                data_list_sorted, field_data[recid], recid, \
+                                shifted_weights=shifted_weights)
         if recids_to_delete:
             write_message("%s records have been deleted." \
                           %len(recids_to_delete), verbose=5)
             for recid in recids_to_delete:
                 perform_delete_record(data_dict, data_dict_ordered, data_list_sorted, recid)
 
-        for recid in recids_to_modify:
-            recids_current_ordered[recid] = data_dict_ordered[recid]
+        #the shifted records change bucket like the modified ones
+        for recid, weight in shifted_weights.iteritems():
+            if recid in data_dict_ordered and recid not in recids_old_ordered \
+                   and recid not in recids_to_insert:
+                recids_old_ordered[recid] = weight
+        for recid in recids_old_ordered:
+            if recid in data_dict_ordered:
+                recids_current_ordered[recid] = data_dict_ordered[recid]
         for recid in recids_to_insert:
             recids_current_ordered[recid] = data_dict_ordered[recid]
+        write_message("%s records have been shifted." \
+                      %len(shifted_weights), verbose=5)
 
-        #write the modifications to db
+        #write only the chunks of the records that changed
+        chunk_numbers = set([get_chunk_no(recid) for recid in \
+                             recids_to_delete + recids_current_ordered.keys()])
         executed = write_to_methoddata_table(method_id, data_dict, \
-                                         data_dict_ordered, data_list_sorted, update_timestamp)
+                                         data_dict_ordered, update_timestamp, \
+                                         chunk_numbers)
         if not executed:
             return False
 
@@ -726,17 +818,19 @@ def perform_update_buckets(recids_current_ordered, recids_to_insert, recids_old_
             write_message("Updating bucket %s for method %s." %(bucket_no, method_id), verbose=5)
 
 
-def perform_modify_record(data_dict, data_dict_ordered, data_list_sorted, value, recid, spacing=CFG_BIBSORT_WEIGHT_DISTANCE):
+def perform_modify_record(data_dict, data_dict_ordered, data_list_sorted, value, recid, spacing=CFG_BIBSORT_WEIGHT_DISTANCE, shifted_weights=None):
     """Modifies all the data structures with the new information
     about the record"""
     #remove the recid from the old position, to make place for the new value
     data_list_sorted.remove(recid)
     # from now on, it is the same thing as insert
-    return perform_insert_record(data_dict, data_dict_ordered, data_list_sorted, value, recid, spacing)
+    return perform_insert_record(data_dict, data_dict_ordered, data_list_sorted, value, recid, spacing, shifted_weights)
 
 
-def perform_insert_record(data_dict, data_dict_ordered, data_list_sorted, value, recid, spacing=CFG_BIBSORT_WEIGHT_DISTANCE):
-    """Inserts a new record into all the data structures"""
+def perform_insert_record(data_dict, data_dict_ordered, data_list_sorted, value, recid, spacing=CFG_BIBSORT_WEIGHT_DISTANCE, shifted_weights=None):
+    """Inserts a new record into all the data structures.
+    The old weights of the other records whose weight had to be
+    changed to make space are stored in shifted_weights, if given"""
     #data_dict
     data_dict[recid] = value
     #data_dict_ordered & data_list_sorted
@@ -760,7 +854,7 @@ def perform_insert_record(data_dict, data_dict_ordered, data_list_sorted, value,
         if weight < 1: #there is no more space to insert, we have to create some space
             data_list_sorted.insert(index_for_insert, recid)
             data_dict_ordered[recid] = left_neighbor_weight + spacing
-            create_space_for_new_weight(index_for_insert, data_dict_ordered, data_list_sorted, spacing)
+            create_space_for_new_weight(index_for_insert, data_dict_ordered, data_list_sorted, spacing, shifted_weights)
         else:
             data_list_sorted.insert(index_for_insert, recid)
             data_dict_ordered[recid] = left_neighbor_weight + weight
@@ -780,14 +874,29 @@ def perform_delete_record(data_dict, data_dict_ordered, data_list_sorted, recid)
     return 1
 
 
-def create_space_for_new_weight(index_for_insert, data_dict_ordered, data_list_sorted, spacing):
+def create_space_for_new_weight(index_for_insert, data_dict_ordered, data_list_sorted, spacing, shifted_weights=None):
     """In order to keep an order of the records in data_dict_ordered, when a new
     weight is inserted, there needs to be some place for it
     (ex: recid3 needs to be inserted between recid1-with weight=10 and recid2-with weight=11)
-    The scope of this function is to increease the distance between recid1 and recid2
-    (and thus all the weights after recid2) so that recid3 will have an integer weight"""
-    for i in range(index_for_insert+1, len(data_list_sorted)):
-        data_dict_ordered[data_list_sorted[i]] += 2 * spacing
+    The scope of this function is to increase the weights of the records
+    following recid3, only as far as needed to keep the weights increasing,
+    so that updates touch as few records as possible"""
+    previous_weight = data_dict_ordered[data_list_sorted[index_for_insert]]
+    shift = None
+    for i in xrange(index_for_insert+1, len(data_list_sorted)):
+        recid = data_list_sorted[i]
+        weight = data_dict_ordered[recid]
+        if weight > previous_weight:
+            #the weights are increasing again, nothing more to shift
+            break
+        if shift is None:
+            #all the shifted records move by the same distance,
+            #which keeps the equal weights equal
+            shift = previous_weight - weight + spacing
+        if shifted_weights is not None and recid not in shifted_weights:
+            shifted_weights[recid] = weight
+        data_dict_ordered[recid] = weight + shift
+        previous_weight = data_dict_ordered[recid]
 
 
 def binary_search(sorted_list, value, data_dict):
@@ -27,6 +27,7 @@ binary_search = lazy_import('invenio.bibsort_engine:binary_search')
 perform_delete_record = lazy_import('invenio.bibsort_engine:perform_delete_record')
 perform_insert_record = lazy_import('invenio.bibsort_engine:perform_insert_record')
 perform_modify_record = lazy_import('invenio.bibsort_engine:perform_modify_record')
+split_into_chunks = lazy_import('invenio.bibsort_engine:split_into_chunks')
 
 
 class TestBibSort(InvenioTestCase):
@@ -162,6 +163,36 @@ class TestBibSort(InvenioTestCase):
         #testinsertion at the end
         self.assertEqual(0, binary_search(sorted_list, 'a', data_dict))
 
+    def test_perform_insert_record_without_space(self):
+        """bibsort - testing perform_insert_record when there is no space left"""
+        data_dict = {1:'b', 2:'c', 3:'d', 4:'e', 5:'g'}
+        data_dict_ordered = {1:8, 2:9, 3:10, 4:11, 5:40}
+        data_list_sorted = [1, 2, 3, 4, 5]
+        spacing = 8
+        shifted_weights = {}
+
+        # only the records up to the next free space are shifted
+        new_value = 'bb'
+        recid = 100
+        self.assertEqual(1, perform_insert_record(data_dict, data_dict_ordered, data_list_sorted, new_value, recid, spacing, shifted_weights))
+        self.assertEqual([1, 100, 2, 3, 4, 5], data_list_sorted)
+        self.assertEqual({1:8, 2:24, 3:25, 4:26, 5:40, 100:16}, data_dict_ordered)
+        self.assertEqual({2:9, 3:10, 4:11}, shifted_weights)
+
+    def test_split_into_chunks(self):
+        """bibsort - testing split_into_chunks"""
+        chunk_size = 100000
+        data_dict = {1:'a', 2:'b', chunk_size:'c', 3 * chunk_size + 1:'d'}
+        data_dict_ordered = {1:8, 2:16, chunk_size:24, 3 * chunk_size + 1:32}
+        self.assertEqual({0: ({1:'a', 2:'b'}, {1:8, 2:16}),
+                          1: ({chunk_size:'c'}, {chunk_size:24}),
+                          3: ({3 * chunk_size + 1:'d'}, {3 * chunk_size + 1:32})},
+                         split_into_chunks(data_dict, data_dict_ordered))
+        # the requested chunks are returned even when they became empty
+        self.assertEqual({1: ({chunk_size:'c'}, {chunk_size:24}),
+                          2: ({}, {})},
+                         split_into_chunks(data_dict, data_dict_ordered, [1, 2]))
+
 TEST_SUITE = make_test_suite(TestBibSort,
                              )
 
@@ -52,6 +52,20 @@ class BsrMETHODDATA(db.Model):
     last_updated = db.Column(db.DateTime)
 
 
+class BsrMETHODDATACHUNK(db.Model):
+    """Represents a BsrMETHODDATACHUNK record."""
+    __tablename__ = 'bsrMETHODDATACHUNK'
+
+    id_bsrMETHOD = db.Column(db.MediumInteger(9, unsigned=True),
+                    db.ForeignKey(BsrMETHOD.id), autoincrement=False,
+                    primary_key=True, nullable=False)
+    chunk_no = db.Column(db.Integer(11, unsigned=True), primary_key=True,
+                    nullable=False, autoincrement=False)
+    data_dict = db.Column(db.LargeBinary)
+    data_dict_ordered = db.Column(db.LargeBinary)
+    last_updated = db.Column(db.DateTime)
+
+
 class BsrMETHODDATABUCKET(db.Model):
     """Represents a BsrMETHODDATABUCKET record."""
     __tablename__ = 'bsrMETHODDATABUCKET'
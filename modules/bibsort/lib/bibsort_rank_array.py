@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+On-disk, memory-mapped BibSort weights.
+
+BibSort stores the weights of the records of every sorting method
+(recid -> weight, the data_dict_ordered) as marshalled dictionaries in
+bsrMETHODDATACHUNK, which every web worker used to load.  This module
+stores the same weights as a dense array indexed by recid:
+
+    header | weights[0..max_recid] | recids having a weight
+
+where the weights are 32-bit integers (the positions computed by
+BibSort) or doubles (the values of ranking methods), little-endian,
+and the recids having a weight are stored as a fastdumped intbitset.
+The files are mapped read-only, so that their pages are shared by all
+the processes of the node, and replaced by an atomic rename.
+
+The files are local to the node where BibSort runs, while the
+database stays the authority: the header holds the last_updated time
+of the bsrMETHODDATA row the weights were written with, and a file
+whose time differs is not used.  A mapping is released only when the
+last reference to it goes away, since other threads may still be
+reading it.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import sys
+import mmap
+import struct
+import tempfile
+from array import array
+
+try:
+    ## import optional module:
+    import numpy
+    CFG_NUMPY_IMPORTABLE = True
+except ImportError:
+    CFG_NUMPY_IMPORTABLE = False
+
+from invenio.config import CFG_CACHEDIR
+from invenio.intbitset import intbitset
+
+CFG_BIBSORT_RANK_ARRAY_DIR = os.path.join(CFG_CACHEDIR, 'bibsort')
+
+CFG_BIBSORT_RANK_ARRAY_MAGIC = 'INVBSRA2'
+CFG_BIBSORT_RANK_ARRAY_HEADER = '<8s19scxxxxII' # magic, last_updated, typecode, max_recid, keys length
+CFG_BIBSORT_RANK_ARRAY_HEADER_SIZE = struct.calcsize(CFG_BIBSORT_RANK_ARRAY_HEADER)
+
+## array typecode -> (item size, numpy dtype)
+CFG_BIBSORT_RANK_ARRAY_TYPECODES = {'i': (4, '<i4'),
+                                    'd': (8, '<f8')}
+
+
+class InvenioBibSortRankArrayError(Exception):
+    """Error raised for missing or corrupted rank array files."""
+    pass
+
+
+def get_rank_array_path(method_id):
+    """Return the path of the rank array file of sorting method 'method_id'."""
+    return os.path.join(CFG_BIBSORT_RANK_ARRAY_DIR, 'method_%s.bsr' % method_id)
+
+
+def _to_little_endian(arr):
+    """Swap bytes of array 'arr' in place if we are on a big-endian box."""
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+
+def write_rank_array(data_dict_ordered, path, last_updated):
+    """
+    Write the weights 'data_dict_ordered' (recid -> weight) into the
+    rank array file 'path', atomically replacing the previous one.
+
+    @param last_updated: last_updated time ('%Y-%m-%d %H:%M:%S') of
+        the bsrMETHODDATA row written with these weights
+    """
+    typecode = 'i'
+    for weight in data_dict_ordered.itervalues():
+        if not isinstance(weight, (int, long)) or \
+               not -2**31 <= weight < 2**31:
+            typecode = 'd'
+            break
+    max_recid = 0
+    if data_dict_ordered:
+        max_recid = max(data_dict_ordered)
+    weights = array(typecode, [0]) * (max_recid + 1)
+    for recid, weight in data_dict_ordered.iteritems():
+        weights[recid] = weight
+    keys = intbitset(data_dict_ordered.keys()).fastdump()
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp', dir=directory)
+    try:
+        tmp_file = os.fdopen(fd, 'wb')
+        try:
+            tmp_file.write(struct.pack(CFG_BIBSORT_RANK_ARRAY_HEADER,
+                                       CFG_BIBSORT_RANK_ARRAY_MAGIC,
+                                       str(last_updated), typecode,
+                                       max_recid, len(keys)))
+            tmp_file.write(_to_little_endian(weights).tostring())
+            tmp_file.write(keys)
+        finally:
+            tmp_file.close()
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class BibSortRankArray(object):
+    """
+    Read-only, memory-mapped BibSort weights.  It quacks like the
+    data_dict_ordered dictionary it replaces (get(), has_key(), ...).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        rank_file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(rank_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        finally:
+            rank_file.close()
+        if len(self._map) < CFG_BIBSORT_RANK_ARRAY_HEADER_SIZE:
+            raise InvenioBibSortRankArrayError("%s is truncated" % path)
+        magic, self.last_updated, self.typecode, self.max_recid, keys_length = struct.unpack(
+            CFG_BIBSORT_RANK_ARRAY_HEADER,
+            self._map[:CFG_BIBSORT_RANK_ARRAY_HEADER_SIZE])
+        if magic != CFG_BIBSORT_RANK_ARRAY_MAGIC or \
+               self.typecode not in CFG_BIBSORT_RANK_ARRAY_TYPECODES:
+            raise InvenioBibSortRankArrayError("%s is not a rank array" % path)
+        self._itemsize, self._dtype = CFG_BIBSORT_RANK_ARRAY_TYPECODES[self.typecode]
+        self._weights_start = CFG_BIBSORT_RANK_ARRAY_HEADER_SIZE
+        keys_start = self._weights_start + self._itemsize * (self.max_recid + 1)
+        if len(self._map) != keys_start + keys_length:
+            raise InvenioBibSortRankArrayError("%s is truncated" % path)
+        self.keys_intbitset = intbitset(self._map[keys_start:])
+        self._weights = None
+        if CFG_NUMPY_IMPORTABLE:
+            self._weights = numpy.frombuffer(self._map, dtype=self._dtype,
+                                             count=self.max_recid + 1,
+                                             offset=self._weights_start)
+
+    def get(self, recid, default=None):
+        if recid not in self.keys_intbitset:
+            return default
+        start = self._weights_start + self._itemsize * recid
+        return struct.unpack('<' + self.typecode,
+                             self._map[start:start + self._itemsize])[0]
+
+    def __getitem__(self, recid):
+        weight = self.get(recid)
+        if weight is None:
+            raise KeyError(recid)
+        return weight
+
+    def has_key(self, recid):
+        return recid in self.keys_intbitset
+
+    __contains__ = has_key
+
+    def keys(self):
+        return self.keys_intbitset.tolist()
+
+    def __len__(self):
+        return len(self.keys_intbitset)
+
+    def get_sorted_tail(self, recids, reverse=False, nb_records=None):
+        """
+        Sort the recids having a weight by weight (in descending
+        order if reverse), records of the same weight by ascending
+        recid, and return the last 'nb_records' of them (all of them
+        if None) together with their weights.
+        """
+        recids = intbitset(recids) & self.keys_intbitset
+        if nb_records is None or nb_records > len(recids):
+            nb_records = len(recids)
+        if not nb_records:
+            return [], []
+        if self._weights is None:
+            sorted_recids = sorted(recids, key=self.__getitem__, reverse=reverse)
+            sorted_recids = sorted_recids[len(sorted_recids) - nb_records:]
+            return sorted_recids, [self[recid] for recid in sorted_recids]
+        recids = numpy.fromiter(recids, dtype=numpy.intc, count=len(recids))
+        weights = self._weights[recids].astype(numpy.float64)
+        if nb_records < len(recids) and hasattr(numpy, 'partition'):
+            ## keep only the records that can be among the last ones
+            if reverse:
+                threshold = numpy.partition(weights, nb_records - 1)[nb_records - 1]
+                candidates = weights <= threshold
+            else:
+                threshold = numpy.partition(weights, len(weights) - nb_records)[len(weights) - nb_records]
+                candidates = weights >= threshold
+            recids = recids[candidates]
+            weights = weights[candidates]
+        if reverse:
+            order = numpy.lexsort((recids, -weights))
+        else:
+            order = numpy.lexsort((recids, weights))
+        order = order[len(order) - nb_records:]
+        sorted_recids = recids[order].tolist()
+        return sorted_recids, [self[recid] for recid in sorted_recids]
+
+
+def load_rank_array(path, last_updated):
+    """Return the BibSortRankArray stored in 'path', or None if there
+    is no valid rank array written with the bsrMETHODDATA row updated
+    at 'last_updated'."""
+    try:
+        rank_array = BibSortRankArray(path)
+    except (IOError, OSError, mmap.error, InvenioBibSortRankArrayError):
+        return None
+    if rank_array.last_updated != str(last_updated):
+        ## written for other weights, e.g. by a former run of BibSort
+        ## on this node
+        return None
+    return rank_array
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the memory-mapped BibSort weights."""
+
+__revision__ = "$Id$"
+
+import os
+import shutil
+import tempfile
+
+from invenio.importutils import lazy_import
+from invenio.testutils import make_test_suite, run_test_suite, InvenioTestCase
+
+bibsort_rank_array = lazy_import('invenio.bibsort_rank_array')
+
+
+class TestBibSortRankArray(InvenioTestCase):
+    """Test writing, reading and sorting with rank array files."""
+
+    def setUp(self):
+        """Write a small rank array"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'method_1.bsr')
+        self.weights = {2: 16, 3: 8, 5: 40, 8: 24, 9: 32}
+        bibsort_rank_array.write_rank_array(self.weights, self.path,
+                                            '2013-07-01 10:00:00')
+        self.rank_array = bibsort_rank_array.BibSortRankArray(self.path)
+
+    def tearDown(self):
+        """Remove the rank array"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_weights(self):
+        """bibsort rank array - weights lookup"""
+        for recid, weight in self.weights.items():
+            self.assertEqual(weight, self.rank_array[recid])
+        self.assertEqual(None, self.rank_array.get(4))
+        self.assertEqual(None, self.rank_array.get(100))
+        self.assertRaises(KeyError, self.rank_array.__getitem__, 1)
+        self.assertEqual([2, 3, 5, 8, 9], self.rank_array.keys())
+
+    def test_sorted_tail(self):
+        """bibsort rank array - sorting of the last records"""
+        self.assertEqual(([3, 2, 8, 9], [8, 16, 24, 32]),
+                         self.rank_array.get_sorted_tail([1, 2, 3, 8, 9]))
+        self.assertEqual(([8, 9], [24, 32]),
+                         self.rank_array.get_sorted_tail([1, 2, 3, 8, 9], nb_records=2))
+        self.assertEqual(([2, 3], [16, 8]),
+                         self.rank_array.get_sorted_tail([1, 2, 3, 8, 9], reverse=True,
+                                                         nb_records=2))
+        self.assertEqual(([], []), self.rank_array.get_sorted_tail([1, 4]))
+
+    def test_ranking_values(self):
+        """bibsort rank array - ties and float values of ranking methods"""
+        path = os.path.join(self.tmpdir, 'method_2.bsr')
+        bibsort_rank_array.write_rank_array({1: 0.5, 2: 2.5, 3: 0.5}, path,
+                                            '2013-07-01 10:00:00')
+        rank_array = bibsort_rank_array.BibSortRankArray(path)
+        self.assertEqual('d', rank_array.typecode)
+        self.assertEqual(([1, 3, 2], [0.5, 0.5, 2.5]),
+                         rank_array.get_sorted_tail([1, 2, 3]))
+        self.assertEqual(([2, 1, 3], [2.5, 0.5, 0.5]),
+                         rank_array.get_sorted_tail([1, 2, 3], reverse=True))
+
+    def test_invalid_file(self):
+        """bibsort rank array - missing or corrupted file"""
+        self.assertEqual(None, bibsort_rank_array.load_rank_array(
+            os.path.join(self.tmpdir, 'missing'), '2013-07-01 10:00:00'))
+        corrupted = os.path.join(self.tmpdir, 'corrupted')
+        open(corrupted, 'w').write('INVALID!' * 4)
+        self.assertEqual(None, bibsort_rank_array.load_rank_array(
+            corrupted, '2013-07-01 10:00:00'))
+
+    def test_outdated_file(self):
+        """bibsort rank array - file written for other weights"""
+        self.assertEqual('2013-07-01 10:00:00', self.rank_array.last_updated)
+        self.assertEqual([2, 3, 5, 8, 9], bibsort_rank_array.load_rank_array(
+            self.path, '2013-07-01 10:00:00').keys())
+        self.assertEqual(None, bibsort_rank_array.load_rank_array(
+            self.path, '2013-07-02 10:00:00'))
+
+
+TEST_SUITE = make_test_suite(TestBibSortRankArray, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -52,10 +52,18 @@ from invenio.config import CFG_OAI_ID_FIELD, \
 
 from invenio.jsonutils import json, CFG_JSON_AVAILABLE
 from invenio.bibupload_config import CFG_BIBUPLOAD_CONTROLFIELD_TAGS, \
-    CFG_BIBUPLOAD_SPECIAL_TAGS
+    CFG_BIBUPLOAD_SPECIAL_TAGS, \
+    CFG_BIBUPLOAD_BULK_CHUNK_SIZE, \
+    CFG_BIBUPLOAD_BIBXXX_ID_CACHE_SIZE, \
+    CFG_BIBUPLOAD_PARALLEL_CHUNK_SIZE, \
+    CFG_BIBUPLOAD_BIBXXX_LOCK_TIMEOUT, \
+    CFG_BIBUPLOAD_BIBXXX_LOCK_ATTEMPTS, \
+    InvenioBibUploadLockError
 from invenio.dbquery import run_sql, \
                             Error
 from invenio.bibrecord import create_records, \
+                              create_records_from_stream, \
+                              count_records_in_stream, \
                               record_add_field, \
                               record_delete_field, \
                               record_xml_output, \
@@ -70,7 +78,10 @@ from invenio.bibrecord import create_records, \
                               record_add_subfield_into, \
                               record_find_field, \
                               record_extract_oai_id, \
-                              record_extract_dois
+                              record_extract_dois, \
+                              _compare_fields, \
+                              _compare_lists
+from invenio.bibrecord_config import InvenioBibRecordParserError
 from invenio.search_engine import get_record
 from invenio.errorlib import register_exception
 from invenio.intbitset import intbitset
@@ -78,7 +89,8 @@ from invenio.urlutils import make_user_agent_string
 from invenio.config import CFG_BIBDOCFILE_FILEDIR
 from invenio.bibtask import task_init, write_message, \
     task_set_option, task_get_option, task_get_task_param, task_update_status, \
-    task_update_progress, task_sleep_now_if_required, fix_argv_paths
+    task_update_progress, task_sleep_now_if_required, fix_argv_paths, \
+    task_add_processed_records, task_init_worker
 from invenio.bibdocfile import BibRecDocs, file_strip_ext, normalize_format, \
     get_docname_from_url, check_valid_url, download_url, \
     KEEP_OLD_VALUE, decompose_bibdocfile_url, InvenioBibDocFileError, \
@@ -86,6 +98,7 @@ from invenio.bibdocfile import BibRecDocs, file_strip_ext, normalize_format, \
     BibRelation, MoreInfo
 
 from invenio.search_engine import search_pattern
+from invenio.websearch_cache import invalidate_search_results_cache
 
 #Statistic variables
 stat = {}
@@ -222,7 +235,8 @@ def bibupload(record, opt_tag=None, opt_mode=None,
             error = None
             write_message("   -Check if reference tags exist: DONE", verbose=2)
 
-    record_deleted_p = False
+    # True while the bibrec_bibxxx rows of the record are being updated:
+    record_metadata_dirty_p = False
     if opt_mode == 'insert' or \
     (opt_mode == 'replace_or_insert') and rec_id is None:
         insert_mode_p = True
@@ -315,13 +329,8 @@ def bibupload(record, opt_tag=None, opt_mode=None,
                     if code == CFG_OAI_PROVENANCE_ALTERED_SUBFIELD:
                         oai_provenance_field[0][i] = (code, 'true')
 
-        # now we clear all the rows from bibrec_bibxxx from the old
-        # record (they will be populated later (if needed) during
-        # stage 4 below):
-        delete_bibrec_bibxxx(rec_old, rec_id, pretend=pretend)
-
-        record_deleted_p = True
-        write_message("   -Clean bibrec_bibxxx: DONE", verbose=2)
+        # the rows of bibrec_bibxxx of the fields that have changed
+        # will be updated later (if needed) during stage 4 below.
     write_message("   -Stage COMPLETED", verbose=2)
 
 
@@ -424,7 +433,13 @@ def bibupload(record, opt_tag=None, opt_mode=None,
                             # OK, some formats like HB could not have been deleted, no big deal
                             pass
                 # archive MARCXML format of this record for version history purposes:
-                error = archive_marcxml_for_history(rec_id, pretend=pretend)
+                if insert_mode_p:
+                    affected_tags = get_affected_tags({}, record)
+                else:
+                    affected_tags = get_affected_tags(original_record, record)
+                write_message("   -Affected tags: %s" % ', '.join(affected_tags), verbose=2)
+                error = archive_marcxml_for_history(rec_id, affected_fields=affected_tags,
+                                                    pretend=pretend)
                 if error == 1:
                     msg = "   Failed to archive MARCXML for history"
                     write_message(msg, verbose=1, stream=sys.stderr)
@@ -439,8 +454,13 @@ def bibupload(record, opt_tag=None, opt_mode=None,
         if opt_stage_to_start_from <= 4:
             if opt_mode in ('insert', 'replace', 'replace_or_insert',
                 'append', 'correct', 'reference', 'delete'):
-                update_database_with_metadata(record, rec_id, oai_rec_id, pretend=pretend)
-                record_deleted_p = False
+                if insert_mode_p:
+                    update_database_with_metadata(record, rec_id, oai_rec_id, pretend=pretend)
+                else:
+                    record_metadata_dirty_p = True
+                    update_database_with_metadata_diff(record, original_record, rec_id,
+                                                       oai_rec_id, pretend=pretend)
+                    record_metadata_dirty_p = False
             else:
                 write_message("   -Stage NOT NEEDED in mode %s" % opt_mode,
                             verbose=2)
@@ -470,10 +490,10 @@ def bibupload(record, opt_tag=None, opt_mode=None,
         write_message("Record "+str(rec_id)+" DONE", verbose=1)
         return (0, int(rec_id), "")
     finally:
-        if record_deleted_p:
-            ## BibUpload has failed living the record deleted. We should
-            ## back the original record then.
-            update_database_with_metadata(original_record, rec_id, oai_rec_id, pretend=pretend)
+        if record_metadata_dirty_p:
+            ## BibUpload has failed leaving the record half updated. We
+            ## should back the original record then.
+            update_database_with_metadata_diff(original_record, record, rec_id, oai_rec_id, pretend=pretend)
             write_message("   Restored original record", verbose=1, stream=sys.stderr)
 
 def record_is_valid(record):
@@ -623,6 +643,33 @@ def xml_marc_to_records(xml_marc):
         recs = map((lambda x:x[0]), recs)
         return recs
 
+def xml_marc_file_to_records(path):
+    """Return the tuple (records, number of records) of the MARCXML
+    file PATH.  Well-formed documents are checked and their records
+    counted by a first incremental parsing; the records are then
+    generated one by one by a second one, so that the file is never
+    held in memory.  Files that are not well-formed XML documents
+    (e.g. records without enclosing collection) are read and parsed
+    as a whole, and their records are returned as a list."""
+    try:
+        nb_records = count_records_in_stream(path)
+    except (IOError, InvenioBibRecordParserError):
+        nb_records = 0
+    if not nb_records:
+        # let the usual parser cope with the file and report errors:
+        recs = xml_marc_to_records(open_marc_file(path))
+        return recs, len(recs)
+
+    def generate_records():
+        for rec, dummy, errors in create_records_from_stream(path, 1, 1):
+            if errors:
+                write_message("   Warning: record %s is not valid: %s" %
+                              (record_extract_oai_id(rec),
+                               '; '.join([str(error) for error in errors])),
+                              verbose=2, stream=sys.stderr)
+            yield rec
+    return generate_records(), nb_records
+
 def find_record_format(rec_id, bibformat):
     """Look whether record REC_ID is formatted in FORMAT,
        i.e. whether FORMAT exists in the bibfmt table for this record.
@@ -2197,10 +2244,12 @@ def delete_bibfmt_format(id_bibrec, format_name, pretend=False):
         run_sql("DELETE LOW_PRIORITY FROM bibfmt WHERE id_bibrec=%s and format=%s", (id_bibrec, format_name))
     return 0
 
-def archive_marcxml_for_history(recID, pretend=False):
+def archive_marcxml_for_history(recID, affected_fields=None, pretend=False):
     """
     Archive current MARCXML format of record RECID from BIBFMT table
     into hstRECORD table.  Useful to keep MARCXML history of records.
+    AFFECTED_FIELDS is the list of tags that have changed with respect
+    to the previous revision, see get_affected_tags().
 
     Return 0 if everything went fine.  Return 1 otherwise.
     """
@@ -2208,18 +2257,35 @@ def archive_marcxml_for_history(recID, pretend=False):
         res = run_sql("SELECT id_bibrec, value, last_updated FROM bibfmt WHERE format='xm' AND id_bibrec=%s",
                       (recID,))
         if res and not pretend:
-            run_sql("""INSERT INTO hstRECORD (id_bibrec, marcxml, job_id, job_name, job_person, job_date, job_details)
-                                      VALUES (%s,%s,%s,%s,%s,%s,%s)""",
+            run_sql("""INSERT INTO hstRECORD (id_bibrec, marcxml, job_id, job_name, job_person, job_date, job_details, affected_fields)
+                                      VALUES (%s,%s,%s,%s,%s,%s,%s,%s)""",
                     (res[0][0], res[0][1], task_get_task_param('task_id', 0), 'bibupload', task_get_task_param('user','UNKNOWN'), res[0][2],
-                     'mode: ' + task_get_option('mode','UNKNOWN') + '; file: ' + task_get_option('file_path','UNKNOWN') + '.'))
+                     'mode: ' + task_get_option('mode','UNKNOWN') + '; file: ' + task_get_option('file_path','UNKNOWN') + '.',
+                     ','.join(affected_fields or [])))
     except Error, error:
         write_message("   Error during archive_marcxml_for_history: %s " % error,
                       verbose=1, stream=sys.stderr)
         return 1
     return 0
 
-def update_database_with_metadata(record, rec_id, oai_rec_id = "oai", pretend=False):
-    """Update the database tables with the record and the record id given in parameter"""
+def get_affected_tags(old_record, new_record):
+    """Return the sorted list of the tags whose fields differ between
+    OLD_RECORD and NEW_RECORD.  Special tags and the 001 and 005
+    controlfields are not taken into account."""
+    affected_tags = []
+    for tag in dict.fromkeys(old_record.keys() + new_record.keys()):
+        if tag in ('001', '005') or tag in CFG_BIBUPLOAD_SPECIAL_TAGS:
+            continue
+        if not _compare_lists(old_record.get(tag, []), new_record.get(tag, []),
+                              _compare_fields):
+            affected_tags.append(tag)
+    affected_tags.sort()
+    return affected_tags
+
+def get_bibxxx_entries(record):
+    """Return the list of (full tag, value, field number) of RECORD that
+    are stored into the bibxxx tables."""
+    entries = []
     for tag in record.keys():
         # check if tag is not a special one:
         if tag not in CFG_BIBUPLOAD_SPECIAL_TAGS:
@@ -2244,26 +2310,12 @@ def update_database_with_metadata(record, rec_id, oai_rec_id = "oai", pretend=Fa
                     tag_list.append(ind2)
                 datafield_number = single_tuple[4]
 
-                if tag in CFG_BIBUPLOAD_SPECIAL_TAGS:
-                    # nothing to do for special tags (FFT, FMT)
-                    pass
-                elif tag in CFG_BIBUPLOAD_CONTROLFIELD_TAGS and tag != "001":
+                if tag in CFG_BIBUPLOAD_CONTROLFIELD_TAGS and tag != "001":
                     value = single_tuple[3]
                     # get the full tag
                     full_tag = ''.join(tag_list)
-
-                    # update the tables
-                    write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
-                    # insert the tag and value into into bibxxx
-                    (table_name, bibxxx_row_id) = insert_record_bibxxx(full_tag, value, pretend=pretend)
-                    #print 'tname, bibrow', table_name, bibxxx_row_id;
-                    if table_name is None or bibxxx_row_id is None:
-                        write_message("   Failed : during insert_record_bibxxx", verbose=1, stream=sys.stderr)
-                    # connect bibxxx and bibrec with the table bibrec_bibxxx
-                    res = insert_record_bibrec_bibxxx(table_name, bibxxx_row_id, datafield_number, rec_id, pretend=pretend)
-                    if res is None:
-                        write_message("   Failed : during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
-                else:
+                    entries.append((full_tag, value, datafield_number))
+                elif tag not in CFG_BIBUPLOAD_CONTROLFIELD_TAGS:
                     # get the tag and value from the content of each subfield
                     for subfield in subfield_list:
                         subtag = subfield[0]
@@ -2271,25 +2323,199 @@ def update_database_with_metadata(record, rec_id, oai_rec_id = "oai", pretend=Fa
                         tag_list.append(subtag)
                         # get the full tag
                         full_tag = ''.join(tag_list)
-                        # update the tables
-                        write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
-                        # insert the tag and value into into bibxxx
-                        (table_name, bibxxx_row_id) = insert_record_bibxxx(full_tag, value, pretend=pretend)
-                        if table_name is None or bibxxx_row_id is None:
-                            write_message("   Failed : during insert_record_bibxxx", verbose=1, stream=sys.stderr)
-                        # connect bibxxx and bibrec with the table bibrec_bibxxx
-                        res = insert_record_bibrec_bibxxx(table_name, bibxxx_row_id, datafield_number, rec_id, pretend=pretend)
-                        if res is None:
-                            write_message("   Failed : during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
+                        entries.append((full_tag, value, datafield_number))
                         # remove the subtag from the list
                         tag_list.pop()
                 tag_list.pop()
                 tag_list.pop()
             tag_list.pop()
+    return entries
+
+def update_database_with_metadata(record, rec_id, oai_rec_id = "oai", pretend=False):
+    """Update the database tables with the record and the record id given in parameter"""
+    entries = get_bibxxx_entries(record)
+    for full_tag, value, dummy in entries:
+        write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
+    # update the tables
+    insert_record_bibxxx_entries(entries, rec_id, pretend=pretend)
     write_message("   -Update the database with metadata : DONE", verbose=2)
 
     log_record_uploading(oai_rec_id, task_get_task_param('task_id', 0), rec_id, 'P', pretend=pretend)
 
+def update_database_with_metadata_diff(record, old_record, rec_id, oai_rec_id = "oai", pretend=False):
+    """Update the database tables of the existing record REC_ID, that
+    used to be OLD_RECORD, with RECORD.  The bibrec_bibxxx rows of the
+    record are compared with the ones RECORD should have, field
+    instance by field instance, and only the field instances that
+    differ are deleted and inserted again."""
+    entries = get_bibxxx_entries(record)
+    new_fields = {} # field number -> list of (full tag, value)
+    for full_tag, value, field_number in entries:
+        new_fields.setdefault(field_number, []).append((full_tag, value))
+    table_names = dict.fromkeys(['bib' + tag[0:2] + 'x'
+                                 for tag in old_record.keys() + record.keys()
+                                 if tag not in CFG_BIBUPLOAD_SPECIAL_TAGS]).keys()
+    try:
+        stored_fields = {} # field number -> list of (full tag, value)
+        stored_tables = {} # field number -> list of table names
+        for table_name in table_names:
+            query = """SELECT b.tag, b.value, bb.field_number
+                         FROM bibrec_%s AS bb, %s AS b
+                        WHERE bb.id_bibrec=%%s AND bb.id_bibxxx=b.id""" % \
+                    (table_name, table_name)
+            for full_tag, value, field_number in run_sql(query, (rec_id, )):
+                stored_fields.setdefault(field_number, []).append((full_tag, value))
+                stored_tables.setdefault(field_number, []).append(table_name)
+
+        changed_field_numbers = {}
+        fields_to_delete = {} # table name -> field numbers
+        for field_number in dict.fromkeys(new_fields.keys() + stored_fields.keys()):
+            stored_field = stored_fields.get(field_number, [])
+            stored_field.sort()
+            new_field = new_fields.get(field_number, [])
+            new_field.sort()
+            if stored_field != new_field:
+                changed_field_numbers[field_number] = True
+                for table_name in dict.fromkeys(stored_tables.get(field_number, [])):
+                    fields_to_delete.setdefault(table_name, []).append(field_number)
+
+        if not pretend:
+            for table_name, field_numbers in fields_to_delete.iteritems():
+                for i in xrange(0, len(field_numbers), CFG_BIBUPLOAD_BULK_CHUNK_SIZE):
+                    chunk = field_numbers[i:i + CFG_BIBUPLOAD_BULK_CHUNK_SIZE]
+                    run_sql("DELETE FROM bibrec_%s WHERE id_bibrec=%%s AND field_number IN (%s)" % \
+                            (table_name, ','.join(['%s'] * len(chunk))), [rec_id] + chunk)
+    except Error, error:
+        write_message("   Error during the update_database_with_metadata_diff function : %s, rewriting all the fields"
+            % error, verbose=1, stream=sys.stderr)
+        delete_bibrec_bibxxx(old_record, rec_id, pretend=pretend)
+        delete_bibrec_bibxxx(record, rec_id, pretend=pretend)
+        changed_field_numbers = new_fields
+
+    entries = [entry for entry in entries if entry[2] in changed_field_numbers]
+    for full_tag, value, dummy in entries:
+        write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
+    # update the tables
+    insert_record_bibxxx_entries(entries, rec_id, pretend=pretend)
+    write_message("   -Update the database with metadata (%s out of %s fields changed) : DONE" %
+                  (len(changed_field_numbers), len(new_fields)), verbose=2)
+
+    log_record_uploading(oai_rec_id, task_get_task_param('task_id', 0), rec_id, 'P', pretend=pretend)
+
+## (table name, tag, value) -> bibxxx row id, see get_bibxxx_ids():
+bibxxx_ids_cache = {}
+
+def get_bibxxx_ids(table_name, tag_values, pretend=False):
+    """Return dictionary (tag, value) -> bibxxx row id for the list of
+    (tag, value) pairs TAG_VALUES of bibxxx table TABLE_NAME.  The
+    pairs that are not in the table yet are inserted.  Lookups and
+    insertions are done with a few queries for all the pairs, and the
+    ids found are cached."""
+    ids = {}
+    missing = []
+    for tag_value in tag_values:
+        if tag_value in ids:
+            continue
+        row_id = bibxxx_ids_cache.get((table_name, ) + tag_value)
+        if row_id is None:
+            ids[tag_value] = None
+            missing.append(tag_value)
+        else:
+            ids[tag_value] = row_id
+
+    def lookup(tag_values):
+        """Look up the ids of TAG_VALUES.  As in insert_record_bibxxx(),
+        values are compared in Python to get binary equality."""
+        wanted = dict.fromkeys(tag_values)
+        tags = dict.fromkeys([tag for tag, dummy in tag_values]).keys()
+        values = dict.fromkeys([value for dummy, value in tag_values]).keys()
+        for i in xrange(0, len(values), CFG_BIBUPLOAD_BULK_CHUNK_SIZE):
+            chunk = values[i:i + CFG_BIBUPLOAD_BULK_CHUNK_SIZE]
+            query = "SELECT id,tag,value FROM %s WHERE tag IN (%s) AND value IN (%s)" % \
+                    (table_name, ','.join(['%s'] * len(tags)), ','.join(['%s'] * len(chunk)))
+            for row_id, tag, value in run_sql(query, tags + chunk):
+                if (tag, value) in wanted and ids[(tag, value)] is None:
+                    ids[(tag, value)] = row_id
+
+    lookup(missing)
+    missing = [tag_value for tag_value in missing if ids[tag_value] is None]
+    if missing:
+        if pretend:
+            for tag_value in missing:
+                ids[tag_value] = 1
+            return ids
+        # several bibupload processes may be running (see --workers):
+        # make sure that they do not insert the same value twice
+        lock_name = 'bibupload_%s' % table_name
+        for dummy in xrange(CFG_BIBUPLOAD_BIBXXX_LOCK_ATTEMPTS):
+            res = run_sql("SELECT GET_LOCK(%s, %s)", (lock_name, CFG_BIBUPLOAD_BIBXXX_LOCK_TIMEOUT))
+            if res and res[0][0] == 1:
+                break
+            write_message("   Waiting for the lock %s" % lock_name, verbose=2)
+        else:
+            # not an Error, so that the values are not inserted one
+            # by one without the lock:
+            raise InvenioBibUploadLockError("could not acquire the lock %s" % lock_name)
+        try:
+            lookup(missing)
+            missing = [tag_value for tag_value in missing if ids[tag_value] is None]
+            for i in xrange(0, len(missing), CFG_BIBUPLOAD_BULK_CHUNK_SIZE):
+                chunk = missing[i:i + CFG_BIBUPLOAD_BULK_CHUNK_SIZE]
+                params = []
+                for tag_value in chunk:
+                    params.extend(tag_value)
+                run_sql("INSERT INTO %s (tag, value) VALUES %s" % \
+                        (table_name, ','.join(['(%s,%s)'] * len(chunk))), params)
+            # fetch the ids of the new rows:
+            lookup(missing)
+        finally:
+            run_sql("SELECT RELEASE_LOCK(%s)", (lock_name, ))
+
+    if len(bibxxx_ids_cache) > CFG_BIBUPLOAD_BIBXXX_ID_CACHE_SIZE:
+        bibxxx_ids_cache.clear()
+    for tag_value, row_id in ids.iteritems():
+        if row_id is not None:
+            bibxxx_ids_cache[(table_name, ) + tag_value] = row_id
+    return ids
+
+def insert_record_bibxxx_entries(entries, rec_id, pretend=False):
+    """Insert ENTRIES, a list of (tag, value, field number) of record
+    REC_ID, into the bibxxx and bibrec_bibxxx tables with a few queries
+    per table.  In case of error, the entries of the table that are
+    left are inserted one by one."""
+    entries_by_table = {}
+    for entry in entries:
+        entries_by_table.setdefault('bib' + entry[0][0:2] + 'x', []).append(entry)
+
+    for table_name, table_entries in entries_by_table.iteritems():
+        nb_done = 0
+        try:
+            ids = get_bibxxx_ids(table_name, [(tag, value) for tag, value, dummy in table_entries],
+                                 pretend=pretend)
+            for i in xrange(0, len(table_entries), CFG_BIBUPLOAD_BULK_CHUNK_SIZE):
+                chunk = table_entries[i:i + CFG_BIBUPLOAD_BULK_CHUNK_SIZE]
+                params = []
+                for tag, value, field_number in chunk:
+                    if ids[(tag, value)] is None:
+                        raise Error("no id found for the tag %s with the value %s" % (tag, value))
+                    params.extend((rec_id, ids[(tag, value)], field_number))
+                if not pretend:
+                    run_sql("INSERT INTO bibrec_%s (id_bibrec,id_bibxxx,field_number) VALUES %s" % \
+                            (table_name, ','.join(['(%s,%s,%s)'] * len(chunk))), params)
+                nb_done += len(chunk)
+        except Error, error:
+            write_message("   Error during the insert_record_bibxxx_entries function : %s "
+                % error, verbose=1, stream=sys.stderr)
+            for tag, value, field_number in table_entries[nb_done:]:
+                # insert the tag and value into into bibxxx
+                (bibxxx_table, bibxxx_row_id) = insert_record_bibxxx(tag, value, pretend=pretend)
+                if bibxxx_table is None or bibxxx_row_id is None:
+                    write_message("   Failed : during insert_record_bibxxx", verbose=1, stream=sys.stderr)
+                # connect bibxxx and bibrec with the table bibrec_bibxxx
+                res = insert_record_bibrec_bibxxx(bibxxx_table, bibxxx_row_id, field_number, rec_id, pretend=pretend)
+                if res is None:
+                    write_message("   Failed : during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
+
 def append_new_tag_to_old_record(record, rec_old, opt_tag, opt_mode):
     """Append new tags to a old record"""
 
@@ -2486,6 +2712,9 @@ Examples:
   -n, --notimechange\tdo not change record last modification date when updating
   -o, --holdingpen\tInsert record into holding pen instead of the normal database
   --pretend\t\tdo not really insert/append/correct/replace the input file
+  --workers=N\t\tupload the records using N parallel processes (1); records
+\t\t\tsharing a record ID or an identifier are uploaded in order by
+\t\t\tthe same process
   --force\t\twhen --replace, use provided 001 tag values, even if the matching
 \t\t\trecord does not exist (thus allocating it on-the-fly)
   --callback-url\tSend via a POST request a JSON-serialized answer (see admin guide), in
@@ -2513,6 +2742,7 @@ Examples:
                    "callback-url=",
                    "nonce=",
                    "special-treatment=",
+                   "workers=",
                  ]),
             task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
             task_run_fnc=task_run_core)
@@ -2609,6 +2839,17 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args): # pylint:
             return False
         task_set_option('stage_to_start_from', value)
 
+    elif key in ("--workers", ):
+        try:
+            value = int(value)
+        except ValueError:
+            print >> sys.stderr, """The value specified for --workers must be a valid integer, not %s""" % value
+            return False
+        if value < 1:
+            print >> sys.stderr, """The value specified for --workers must be at least 1"""
+            return False
+        task_set_option('workers', value)
+
     elif key in ("--callback-url", ):
         task_set_option('callback_url', value)
     elif key in ("--nonce", ):
@@ -2693,12 +2934,68 @@ def post_results_to_callback_url(results, callback_url):
     write_message("Returned message is: %s" % msg, verbose=9)
     return res
 
+def _handle_bibupload_result(record, error, callback_url=None, results_for_callback=None):
+    """Report the result ERROR, as returned by bibupload(), of the
+    upload of RECORD."""
+    if error[0] == 1:
+        if record:
+            write_message(record_xml_output(record),
+                          stream=sys.stderr)
+        else:
+            write_message("Record could not have been parsed",
+                          stream=sys.stderr)
+            stat['nb_errors'] += 1
+            if callback_url:
+                results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
+    elif error[0] == 2:
+        if record:
+            write_message(record_xml_output(record),
+                          stream=sys.stderr)
+        else:
+            write_message("Record could not have been parsed",
+                          stream=sys.stderr)
+        if callback_url:
+            results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
+    elif error[0] == 0:
+        if callback_url:
+            from invenio.search_engine import print_record
+            results_for_callback['results'].append({'recid': error[1], 'success': True, "marcxml": print_record(error[1], 'xm'), 'url': "%s/%s/%s" % (CFG_SITE_URL, CFG_SITE_RECORD, error[1])})
+    else:
+        if callback_url:
+            results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
+    task_add_processed_records()
+    # stat us a global variable
+    task_update_progress("Done %d out of %d." % \
+                             (stat['nb_records_inserted'] + \
+                                  stat['nb_records_updated'],
+                              stat['nb_records_to_upload']))
+
 def bibupload_records(records, opt_mode = None, opt_tag = None,
                       opt_stage_to_start_from = 1, opt_notimechange = 0,
                       pretend = False, callback_url = None, results_for_callback = None):
     """perform the task of uploading a set of records
     returns list of (error_code, recid) tuples for separate records
+
+    RECORDS may be any iterable: unless they are uploaded by several
+    processes, which have to partition them beforehand, they are
+    consumed one by one and only the records having BDR or BDM tags
+    are kept for the second phase.
     """
+    workers = task_get_option('workers', 1)
+    if workers > 1 and opt_mode != "holdingpen":
+        records = list(records)
+    if workers > 1 and opt_mode != "holdingpen" and len(records) > 1:
+        if records_have_temporary_identifiers_p(records):
+            write_message("Records refer to each other through BDR/BDM tags: uploading them with one process")
+        else:
+            return bibupload_records_in_parallel(records, workers, opt_mode=opt_mode,
+                                                 opt_tag=opt_tag,
+                                                 opt_stage_to_start_from=opt_stage_to_start_from,
+                                                 opt_notimechange=opt_notimechange,
+                                                 pretend=pretend,
+                                                 callback_url=callback_url,
+                                                 results_for_callback=results_for_callback)
+
     #Dictionaries maintaining temporary identifiers
     # Structure: identifier -> number
 
@@ -2706,6 +3003,8 @@ def bibupload_records(records, opt_mode = None, opt_tag = None,
     tmp_vers = {}
 
     results = []
+    # records whose BDR and BDM tags are elaborated in the second phase:
+    post_phase_records = []
     # The first phase -> assigning meaning to temporary identifiers
 
     for record in records:
@@ -2728,44 +3027,16 @@ def bibupload_records(records, opt_mode = None, opt_tag = None,
                 tmp_ids = tmp_ids,
                 tmp_vers = tmp_vers)
             results.append(error)
-            if error[0] == 1:
-                if record:
-                    write_message(record_xml_output(record),
-                                  stream=sys.stderr)
-                else:
-                    write_message("Record could not have been parsed",
-                                  stream=sys.stderr)
-                    stat['nb_errors'] += 1
-                    if callback_url:
-                        results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
-            elif error[0] == 2:
-                if record:
-                    write_message(record_xml_output(record),
-                                  stream=sys.stderr)
-                else:
-                    write_message("Record could not have been parsed",
-                                  stream=sys.stderr)
-                if callback_url:
-                    results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
-            elif error[0] == 0:
-                if callback_url:
-                    from invenio.search_engine import print_record
-                    results_for_callback['results'].append({'recid': error[1], 'success': True, "marcxml": print_record(error[1], 'xm'), 'url': "%s/%s/%s" % (CFG_SITE_URL, CFG_SITE_RECORD, error[1])})
-            else:
-                if callback_url:
-                    results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
-            # stat us a global variable
-            task_update_progress("Done %d out of %d." % \
-                                     (stat['nb_records_inserted'] + \
-                                          stat['nb_records_updated'],
-                                      stat['nb_records_to_upload']))
+            _handle_bibupload_result(record, error, callback_url, results_for_callback)
+            if records_have_temporary_identifiers_p([record]):
+                post_phase_records.append(record)
 
     # Second phase -> Now we can process all entries where temporary identifiers might appear (BDR, BDM)
 
     write_message("Identifiers table after processing: %s  versions: %s" % (str(tmp_ids), str(tmp_vers)))
     write_message("Uploading BDR and BDM fields")
     if opt_mode != "holdingpen":
-        for record in records:
+        for record in post_phase_records:
             record_id = retrieve_rec_id(record, opt_mode, pretend=pretend, post_phase = True)
             bibupload_post_phase(record,
                                  rec_id = record_id,
@@ -2777,6 +3048,170 @@ def bibupload_records(records, opt_mode = None, opt_tag = None,
 
     return results
 
+def records_have_temporary_identifiers_p(records):
+    """Return True if some of the RECORDS have BDR or BDM tags, that
+    may refer to documents of other records of the same upload
+    through temporary identifiers."""
+    for record in records:
+        if extract_tag_from_record(record, 'BDR') is not None or \
+           extract_tag_from_record(record, 'BDM') is not None:
+            return True
+    return False
+
+def _get_record_identifiers(record, opt_mode):
+    """Return the list of identifiers of RECORD: its record ID if it
+    can be resolved, as well as its external SYSNO, external OAI IDs,
+    local OAI ID and DOIs."""
+    identifiers = []
+    rec_id = retrieve_rec_id(record, opt_mode, pretend=True)
+    if rec_id > 0:
+        identifiers.append(('001', rec_id))
+    for tag in (CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG,
+                CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG,
+                CFG_OAI_ID_FIELD):
+        if not tag:
+            continue
+        for value in record_get_field_values(record, tag[0:3],
+                tag[3:4] != "_" and tag[3:4] or "",
+                tag[4:5] != "_" and tag[4:5] or "",
+                tag[5:6]):
+            identifiers.append((tag, value))
+    for doi in record_extract_dois(record):
+        identifiers.append(('doi', doi))
+    return identifiers
+
+def partition_records(records, opt_mode):
+    """Partition RECORDS into groups that can be uploaded independently
+    of each other: the records resolving to the same record ID, or
+    sharing an external identifier, are put into the same group.
+
+    @return: list of groups, each of them being the list of the indexes
+        of its records in RECORDS, in increasing order
+    """
+    # union-find of the groups, a group is represented by the index of
+    # its first record:
+    parents = []
+    def find(group):
+        while parents[group] != group:
+            parents[group] = parents[parents[group]]
+            group = parents[group]
+        return group
+
+    owners = {} # identifier -> group
+    for index, record in enumerate(records):
+        parents.append(index)
+        for identifier in _get_record_identifiers(record, opt_mode):
+            if identifier in owners:
+                group = find(owners[identifier])
+                if group != index:
+                    parents[group] = index
+            owners[identifier] = index
+
+    groups = {}
+    for index in xrange(len(records)):
+        groups.setdefault(find(index), []).append(index)
+    groups = groups.values()
+    groups.sort()
+    return groups
+
+def _bibupload_records_in_worker(args):
+    """Upload a batch of records in a worker process of
+    bibupload_records_in_parallel().
+
+    Records whose bibxxx table lock cannot be acquired are reported
+    as failed, like the records bibupload() fails to upload.
+
+    @return: tuple (list of (record index, bibupload() result),
+        statistics of the batch), or None if the worker had to exit
+    """
+    batch, opt_mode, opt_tag, opt_stage_to_start_from, opt_notimechange, pretend = args
+    stat_keys = ('nb_records_inserted', 'nb_records_updated', 'nb_errors')
+    stat_before = dict([(key, stat[key]) for key in stat_keys])
+    results = []
+    try:
+        for index, record in batch:
+            try:
+                error = bibupload(record,
+                                  opt_tag=opt_tag,
+                                  opt_mode=opt_mode,
+                                  opt_stage_to_start_from=opt_stage_to_start_from,
+                                  opt_notimechange=opt_notimechange,
+                                  oai_rec_id=record_extract_oai_id(record),
+                                  pretend=pretend,
+                                  tmp_ids={},
+                                  tmp_vers={})
+            except InvenioBibUploadLockError, exc:
+                # the other workers held a bibxxx table for too long:
+                # report this record as failed and go on with the batch
+                register_exception()
+                msg = "   Failed: %s" % exc
+                write_message(msg, verbose=1, stream=sys.stderr)
+                stat['nb_errors'] += 1
+                error = (1, -1, msg)
+            results.append((index, error))
+    except SystemExit:
+        # bibupload() has already set the task status:
+        return None
+    return results, dict([(key, stat[key] - stat_before[key]) for key in stat_keys])
+
+def bibupload_records_in_parallel(records, workers, opt_mode=None, opt_tag=None,
+                                  opt_stage_to_start_from=1, opt_notimechange=0,
+                                  pretend=False, callback_url=None, results_for_callback=None):
+    """Upload RECORDS like bibupload_records() does, using WORKERS
+    processes.  The records are partitioned with partition_records(),
+    so that the records of a group are uploaded in order by one
+    process, while the groups are uploaded concurrently.  Each process
+    has its own database connection.
+
+    Records having BDR or BDM tags must not be uploaded this way, as
+    their temporary identifiers are not shared between processes.
+    """
+    task_update_progress("Partitioning records")
+    groups = partition_records(records, opt_mode)
+    write_message("Uploading %s records in %s independent groups with %s processes" %
+                  (len(records), len(groups), workers))
+    # batches of about CFG_BIBUPLOAD_PARALLEL_CHUNK_SIZE records, made of
+    # whole groups:
+    batches = []
+    batch = []
+    for group in groups:
+        batch.extend([(index, records[index]) for index in group])
+        if len(batch) >= CFG_BIBUPLOAD_PARALLEL_CHUNK_SIZE:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+
+    from multiprocessing import Pool
+    results = [None] * len(records)
+    # hand as many batches to the workers as they can treat at once, so
+    # that the task can be put to sleep in between:
+    group_size = workers * 2
+    pool = Pool(processes=workers, initializer=task_init_worker)
+    try:
+        for i in xrange(0, len(batches), group_size):
+            task_sleep_now_if_required(can_stop_too=True)
+            args = [(batch, opt_mode, opt_tag, opt_stage_to_start_from, opt_notimechange, pretend)
+                    for batch in batches[i:i + group_size]]
+            for batch_results in pool.imap_unordered(_bibupload_records_in_worker, args):
+                if batch_results is None:
+                    write_message("   Error: a worker process has stopped, exiting",
+                                  verbose=1, stream=sys.stderr)
+                    sys.exit(1)
+                batch_results, batch_stat = batch_results
+                for key, value in batch_stat.iteritems():
+                    stat[key] += value
+                for index, error in batch_results:
+                    results[index] = error
+                    _handle_bibupload_result(records[index], error, callback_url, results_for_callback)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
 def task_run_core():
     """ Reimplement to add the body of the task."""
     write_message("Input file '%s', input mode '%s'." %
@@ -2786,8 +3221,7 @@ def task_run_core():
     if task_get_option('file_path') is not None:
         write_message("start preocessing", verbose=3)
         task_update_progress("Reading XML input")
-        recs = xml_marc_to_records(open_marc_file(task_get_option('file_path')))
-        stat['nb_records_to_upload'] = len(recs)
+        recs, stat['nb_records_to_upload'] = xml_marc_file_to_records(task_get_option('file_path'))
         write_message("   -Open XML marc: DONE", verbose=2)
         task_sleep_now_if_required(can_stop_too=True)
         write_message("Entering records loop", verbose=3)
@@ -2817,6 +3251,11 @@ def task_run_core():
         # Print out the statistics
         print_out_bibupload_statistics()
 
+    if not task_get_option('pretend') and \
+           (stat['nb_records_inserted'] or stat['nb_records_updated']):
+        # cached search results may not reflect the new records anymore:
+        invalidate_search_results_cache()
+
     # Check if they were errors
     return not stat['nb_errors'] >= 1
 
@@ -28,3 +28,25 @@ CFG_BIBUPLOAD_CONTROLFIELD_TAGS = ['001', '002', '003', '004',
 
 CFG_BIBUPLOAD_SPECIAL_TAGS = ['FMT', 'FFT', 'BDR', 'BDM']
 
+
+# number of values looked up or rows inserted with one query when
+# writing the metadata of a record into the bibxxx tables:
+CFG_BIBUPLOAD_BULK_CHUNK_SIZE = 500
+
+# maximum number of (tag, value) -> bibxxx id entries kept in memory:
+CFG_BIBUPLOAD_BIBXXX_ID_CACHE_SIZE = 100000
+
+# number of seconds bibupload waits for the lock that protects a bibxxx
+# table from concurrent insertions of the same value, and number of
+# times it tries to get it before giving up:
+CFG_BIBUPLOAD_BIBXXX_LOCK_TIMEOUT = 60
+CFG_BIBUPLOAD_BIBXXX_LOCK_ATTEMPTS = 5
+
+# number of records handed at once to a worker process when uploading
+# with several --workers:
+CFG_BIBUPLOAD_PARALLEL_CHUNK_SIZE = 20
+
+
+class InvenioBibUploadLockError(Exception):
+    """Raised when the lock of a bibxxx table cannot be acquired."""
+    pass
@@ -1181,6 +1181,20 @@ class BibUploadCorrectModeTest(GenericBibUploadTest):
         # clean up after ourselves:
         return
 
+    def test_record_correction_metadata(self):
+        """bibupload - correct mode, bibxxx rows and affected fields"""
+        recs = bibupload.xml_marc_to_records(self.testrec1_xm_to_correct)
+        _, recid, _ = bibupload.bibupload_records(recs, opt_mode='correct')[0]
+        res = run_sql("""SELECT b.tag, b.value FROM bibrec_bib10x AS bb, bib10x AS b
+                          WHERE bb.id_bibrec=%s AND bb.id_bibxxx=b.id""", (recid, ))
+        self.assertEqual(sorted(res),
+                         [('100__a', 'Test, Jane'), ('100__u', 'Test Institute'),
+                          ('10047a', 'Test, Joseph'), ('10047a', 'Test2, Joseph'),
+                          ('10047u', 'Test Academy'), ('10047u', 'Test2 Academy'),
+                          ('10048a', 'Cool')])
+        res = run_sql("SELECT affected_fields FROM hstRECORD WHERE id_bibrec=%s", (recid, ))
+        self.assertEqual(sorted([row[0] for row in res]), ['003,100', '100'])
+
 class BibUploadDeleteModeTest(GenericBibUploadTest):
     """
     Testing deleting specific tags from a record while keeping anything else
@@ -5569,6 +5583,107 @@ allow any</subfield>
         self.assertEqual(test_web_page_content(testrec_expected_url, expected_text=['<em>04 May 2008, 03:02</em>']), [])
 
 
+class BibUploadParallelTest(GenericBibUploadTest):
+    """Testing uploading of records with several worker processes."""
+
+    def setUp(self):
+        """Initialize the MARCXML test records."""
+        GenericBibUploadTest.setUp(self)
+        self.xm_testrec = """
+        <record>
+         <datafield tag="245" ind1=" " ind2=" ">
+          <subfield code="a">%(title)s</subfield>
+         </datafield>
+         <datafield tag="%(sysnotag)s" ind1="%(sysnoind1)s" ind2="%(sysnoind2)s">
+          <subfield code="%(sysnosubfieldcode)s">%(sysno)s</subfield>
+         </datafield>
+        </record>
+        """
+        self.sysno_params = {'sysnotag': CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[0:3],
+                             'sysnoind1': CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[3:4] != "_" and \
+                                          CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[3:4] or " ",
+                             'sysnoind2': CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[4:5] != "_" and \
+                                          CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[4:5] or " ",
+                             'sysnosubfieldcode': CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[5:6],
+                             }
+
+    def _get_records(self, titles_and_sysnos):
+        """Return the records having the given titles and SYSNOs."""
+        xml = '<collection>%s</collection>' % ''.join([
+            self.xm_testrec % dict(self.sysno_params, title=title, sysno=sysno)
+            for title, sysno in titles_and_sysnos])
+        return bibupload.xml_marc_to_records(xml)
+
+    def test_partition_records(self):
+        """bibupload - partition of records sharing a SYSNO"""
+        recs = self._get_records([('Foo', 'sysno-parallel-1'),
+                                  ('Bar', 'sysno-parallel-2'),
+                                  ('Foo updated', 'sysno-parallel-1')])
+        self.assertEqual(bibupload.partition_records(recs, 'replace_or_insert'),
+                         [[0, 2], [1]])
+
+    def test_upload_in_parallel(self):
+        """bibupload - upload records sharing a SYSNO with several processes"""
+        recs = self._get_records([('Foo', 'sysno-parallel-1'),
+                                  ('Bar', 'sysno-parallel-2'),
+                                  ('Foo updated', 'sysno-parallel-1')])
+        results = bibupload.bibupload_records_in_parallel(recs, 2,
+                                                          opt_mode='replace_or_insert')
+        self.assertEqual([error for error, dummy, dummy in results], [0, 0, 0])
+        recid1, recid2, recid3 = [recid for dummy, recid, dummy in results]
+        self.assertNotEqual(recid1, recid2)
+        self.assertEqual(recid1, recid3)
+        self.assertEqual(get_record(recid1)['245'][0][0], [('a', 'Foo updated')])
+        self.assertEqual(get_record(recid2)['245'][0][0], [('a', 'Bar')])
+
+
+class BibUploadBibxxxEntriesTest(GenericBibUploadTest):
+    """Testing the batched insertion of the bibxxx entries of a record."""
+
+    def setUp(self):
+        """Create two empty records and some entries sharing values
+        between tags of the same bibxxx table."""
+        GenericBibUploadTest.setUp(self)
+        self.recids = [run_sql("INSERT INTO bibrec (creation_date, modification_date) "
+                               "VALUES (NOW(), NOW())") for dummy in range(2)]
+        value = 'bibupload bibxxx entries test %s' % time.time()
+        self.entries = [('100__a', value, 1),
+                        ('100__u', value, 1),
+                        ('100__a', value + ' 2', 2),
+                        ('245__a', value, 3),
+                        ('245__b', value.upper(), 3)]
+
+    def _get_rows(self, recid):
+        """Return the bibxxx rows linked to RECID."""
+        rows = []
+        for table_name in ('bib10x', 'bib24x'):
+            rows.extend(run_sql("""SELECT b.id, b.tag, b.value, bb.field_number
+                                   FROM %s AS b, bibrec_%s AS bb
+                                   WHERE b.id=bb.id_bibxxx AND bb.id_bibrec=%%s""" % \
+                                (table_name, table_name), (recid, )))
+        return sorted(rows)
+
+    def test_batched_entries(self):
+        """bibupload - batched and per-field bibxxx entries insertion"""
+        for tag, value, field_number in self.entries:
+            table_name, row_id = bibupload.insert_record_bibxxx(tag, value)
+            bibupload.insert_record_bibrec_bibxxx(table_name, row_id, field_number,
+                                                  self.recids[0])
+        bibupload.bibxxx_ids_cache.clear()
+        bibupload.insert_record_bibxxx_entries(self.entries, self.recids[1])
+        self.assertEqual(len(self.entries), len(self._get_rows(self.recids[0])))
+        self.assertEqual(self._get_rows(self.recids[0]), self._get_rows(self.recids[1]))
+        ## inserting them again reuses the same bibxxx rows
+        bibupload.bibxxx_ids_cache.clear()
+        for table_name in ('bib10x', 'bib24x'):
+            run_sql("DELETE FROM bibrec_%s WHERE id_bibrec=%%s" % table_name, (self.recids[1], ))
+        bibupload.insert_record_bibxxx_entries(self.entries, self.recids[1])
+        self.assertEqual(self._get_rows(self.recids[0]), self._get_rows(self.recids[1]))
+        for tag, value, dummy in self.entries:
+            self.assertEqual(1, len([row for row in run_sql("SELECT value FROM bib%sx WHERE tag=%%s AND value=%%s" % tag[0:2],
+                                                                (tag, value))
+                                     if row[0] == value]))
+
 TEST_SUITE = make_test_suite(BibUploadHoldingPenTest,
                              BibUploadInsertModeTest,
                              BibUploadAppendModeTest,
@@ -5590,6 +5705,8 @@ TEST_SUITE = make_test_suite(BibUploadHoldingPenTest,
                              BibUploadMoreInfoTest,
                              BibUploadBibRelationsTest,
                              BibUploadRecordsWithDOITest,
+                             BibUploadParallelTest,
+                             BibUploadBibxxxEntriesTest,
                              )
 
 
@@ -19,6 +19,8 @@
 Invenio special data structures
 """
 
+import threading
+
 class LazyDict(object):
     """
     Lazy dictionary that evaluates its content when it is first accessed.
@@ -147,3 +149,123 @@ class LaziestDict(LazyDict):
                 return False
         return True
 
+
+class SizedLRUCache(object):
+    """
+    Least recently used cache bounded by the total size of its values
+    rather than by their number.
+
+    The size of every value is measured by the 'sizeof' function given
+    to the constructor; once the sum of the sizes would exceed
+    'max_size', the least recently used values are evicted.  Values
+    bigger than 'max_size' are not cached at all.  The cache can be
+    shared by the threads of a process.
+
+    Example of use:
+
+    cache = SizedLRUCache(1024 * 1024, sizeof=len)
+    cache['foo'] = 'bar'
+    cache.get('foo')
+    """
+
+    def __init__(self, max_size, sizeof=len):
+        """
+        @param max_size: maximum total size of the cached values
+        @param sizeof: function returning the size of a value
+        """
+        super(SizedLRUCache, self).__init__()
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> [prev_key, next_key, value, size]; the circular list
+        # is anchored at the _root sentinel, most recent items first:
+        self._root = object()
+        self._items = {self._root: [self._root, self._root, None, 0]}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items) - 1
+
+    def __contains__(self, key):
+        return key in self._items and key is not self._root
+
+    def _unlink(self, key):
+        prev_key, next_key = self._items[key][:2]
+        self._items[prev_key][1] = next_key
+        self._items[next_key][0] = prev_key
+
+    def _link_first(self, key):
+        root = self._items[self._root]
+        first_key = root[1]
+        self._items[key][0] = self._root
+        self._items[key][1] = first_key
+        self._items[first_key][0] = key
+        root[1] = key
+
+    def __getitem__(self, key):
+        self._lock.acquire()
+        try:
+            if key not in self:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            self._unlink(key)
+            self._link_first(key)
+            return self._items[key][2]
+        finally:
+            self._lock.release()
+
+    def __setitem__(self, key, value):
+        size = self.sizeof(value)
+        self._lock.acquire()
+        try:
+            if key in self:
+                self.__delitem__(key)
+            if size > self.max_size:
+                return
+            while self.size + size > self.max_size:
+                self.__delitem__(self._items[self._root][0])
+            self._items[key] = [None, None, value, size]
+            self._link_first(key)
+            self.size += size
+        finally:
+            self._lock.release()
+
+    def __delitem__(self, key):
+        self._lock.acquire()
+        try:
+            if key not in self:
+                raise KeyError(key)
+            self._unlink(key)
+            self.size -= self._items.pop(key)[3]
+        finally:
+            self._lock.release()
+
+    def get(self, key, default=None):
+        try:
+            return self.__getitem__(key)
+        except KeyError:
+            return default
+
+    def keys(self):
+        """Return the keys, the most recently used first."""
+        self._lock.acquire()
+        try:
+            out = []
+            key = self._items[self._root][1]
+            while key is not self._root:
+                out.append(key)
+                key = self._items[key][1]
+            return out
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._items = {self._root: [self._root, self._root, None, 0]}
+            self.size = 0
+        finally:
+            self._lock.release()
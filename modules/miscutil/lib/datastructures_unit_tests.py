@@ -21,7 +21,7 @@
 Test unit for the miscutil/datastructures module.
 """
 
-from invenio.datastructures import LazyDict, LaziestDict
+from invenio.datastructures import LazyDict, LaziestDict, SizedLRUCache
 from invenio.testutils import make_test_suite, run_test_suite, InvenioTestCase
 
 class CallCounter(object):
@@ -91,7 +91,43 @@ class TestLazyDictionaries(InvenioTestCase):
         self.assertEqual(populate.counter, 5)
 
 
-TEST_SUITE = make_test_suite(TestLazyDictionaries, )
+class TestSizedLRUCache(InvenioTestCase):
+    """
+    Size-bounded LRU cache TestSuite.
+    """
+
+    def test_eviction_of_least_recently_used(self):
+        """Checks that the least recently used values are evicted first."""
+        cache = SizedLRUCache(10, sizeof=len)
+        cache['a'] = 'xxxx'
+        cache['b'] = 'xxxx'
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(cache['a'], 'xxxx')
+        cache['c'] = 'xxxx'
+        self.assertEqual(cache.keys(), ['c', 'a'])
+        self.failIf('b' in cache)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.size, 8)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_replacing_and_oversized_values(self):
+        """Checks size accounting when replacing values and oversized values."""
+        cache = SizedLRUCache(10, sizeof=len)
+        cache['a'] = 'xx'
+        cache['a'] = 'xxxxx'
+        self.assertEqual(cache.size, 5)
+        cache['b'] = 'x' * 11
+        self.failIf('b' in cache)
+        self.assertEqual(len(cache), 1)
+        del cache['a']
+        self.assertEqual((len(cache), cache.size), (0, 0))
+        cache['c'] = 'x'
+        cache.clear()
+        self.assertEqual(cache.keys(), [])
+
+
+TEST_SUITE = make_test_suite(TestLazyDictionaries,
+                             TestSizedLRUCache, )
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -89,6 +89,10 @@ _DB_CONN = {}
 _DB_CONN[CFG_DATABASE_HOST] = {}
 _DB_CONN[CFG_DATABASE_SLAVE] = {}
 
+## Number of SQL queries run by this process and seconds spent running
+## them, see get_db_statistics()
+_DB_STATS = {'queries': 0, 'time': 0.0}
+
 def unlock_all():
     for dbhost in _DB_CONN.keys():
         for db in _DB_CONN[dbhost].values():
@@ -209,6 +213,7 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
     if 'sql-logger' in getattr(config, 'CFG_DEVEL_TOOLS', []):
         log_sql_query(dbhost, sql, param)
 
+    query_started = time.time()
     try:
         db = _db_login(dbhost)
         cur = db.cursor()
@@ -225,6 +230,8 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
             gc.enable()
         except (OperationalError, InterfaceError): # unexpected disconnect, bad malloc error, etc
             raise
+    _DB_STATS['queries'] += 1
+    _DB_STATS['time'] += time.time() - query_started
 
     if string.upper(string.split(sql)[0]) in ("SELECT", "SHOW", "DESC", "DESCRIBE"):
         if n:
@@ -273,6 +280,7 @@ def run_sql_many(query, params, limit=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, run_o
     r = None
     while i < len(params):
         ## make partial query safely (mimicking procedure from run_sql())
+        query_started = time.time()
         try:
             db = _db_login(dbhost)
             cur = db.cursor()
@@ -288,6 +296,8 @@ def run_sql_many(query, params, limit=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, run_o
                 gc.enable()
             except (OperationalError, InterfaceError):
                 raise
+        _DB_STATS['queries'] += 1
+        _DB_STATS['time'] += time.time() - query_started
         ## collect its result:
         if r is None:
             r = rc
@@ -315,6 +325,12 @@ def run_sql_with_limit(query, param=None, n=0, with_desc=False, wildcard_limit=0
         raise InvenioDbQueryWildcardLimitError(res)
     return res
 
+def get_db_statistics():
+    """Return a dictionary with the number of SQL queries run so far by
+    this process ('queries') and the seconds spent running them
+    ('time')."""
+    return dict(_DB_STATS)
+
 def blob_to_string(ablob):
     """Return string representation of ABLOB.  Useful to treat MySQL
     BLOBs in the same way for both recent and old MySQLdb versions.
@@ -57,7 +57,20 @@ class RunSqlReturnListOfDictionaries(InvenioTestCase):
                                   'nbrecs': 37L,
                                   'reclist': 'x\x9cc\xf8\xcf\xc8\xc0\xf0\xe3\xff\x7ff\x066E\x16\x06\x04\x00\x00N\xbd\x04%'}]))
 
-TEST_SUITE = make_test_suite(RunSqlReturnListOfDictionaries,)
+class RunSqlStatistics(InvenioTestCase):
+    """Test the counting of the queries run by run_sql"""
+
+    def test_queries_are_counted(self):
+        """dbquery - queries are counted in the statistics"""
+        before = dbquery.get_db_statistics()
+        dbquery.run_sql("SELECT id FROM collection WHERE id=1")
+        dbquery.run_sql("SELECT id FROM collection WHERE id=2")
+        after = dbquery.get_db_statistics()
+        self.assertEqual(after['queries'] - before['queries'], 2)
+        self.failUnless(after['time'] >= before['time'])
+
+TEST_SUITE = make_test_suite(RunSqlReturnListOfDictionaries,
+                             RunSqlStatistics)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE, warn_user=True)
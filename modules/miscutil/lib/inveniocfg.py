@@ -174,6 +174,7 @@ Please, update your invenio-local.conf file accordingly.""" % (option_name, new_
                        'CFG_WEBCOMMENT_ROUND_DATAFIELD',
                        'CFG_BIBUPLOAD_FFT_ALLOWED_EXTERNAL_URLS',
                        'CFG_BIBSCHED_NODE_TASKS',
+                       'CFG_BIBSCHED_RESOURCE_SLOTS',
                        'CFG_BIBEDIT_EXTEND_RECORD_WITH_COLLECTION_TEMPLATE',
                        'CFG_OAI_METADATA_FORMATS',
                        'CFG_BIBDOCFILE_DESIRED_CONVERSIONS',
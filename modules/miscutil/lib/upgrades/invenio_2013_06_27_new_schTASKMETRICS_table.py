@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_2013_06_24_new_schNOTIFY_table']
+
+def info():
+    return "New schTASKMETRICS table for the runtime metrics of the tasks"
+
+def do_upgrade():
+    run_sql("""CREATE TABLE IF NOT EXISTS schTASKMETRICS (
+                 id_schTASK int(15) unsigned NOT NULL,
+                 proc varchar(255) NOT NULL,
+                 host varchar(255) NOT NULL default '',
+                 started datetime NOT NULL,
+                 status varchar(50),
+                 wall_time float NOT NULL default 0,
+                 cpu_time float NOT NULL default 0,
+                 records int(15) unsigned NOT NULL default 0,
+                 db_queries int(15) unsigned NOT NULL default 0,
+                 db_time float NOT NULL default 0,
+                 sleep_time float NOT NULL default 0,
+                 rss_peak int(15) unsigned NOT NULL default 0,
+                 PRIMARY KEY (id_schTASK, started),
+                 KEY proc (proc, started)
+               ) ENGINE=MyISAM""")
+
+def estimate():
+    """  Estimate running time of upgrade in seconds (optional). """
+    return 1
+
+def pre_upgrade():
+    pass
+
+def post_upgrade():
+    pass
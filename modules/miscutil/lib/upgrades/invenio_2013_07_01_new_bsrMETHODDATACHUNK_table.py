@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+from invenio.dbquery import run_sql, serialize_via_marshal, \
+     deserialize_via_marshal
+
+depends_on = ['invenio_2013_06_27_new_schTASKMETRICS_table']
+
+## must be the same as CFG_BIBSORT_DATA_CHUNK_SIZE in bibsort_engine:
+CHUNK_SIZE = 100000
+
+def info():
+    return "New bsrMETHODDATACHUNK table for the chunked BibSort method data"
+
+def do_upgrade():
+    run_sql("""CREATE TABLE IF NOT EXISTS bsrMETHODDATACHUNK (
+                 id_bsrMETHOD mediumint(8) unsigned NOT NULL,
+                 chunk_no int(11) unsigned NOT NULL,
+                 data_dict longblob,
+                 data_dict_ordered longblob,
+                 last_updated datetime,
+                 PRIMARY KEY (id_bsrMETHOD, chunk_no)
+               ) ENGINE=MyISAM""")
+    ## move the existing method data into chunks:
+    for id_method, in run_sql("""SELECT id_bsrMETHOD FROM bsrMETHODDATA
+                                 WHERE data_dict IS NOT NULL"""):
+        res = run_sql("""SELECT data_dict, data_dict_ordered, last_updated
+                         FROM bsrMETHODDATA WHERE id_bsrMETHOD=%s""",
+                      (id_method, ))
+        data_dict = deserialize_via_marshal(res[0][0])
+        data_dict_ordered = deserialize_via_marshal(res[0][1])
+        last_updated = res[0][2]
+        chunks = {}
+        for recid, value in data_dict.iteritems():
+            chunk = chunks.setdefault(recid // CHUNK_SIZE, ({}, {}))
+            chunk[0][recid] = value
+            chunk[1][recid] = data_dict_ordered[recid]
+        for chunk_no, (chunk_dict, chunk_dict_ordered) in chunks.iteritems():
+            run_sql("""REPLACE INTO bsrMETHODDATACHUNK (id_bsrMETHOD, chunk_no,
+                       data_dict, data_dict_ordered, last_updated)
+                       VALUES (%s, %s, %s, %s, %s)""",
+                    (id_method, chunk_no, serialize_via_marshal(chunk_dict),
+                     serialize_via_marshal(chunk_dict_ordered), last_updated))
+        run_sql("""UPDATE bsrMETHODDATA SET data_dict=NULL,
+                   data_dict_ordered=NULL, data_list_sorted=NULL
+                   WHERE id_bsrMETHOD=%s""", (id_method, ))
+
+def estimate():
+    """  Estimate running time of upgrade in seconds (optional). """
+    count_rows = run_sql("SELECT COUNT(*) FROM bsrMETHODDATA")[0][0]
+    return count_rows * 30 + 1
+
+def pre_upgrade():
+    pass
+
+def post_upgrade():
+    pass
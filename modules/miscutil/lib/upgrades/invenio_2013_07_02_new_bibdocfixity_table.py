@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_2013_07_01_new_bsrMETHODDATACHUNK_table']
+
+def info():
+    return "New bibdocfixity table for the results of bibdocfile --audit-fixity"
+
+def do_upgrade():
+    run_sql("""CREATE TABLE IF NOT EXISTS bibdocfixity (
+                 id_bibdoc mediumint(9) unsigned NOT NULL,
+                 version tinyint(4) unsigned NOT NULL,
+                 format varchar(50) NOT NULL,
+                 filesize bigint(15) unsigned NOT NULL default '0',
+                 md datetime default NULL,
+                 checksum char(32) NOT NULL default '',
+                 status varchar(20) NOT NULL default '',
+                 last_checked datetime NOT NULL,
+                 PRIMARY KEY (id_bibdoc, version, format),
+                 KEY (status),
+                 KEY (last_checked)
+               ) ENGINE=MyISAM""")
+
+def estimate():
+    """  Estimate running time of upgrade in seconds (optional). """
+    return 1
+
+def pre_upgrade():
+    pass
+
+def post_upgrade():
+    pass
@@ -2958,6 +2958,14 @@ CREATE TABLE IF NOT EXISTS field_tag (
   PRIMARY KEY  (id_field,id_tag)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS facetINDEX (
+  field varchar(255) NOT NULL,
+  data longblob,
+  modified_until datetime NOT NULL default '1900-01-01 00:00:00',
+  last_updated datetime NOT NULL default '1900-01-01 00:00:00',
+  PRIMARY KEY  (field)
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS tag (
   id mediumint(9) unsigned NOT NULL auto_increment,
   name varchar(255) NOT NULL,
@@ -3037,6 +3045,20 @@ CREATE TABLE IF NOT EXISTS bibdocfsinfo (
   KEY (mime)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS bibdocfixity (
+  id_bibdoc mediumint(9) unsigned NOT NULL,
+  version tinyint(4) unsigned NOT NULL,
+  format varchar(50) NOT NULL,
+  filesize bigint(15) unsigned NOT NULL default '0',
+  md datetime default NULL,
+  checksum char(32) NOT NULL default '',
+  status varchar(20) NOT NULL default '', -- OK, CORRUPTED, MISSING, UNREADABLE or UNKNOWN
+  last_checked datetime NOT NULL,
+  PRIMARY KEY (id_bibdoc, version, format),
+  KEY (status),
+  KEY (last_checked)
+) ENGINE=MyISAM;
+
 -- tables for publication requests:
 
 CREATE TABLE IF NOT EXISTS publreq (
@@ -3666,6 +3688,30 @@ CREATE TABLE IF NOT EXISTS schTASK (
   KEY sequenceid (sequenceid)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS schNOTIFY (
+  name varchar(50) NOT NULL,
+  version int(15) unsigned NOT NULL default 0,
+  last_updated datetime NOT NULL default '1900-01-01 00:00:00',
+  PRIMARY KEY (name)
+) ENGINE=MyISAM;
+
+CREATE TABLE IF NOT EXISTS schTASKMETRICS (
+  id_schTASK int(15) unsigned NOT NULL,
+  proc varchar(255) NOT NULL,
+  host varchar(255) NOT NULL default '',
+  started datetime NOT NULL,
+  status varchar(50),
+  wall_time float NOT NULL default 0,
+  cpu_time float NOT NULL default 0,
+  records int(15) unsigned NOT NULL default 0,
+  db_queries int(15) unsigned NOT NULL default 0,
+  db_time float NOT NULL default 0,
+  sleep_time float NOT NULL default 0,
+  rss_peak int(15) unsigned NOT NULL default 0,
+  PRIMARY KEY (id_schTASK, started),
+  KEY proc (proc, started)
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS hstTASK (
   id int(15) unsigned NOT NULL,
   proc varchar(255) NOT NULL,
@@ -3773,6 +3819,7 @@ CREATE TABLE IF NOT EXISTS hstRECORD (
   job_person varchar(255) NOT NULL,
   job_date datetime NOT NULL,
   job_details blob NOT NULL,
+  affected_fields text NOT NULL default '',
   KEY (id_bibrec),
   KEY (job_id),
   KEY (job_name),
@@ -4182,6 +4229,15 @@ CREATE TABLE IF NOT EXISTS bsrMETHODDATA (
   PRIMARY KEY (id_bsrMETHOD)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS bsrMETHODDATACHUNK (
+  id_bsrMETHOD mediumint(8) unsigned NOT NULL,
+  chunk_no int(11) unsigned NOT NULL,
+  data_dict longblob,
+  data_dict_ordered longblob,
+  last_updated datetime,
+  PRIMARY KEY (id_bsrMETHOD, chunk_no)
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS bsrMETHODDATABUCKET (
   id_bsrMETHOD mediumint(8) unsigned NOT NULL,
   bucket_no tinyint(2) NOT NULL,
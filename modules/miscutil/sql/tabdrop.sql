@@ -370,6 +370,7 @@ DROP TABLE IF EXISTS field;
 DROP TABLE IF EXISTS fieldname;
 DROP TABLE IF EXISTS fieldvalue;
 DROP TABLE IF EXISTS field_tag;
+DROP TABLE IF EXISTS facetINDEX;
 DROP TABLE IF EXISTS tag;
 DROP TABLE IF EXISTS publreq;
 DROP TABLE IF EXISTS session;
@@ -418,11 +419,14 @@ DROP TABLE IF EXISTS sbmPUBLICATIONDATA;
 DROP TABLE IF EXISTS sbmREFEREES;
 DROP TABLE IF EXISTS sbmSUBMISSIONS;
 DROP TABLE IF EXISTS schTASK;
+DROP TABLE IF EXISTS schNOTIFY;
+DROP TABLE IF EXISTS schTASKMETRICS;
 DROP TABLE IF EXISTS bibdoc;
 DROP TABLE IF EXISTS bibdoc_bibdoc;
 DROP TABLE IF EXISTS bibdocmoreinfo;
 DROP TABLE IF EXISTS bibrec_bibdoc;
 DROP TABLE IF EXISTS bibdocfsinfo;
+DROP TABLE IF EXISTS bibdocfixity;
 DROP TABLE IF EXISTS usergroup;
 DROP TABLE IF EXISTS user_usergroup;
 DROP TABLE IF EXISTS user_basket;
@@ -476,6 +480,7 @@ DROP TABLE IF EXISTS xtrJOB;
 DROP TABLE IF EXISTS bsrMETHOD;
 DROP TABLE IF EXISTS bsrMETHODNAME;
 DROP TABLE IF EXISTS bsrMETHODDATA;
+DROP TABLE IF EXISTS bsrMETHODDATACHUNK;
 DROP TABLE IF EXISTS bsrMETHODDATABUCKET;
 DROP TABLE IF EXISTS collection_bsrMETHOD;
 DROP TABLE IF EXISTS lnkENTRY;
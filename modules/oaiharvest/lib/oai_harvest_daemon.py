@@ -61,11 +61,13 @@ from invenio.bibtask import \
      task_update_progress, \
      task_low_level_submission
 from invenio.bibrecord import record_extract_oai_id, create_records, \
+                              create_records_from_stream, \
                               create_record, record_add_fields, \
                               record_delete_fields, record_xml_output, \
                               record_get_field_instances, \
                               record_modify_subfield, \
                               record_has_field, field_xml_output
+from invenio.bibrecord_config import InvenioBibRecordParserError
 from invenio import oai_harvest_getter
 from invenio.errorlib import register_exception
 from invenio.plotextractor_getter import harvest_single, make_single_directory
@@ -1163,10 +1165,17 @@ def create_oaiharvest_log(task_id, oai_src_id, marcxmlfile):
     Function which creates the harvesting logs
     @param task_id bibupload task id
     """
-    file_fd = open(marcxmlfile, "r")
-    xml_content = file_fd.read(-1)
-    file_fd.close()
-    create_oaiharvest_log_str(task_id, oai_src_id, xml_content)
+    try:
+        # parse the file incrementally, without reading it in memory:
+        oai_ids = [record_extract_oai_id(record[0]) for record in
+                   create_records_from_stream(marcxmlfile)]
+    except InvenioBibRecordParserError:
+        file_fd = open(marcxmlfile, "r")
+        xml_content = file_fd.read(-1)
+        file_fd.close()
+        create_oaiharvest_log_str(task_id, oai_src_id, xml_content)
+    else:
+        insert_oaiharvest_log(task_id, oai_src_id, oai_ids)
 
 def create_oaiharvest_log_str(task_id, oai_src_id, xml_content):
     """
@@ -1175,8 +1184,19 @@ def create_oaiharvest_log_str(task_id, oai_src_id, xml_content):
     """
     try:
         records = create_records(xml_content)
-        for record in records:
-            oai_id = record_extract_oai_id(record[0])
+        oai_ids = [record_extract_oai_id(record[0]) for record in records]
+    except Exception, msg:
+        print "Logging exception : %s   " % (str(msg),)
+    else:
+        insert_oaiharvest_log(task_id, oai_src_id, oai_ids)
+
+def insert_oaiharvest_log(task_id, oai_src_id, oai_ids):
+    """
+    Function which logs the harvesting of the records OAI_IDS
+    @param task_id bibupload task id
+    """
+    try:
+        for oai_id in oai_ids:
             query = "INSERT INTO oaiHARVESTLOG (id_oaiHARVEST, oai_id, date_harvested, bibupload_task_id) VALUES (%s, %s, NOW(), %s)"
             run_sql(query, (str(oai_src_id), str(oai_id), str(task_id)))
     except Exception, msg:
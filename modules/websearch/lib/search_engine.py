@@ -37,6 +37,7 @@ import urllib
 import urlparse
 import zlib
 import sys
+import heapq
 
 try:
     ## import optional module:
@@ -62,6 +63,7 @@ from invenio.config import \
      CFG_WEBSEARCH_NB_RECORDS_TO_SORT, \
      CFG_WEBSEARCH_SEARCH_CACHE_SIZE, \
      CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT, \
+     CFG_WEBSEARCH_HITLIST_CACHE_SIZE, \
      CFG_WEBSEARCH_USE_MATHJAX_FOR_FORMATS, \
      CFG_WEBSEARCH_USE_ALEPH_SYSNOS, \
      CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, \
@@ -92,8 +94,9 @@ from invenio.search_engine_config import \
      InvenioWebSearchWildcardLimitError, \
      CFG_WEBSEARCH_IDXPAIRS_FIELDS,\
      CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH, \
-     CFG_SEARCH_RESULTS_CACHE_PREFIX
-from invenio.search_engine_utils import get_fieldvalues
+     CFG_SEARCH_RESULTS_CACHE_PREFIX, \
+     CFG_WEBSEARCH_INDEX_LAST_UPDATED_CHECK_INTERVAL
+from invenio.search_engine_utils import get_fieldvalues, get_fieldvalues_for_records
 from invenio.bibrecord import create_record
 from invenio.bibrank_record_sorter import get_bibrank_methods, is_method_valid, rank_records as rank_records_bibrank
 from invenio.bibrank_downloads_similarity import register_page_view_event, calculate_reading_similarity_list
@@ -102,11 +105,17 @@ from invenio.bibindex_engine_tokenizer import wash_author_name, author_name_requ
      BibIndexPairTokenizer
 from invenio.bibindex_engine_washer import wash_index_term, lower_index_term, wash_author_name
 from invenio.bibindexadminlib import get_idx_indexer
-from invenio.bibformat import format_record, format_records, get_output_format_content_type, create_excel
+from invenio.bibformat import format_record, format_records, get_output_format_content_type, create_excel, \
+     prefetch_records
 from invenio.bibformat_config import CFG_BIBFORMAT_USE_OLD_BIBFORMAT
 from invenio.bibrank_downloads_grapher import create_download_history_graph_and_box
 from invenio.bibknowledge import get_kbr_values
 from invenio.data_cacher import DataCacher
+from invenio.bibsort_rank_array import BibSortRankArray, load_rank_array, \
+     get_rank_array_path
+from invenio.websearch_reclist_snapshot import load_reclist_snapshot, \
+     get_reclist_snapshot_timestamp
+from invenio.datastructures import SizedLRUCache
 from invenio.websearch_external_collections import print_external_results_overview, perform_external_collection_search
 from invenio.access_control_admin import acc_get_action_id
 from invenio.access_control_config import VIEWRESTRCOLL, \
@@ -427,12 +436,103 @@ def get_index_stemming_language(index_id, recreate_cache_if_needed=True):
         index_stemming_cache.recreate_cache_if_needed()
     return index_stemming_cache.cache[index_id]
 
+class IndexLastUpdatedDataCacher(DataCacher):
+    """
+    Provides cache for last_updated timestamps of word/phrase indexes.
+    This class is not to be used directly; use function
+    get_index_last_updated() instead.
+    """
+    def __init__(self):
+        def cache_filler():
+            try:
+                res = run_sql("""SELECT id, last_updated FROM idxINDEX""")
+            except DatabaseError:
+                # database problems, return empty cache
+                return {}
+            return dict(res)
+
+        def timestamp_verifier():
+            return get_table_update_time('idxINDEX')
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+try:
+    index_last_updated_cache.is_ok_p
+except Exception:
+    index_last_updated_cache = IndexLastUpdatedDataCacher()
+
+try:
+    index_last_updated_checked_at
+except NameError:
+    index_last_updated_checked_at = 0
+
+def get_index_last_updated(index_id, recreate_cache_if_needed=True):
+    """Return last_updated timestamp of given index.  The timestamps
+       are checked against the database at most every
+       CFG_WEBSEARCH_INDEX_LAST_UPDATED_CHECK_INTERVAL seconds."""
+    global index_last_updated_checked_at
+    if recreate_cache_if_needed and \
+           time.time() - index_last_updated_checked_at >= CFG_WEBSEARCH_INDEX_LAST_UPDATED_CHECK_INTERVAL:
+        index_last_updated_cache.recreate_cache_if_needed()
+        index_last_updated_checked_at = time.time()
+    return index_last_updated_cache.cache.get(index_id)
+
+try:
+    index_hitlist_caches.keys()
+except Exception:
+    index_hitlist_caches = {} # index table -> (last_updated, SizedLRUCache)
+
+def get_hitset_size(hitset):
+    """Return the approximate memory footprint of 'hitset' in bytes."""
+    return hitset.get_allocated() * hitset.get_wordbytsize() + 64
+
+def get_index_hitlist_cache(table, index_id):
+    """Return the in-process term -> hitset cache for the word or
+       phrase index table 'table' belonging to index 'index_id'.  The
+       cache is emptied whenever the last_updated timestamp of the
+       index changes, i.e. after every bibindex run on this index, so
+       that other indexes keep their cached hitlists.  Return None if
+       the cache is switched off."""
+    if not CFG_WEBSEARCH_HITLIST_CACHE_SIZE:
+        return None
+    last_updated = get_index_last_updated(index_id)
+    cache_last_updated, cache = index_hitlist_caches.get(table, (None, None))
+    if cache is None or cache_last_updated != last_updated:
+        cache = SizedLRUCache(CFG_WEBSEARCH_HITLIST_CACHE_SIZE, sizeof=get_hitset_size)
+        index_hitlist_caches[table] = (last_updated, cache)
+    return cache
+
+def get_cached_hitlist(cache, term):
+    """Return a copy of the hitset of 'term' from the index hitlist
+       'cache', or None if the term is not cached.  Copies are given
+       out since the callers are free to modify the returned sets."""
+    if cache is None:
+        return None
+    hitset = cache.get(term)
+    if hitset is None:
+        return None
+    return intbitset(hitset)
+
+def cache_hitlist(cache, term, hitset):
+    """Store a copy of 'hitset' for 'term' in the index hitlist 'cache'."""
+    if cache is not None:
+        cache[term] = intbitset(hitset)
+
 class CollectionRecListDataCacher(DataCacher):
     """
     Provides cache for collection reclist hitsets.  This class is not
     to be used directly; use function get_collection_reclist() instead.
+
+    Reclists are read lazily from the snapshot published by webcoll.
+    The collection table stays the authority: the snapshot is used
+    only if it was published after the last update of the table, and
+    the reclists are read from the table otherwise.  When the cache is
+    recreated, the reclists whose checksum did not change in the new
+    snapshot are kept.
     """
     def __init__(self):
+        self.snapshot = None
+        self.checksums = {} # checksums of the reclists loaded from the snapshot
         def cache_filler():
             ret = {}
             try:
@@ -440,15 +540,41 @@ class CollectionRecListDataCacher(DataCacher):
             except Exception:
                 # database problems, return empty cache
                 return {}
+            old_checksums = self.checksums
+            old_cache = getattr(self, 'old_cache', None) or {}
+            self.snapshot = load_reclist_snapshot()
+            if self.snapshot is not None and \
+                   self.snapshot.get_timestamp() < get_table_update_time('collection'):
+                ## The snapshot of this node is older than the
+                ## collection table, e.g. webcoll ran on another node
+                self.snapshot = None
+            self.checksums = {}
             for name in res:
-                ret[name[0]] = None # this will be filled later during runtime by calling get_collection_reclist(coll)
+                name = name[0]
+                ret[name] = None # this will be filled later during runtime by calling get_collection_reclist(coll)
+                if self.snapshot is not None and old_cache.get(name) is not None:
+                    checksum = self.snapshot.get_checksum(name)
+                    if checksum is not None and checksum == old_checksums.get(name):
+                        ## Unchanged since the previous snapshot
+                        ret[name] = old_cache[name]
+                        self.checksums[name] = checksum
             return ret
 
         def timestamp_verifier():
-            return get_table_update_time('collection')
+            return max(get_table_update_time('collection'),
+                       get_reclist_snapshot_timestamp())
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
+    def create_cache(self):
+        """Recreate the cache, giving the cache filler access to the
+        reclists of the previous cache."""
+        self.old_cache = self.cache
+        try:
+            DataCacher.create_cache(self)
+        finally:
+            self.old_cache = None
+
 try:
     if not collection_reclist_cache.is_ok_p:
         raise Exception
@@ -461,17 +587,27 @@ def get_collection_reclist(coll, recreate_cache_if_needed=True):
         collection_reclist_cache.recreate_cache_if_needed()
     if coll not in collection_reclist_cache.cache:
         return intbitset() # collection does not exist; return empty set
-    if not collection_reclist_cache.cache[coll]:
-        # collection's reclist not in the cache yet, so calculate it
-        # and fill the cache:
-        reclist = intbitset()
-        query = "SELECT nbrecs,reclist FROM collection WHERE name=%s"
-        res = run_sql(query, (coll, ), 1)
-        if res:
+    if collection_reclist_cache.cache[coll] is None:
+        # collection's reclist not in the cache yet, so read it from
+        # the snapshot or from the database and fill the cache:
+        reclist = None
+        snapshot = collection_reclist_cache.snapshot
+        if snapshot is not None:
             try:
-                reclist = intbitset(res[0][1])
-            except:
-                pass
+                reclist = snapshot.get_reclist(coll)
+            except Exception:
+                register_exception()
+            if reclist is not None:
+                collection_reclist_cache.checksums[coll] = snapshot.get_checksum(coll)
+        if reclist is None:
+            reclist = intbitset()
+            query = "SELECT nbrecs,reclist FROM collection WHERE name=%s"
+            res = run_sql(query, (coll, ), 1)
+            if res:
+                try:
+                    reclist = intbitset(res[0][1])
+                except:
+                    pass
         collection_reclist_cache.cache[coll] = reclist
     # finally, return reclist:
     return collection_reclist_cache.cache[coll]
@@ -502,7 +638,10 @@ def get_available_output_formats(visible_only=False):
     return formats
 
 # Flask cache for search results.
-from invenio.websearch_cache import search_results_cache, get_search_results_cache_key
+from invenio.websearch_cache import search_results_cache, \
+     get_search_results_cache_key, \
+     get_search_results_from_cache, \
+     set_search_results_in_cache
 
 class CollectionI18nNameDataCacher(DataCacher):
     """
@@ -1980,7 +2119,6 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
     # search stage 2: do search for each search unit and verify hit presence:
     if verbose and of.startswith("h"):
         t1 = os.times()[4]
-    basic_search_units_hitsets = []
     #prepare hiddenfield-related..
     myhiddens = CFG_BIBFORMAT_HIDDEN_TAGS
     can_see_hidden = False
@@ -2004,8 +2142,28 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
                           {'x_range_from_year': '2008',
                            'x_range_to_year': '2012'}, req=req)
 
-    for idx_unit in xrange(len(basic_search_units)):
+    # look up all plain word units at once, one query per word index:
+    basic_search_units_prefetched = search_units_in_bibwords(basic_search_units)
+    if verbose >= 9 and of.startswith("h"):
+        write_warning("Search stage 2: units %s were looked up in batch." % \
+                      sorted(basic_search_units_prefetched.keys()), req=req)
+
+    # evaluate the units in the order planned by
+    # plan_basic_search_units() and apply the boolean query as we go,
+    # skipping the units that cannot change the result:
+    basic_search_units_hitsets = [None] * len(basic_search_units)
+    # let the initial set be the complete universe:
+    hitset_in_any_collection = intbitset(trailing_bits=1)
+    hitset_in_any_collection.discard(0)
+    hitset_is_universe = True
+    for idx_unit in plan_basic_search_units(basic_search_units, basic_search_units_prefetched):
         bsu_o, bsu_p, bsu_f, bsu_m = basic_search_units[idx_unit]
+        if (bsu_o == '|' and hitset_is_universe) or \
+               (bsu_o != '|' and not hitset_is_universe and not hitset_in_any_collection):
+            # OR with the universe, or AND/AND NOT with the empty set
+            if verbose >= 9 and of.startswith("h"):
+                write_warning("Search stage 2: pattern %s skipped since it cannot change the result" % cgi.escape(bsu_p), req=req)
+            continue
         if bsu_f and len(bsu_f) < 2:
             if of.startswith("h"):
                 write_warning(_("There is no index %s.  Searching for %s in all fields." % (bsu_f, bsu_p)), req=req)
@@ -2014,7 +2172,10 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
             if of.startswith("h") and verbose:
                 write_warning(_('Instead searching %s.' % str([bsu_o, bsu_p, bsu_f, bsu_m])), req=req)
         try:
-            basic_search_unit_hitset = search_unit(bsu_p, bsu_f, bsu_m, wl)
+            if idx_unit in basic_search_units_prefetched:
+                basic_search_unit_hitset = basic_search_units_prefetched[idx_unit]
+            else:
+                basic_search_unit_hitset = search_unit(bsu_p, bsu_f, bsu_m, wl)
         except InvenioWebSearchWildcardLimitError, excp:
             basic_search_unit_hitset = excp.res
             if of.startswith("h"):
@@ -2047,7 +2208,7 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
             # pattern treatment is switched off, or the search unit
             # was joined by an OR operator to preceding/following
             # units so we do not require that it exists
-            basic_search_units_hitsets.append(basic_search_unit_hitset)
+            basic_search_units_hitsets[idx_unit] = basic_search_unit_hitset
         else:
             # stage 2-2: no hits found for this search unit, try to replace non-alphanumeric chars inside pattern:
             if re.search(r'[^a-zA-Z0-9\s\:]', bsu_p) and bsu_f != 'refersto' and bsu_f != 'citedby':
@@ -2065,7 +2226,7 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
                                       {'x_query1': "<em>" + cgi.escape(bsu_p) + "</em>",
                                        'x_query2': "<em>" + cgi.escape(bsu_pn) + "</em>"}, req=req)
                     basic_search_units[idx_unit][1] = bsu_pn
-                    basic_search_units_hitsets.append(basic_search_unit_hitset)
+                    basic_search_units_hitsets[idx_unit] = basic_search_unit_hitset
                 else:
                     # stage 2-3: no hits found either, propose nearest indexed terms:
                     if of.startswith('h') and display_nearest_terms_box:
@@ -2084,30 +2245,32 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
                         else:
                             write_warning(create_nearest_terms_box(req.argd, bsu_p, bsu_f, bsu_m, ln=ln), req=req)
                 return hitset_empty
-    if verbose and of.startswith("h"):
-        t2 = os.times()[4]
-        for idx_unit in range(0, len(basic_search_units)):
-            write_warning("Search stage 2: basic search unit %s gave %d hits." %
-                          (basic_search_units[idx_unit][1:], len(basic_search_units_hitsets[idx_unit])), req=req)
-        write_warning("Search stage 2: execution took %.2f seconds." % (t2 - t1), req=req)
-    # search stage 3: apply boolean query for each search unit:
-    if verbose and of.startswith("h"):
-        t1 = os.times()[4]
-    # let the initial set be the complete universe:
-    hitset_in_any_collection = intbitset(trailing_bits=1)
-    hitset_in_any_collection.discard(0)
-    for idx_unit in xrange(len(basic_search_units)):
-        this_unit_operation = basic_search_units[idx_unit][0]
+        # stage 2-4: apply the boolean operation of the unit:
         this_unit_hitset = basic_search_units_hitsets[idx_unit]
-        if this_unit_operation == '+':
+        if bsu_o == '+':
             hitset_in_any_collection.intersection_update(this_unit_hitset)
-        elif this_unit_operation == '-':
+            hitset_is_universe = False
+        elif bsu_o == '-':
             hitset_in_any_collection.difference_update(this_unit_hitset)
-        elif this_unit_operation == '|':
+            hitset_is_universe = False
+        elif bsu_o == '|':
             hitset_in_any_collection.union_update(this_unit_hitset)
         else:
             if of.startswith("h"):
-                write_warning("Invalid set operation %s." % cgi.escape(this_unit_operation), "Error", req=req)
+                write_warning("Invalid set operation %s." % cgi.escape(bsu_o), "Error", req=req)
+    if verbose and of.startswith("h"):
+        t2 = os.times()[4]
+        for idx_unit in range(0, len(basic_search_units)):
+            if basic_search_units_hitsets[idx_unit] is None:
+                write_warning("Search stage 2: basic search unit %s was skipped." %
+                              (basic_search_units[idx_unit][1:], ), req=req)
+            else:
+                write_warning("Search stage 2: basic search unit %s gave %d hits." %
+                              (basic_search_units[idx_unit][1:], len(basic_search_units_hitsets[idx_unit])), req=req)
+        write_warning("Search stage 2: execution took %.2f seconds." % (t2 - t1), req=req)
+    # search stage 3: look at the result of the boolean query:
+    if verbose and of.startswith("h"):
+        t1 = os.times()[4]
     if len(hitset_in_any_collection) == 0:
         # no hits found, propose alternative boolean query:
         if of.startswith('h') and display_nearest_terms_box:
@@ -2116,7 +2279,14 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
                 bsu_o, bsu_p, bsu_f, bsu_m = basic_search_units[idx_unit]
                 if bsu_p.startswith("%") and bsu_p.endswith("%"):
                     bsu_p = "'" + bsu_p[1:-1] + "'"
-                bsu_nbhits = len(basic_search_units_hitsets[idx_unit])
+                if basic_search_units_hitsets[idx_unit] is not None:
+                    bsu_nbhits = len(basic_search_units_hitsets[idx_unit])
+                else:
+                    # the unit was skipped by the query planner
+                    try:
+                        bsu_nbhits = len(search_unit(bsu_p, bsu_f, bsu_m, wl))
+                    except InvenioWebSearchWildcardLimitError, excp:
+                        bsu_nbhits = len(excp.res)
 
                 # create a similar query, but with the basic search unit only
                 argd = {}
@@ -2136,6 +2306,49 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
         write_warning("Search stage 3: execution took %.2f seconds." % (t2 - t1), req=req)
     return hitset_in_any_collection
 
+def plan_basic_search_units(basic_search_units, known_hitsets):
+    """Return the list of the indexes of the basic search units in the
+       order in which search_pattern() should evaluate them.
+
+       Units are combined left to right, but inside a run of units
+       joined by AND (+) and AND NOT (-) the order does not matter.
+       Inside such a run the intersections are done first, smallest
+       known hitset first, and the differences last, so that the
+       intermediate result shrinks as soon as possible and the units
+       coming after an empty intersection need not be looked up at
+       all.  Units joined by OR (|) keep their position.
+
+       'known_hitsets' is the dictionary {idx_unit: hitset} of the
+       units already looked up (see search_units_in_bibwords()); their
+       hitset sizes are the cardinality estimates.  Units of unknown
+       size come after them, in query order.
+    """
+    def estimated_cost(idx_unit):
+        if idx_unit in known_hitsets:
+            return (0, len(known_hitsets[idx_unit]), idx_unit)
+        return (1, 0, idx_unit)
+
+    plan = []
+    intersections = []
+    differences = []
+    for idx_unit in xrange(len(basic_search_units)):
+        operation = basic_search_units[idx_unit][0]
+        if operation == '|':
+            intersections.sort(key=estimated_cost)
+            plan.extend(intersections)
+            plan.extend(differences)
+            plan.append(idx_unit)
+            intersections = []
+            differences = []
+        elif operation == '+':
+            intersections.append(idx_unit)
+        else:
+            differences.append(idx_unit)
+    intersections.sort(key=estimated_cost)
+    plan.extend(intersections)
+    plan.extend(differences)
+    return plan
+
 def search_pattern_parenthesised(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, ln=CFG_SITE_LANG, display_nearest_terms_box=True, wl=0):
     """Search for complex pattern 'p' containing parenthesis within field 'f' according to
        matching type 'm'.  Return hitset of recIDs.
@@ -2396,8 +2609,18 @@ def search_unit_in_bibwords(word, f, m=None, decompress=zlib.decompress, wl=0):
                     res = excp.res
                     limit_reached = 1 # set the limit reached flag to true
         else:
+            word = wash_index_term(word)
+            hitlist_cache = get_index_hitlist_cache(bibwordsX, index_id)
+            set = get_cached_hitlist(hitlist_cache, word)
+            if set is not None:
+                return set
+            set = intbitset()
             res = run_sql("SELECT term,hitlist FROM %s WHERE term=%%s" % bibwordsX,
-                          (wash_index_term(word),))
+                          (word,))
+            for dummy, hitlist in res:
+                set.union_update(intbitset(hitlist))
+            cache_hitlist(hitlist_cache, word, set)
+            return set
     # fill the result set:
     for word, hitlist in res:
         hitset_bibwrd = intbitset(hitlist)
@@ -2414,6 +2637,76 @@ def search_unit_in_bibwords(word, f, m=None, decompress=zlib.decompress, wl=0):
     # okay, return result set:
     return set
 
+def search_units_in_bibwords(basic_search_units):
+    """Batched counterpart of search_unit_in_bibwords() for a whole query.
+
+       Take the list of basic search units as returned by
+       create_basic_search_units() and look up, in one
+       'SELECT ... WHERE term IN (...)' query per word index table,
+       the hitlists of all the units that would otherwise end up as a
+       plain exact-term search_unit_in_bibwords() call.  Units that
+       need any special treatment (wildcards, span queries, synonyms,
+       phrase or regexp matching, citation or date fields, external
+       full-text engines, etc) are left out, so that the caller can
+       still run them through search_unit() one by one.  Terms found
+       in the in-process index hitlist cache are not queried at all.
+
+       Return dictionary {idx_unit: hitset} for the looked up units.
+    """
+    out = {}
+    terms_by_index = {} # index_id -> {washed_term: [idx_unit, ...]}
+    for idx_unit in xrange(len(basic_search_units)):
+        bsu_o, bsu_p, bsu_f, bsu_m = basic_search_units[idx_unit]
+        if bsu_m != 'w' or not bsu_p:
+            continue
+        if bsu_f and len(bsu_f) < 2:
+            # search_pattern() will warn and fall back to all fields
+            continue
+        if bsu_f in ('datecreated', 'datemodified', 'refersto', 'rawref',
+                     'citedby', 'collection', 'journal', 'authorcount') or \
+               CFG_WEBSEARCH_SYNONYM_KBRS.has_key(bsu_f) or \
+               bsu_p.startswith("cited:"):
+            continue
+        if bsu_f == 'fulltext' and get_idx_indexer('fulltext') in ('SOLR', 'XAPIAN'):
+            continue
+        if '*' in bsu_p or '%' in bsu_p or '->' in bsu_p:
+            continue
+        index_id = get_index_id_from_field(bsu_f or 'anyfield')
+        if not index_id:
+            out[idx_unit] = intbitset()
+            continue
+        word = re_word.sub('', bsu_p)
+        stemming_language = get_index_stemming_language(index_id)
+        if stemming_language:
+            word = lower_index_term(word)
+            word = stem(word, stemming_language)
+        word = wash_index_term(word)
+        terms_by_index.setdefault(index_id, {}).setdefault(word, []).append(idx_unit)
+    for index_id, terms in terms_by_index.iteritems():
+        bibwordsX = "idxWORD%02dF" % index_id
+        hitlist_cache = get_index_hitlist_cache(bibwordsX, index_id)
+        for term in terms.keys():
+            hitset_bibwrd = get_cached_hitlist(hitlist_cache, term)
+            if hitset_bibwrd is not None:
+                for idx_unit in terms.pop(term):
+                    out[idx_unit] = hitset_bibwrd
+        if not terms:
+            continue
+        res = run_sql("SELECT term,hitlist FROM %s WHERE term IN (%s)" % \
+                      (bibwordsX, ','.join(['%s'] * len(terms))),
+                      terms.keys())
+        for term, hitlist in res:
+            # note that the column collation may let MySQL return
+            # differently cased or accented terms; units for which we
+            # got no exact term back are left to search_unit() so that
+            # they behave exactly as before
+            if term in terms:
+                hitset_bibwrd = intbitset(hitlist)
+                cache_hitlist(hitlist_cache, term, hitset_bibwrd)
+                for idx_unit in terms[term]:
+                    out[idx_unit] = hitset_bibwrd
+    return out
+
 def search_unit_in_idxpairs(p, f, type, wl=0):
     """Searches for pair 'p' inside idxPAIR table for field 'f' and
     returns hitset of recIDs found."""
@@ -2545,13 +2838,12 @@ def search_unit_in_idxphrases(p, f, type, wl=0):
     limit_reached = 0 # flag for knowing if the query limit has been reached
     use_query_limit = False # flag for knowing if to limit the query results or not
     # deduce in which idxPHRASE table we will search:
-    idxphraseX = "idxPHRASE%02dF" % get_index_id_from_field("anyfield")
+    index_id = get_index_id_from_field("anyfield")
     if f:
         index_id = get_index_id_from_field(f)
-        if index_id:
-            idxphraseX = "idxPHRASE%02dF" % index_id
-        else:
+        if not index_id:
             return intbitset() # phrase index f does not exist
+    idxphraseX = "idxPHRASE%02dF" % index_id
     # detect query type (exact phrase, partial phrase, regexp):
     if type == 'r':
         query_addons = "REGEXP %s"
@@ -2588,7 +2880,16 @@ def search_unit_in_idxphrases(p, f, type, wl=0):
             res = excp.res
             limit_reached = 1 # set the limit reached flag to true
     else:
+        hitlist_cache = get_index_hitlist_cache(idxphraseX, index_id)
+        set = get_cached_hitlist(hitlist_cache, query_params[0])
+        if set is not None:
+            return set
+        set = intbitset()
         res = run_sql("SELECT term,hitlist FROM %s WHERE term %s" % (idxphraseX, query_addons), query_params)
+        for dummy, hitlist in res:
+            set.union_update(intbitset(hitlist))
+        cache_hitlist(hitlist_cache, query_params[0], set)
+        return set
     # fill the result set:
     for word, hitlist in res:
         hitset_bibphrase = intbitset(hitlist)
@@ -3691,6 +3992,32 @@ def record_exists(recID):
             out = 1 # exists fine
     return out
 
+def records_exist(recIDs):
+    """Return dictionary recID -> record_exists(recID) for the list of
+       record IDs RECIDS, using two queries for all of them.
+    """
+    out = dict.fromkeys(recIDs, 0)
+    if not recIDs:
+        return out
+    existing = intbitset(run_sql("SELECT id FROM bibrec WHERE id IN (%s)" % \
+                                 ','.join([str(int(recID)) for recID in recIDs])))
+    if not existing:
+        return out
+    deleted = intbitset()
+    res = run_sql("""SELECT bb.id_bibrec, b.value FROM bib98x AS b, bibrec_bib98x AS bb
+                      WHERE bb.id_bibrec IN (%s) AND bb.id_bibxxx=b.id
+                        AND b.tag LIKE %%s""" % ','.join([str(recID) for recID in existing]),
+                  ('980__%',))
+    for recID, value in res:
+        if value == "DELETED" or (CFG_CERN_SITE and value == "DUMMY"):
+            deleted.add(recID)
+    for recID in existing:
+        if recID in deleted:
+            out[recID] = -1 # exists, but marked as deleted
+        else:
+            out[recID] = 1 # exists fine
+    return out
+
 def record_empty(recID):
     """
     Is this record empty, e.g. has only 001, waiting for integration?
@@ -3912,18 +4239,30 @@ class BibSortDataCacher(DataCacher):
             alldicts = {}
             if self.method_id == 0:
                 return {}
+            data_dict_ordered = None
             try:
-                res_data = run_sql("""SELECT data_dict_ordered from bsrMETHODDATA \
+                # prefer the memory-mapped weights written by bibsort on
+                # this node, if they are those of the database:
+                res_data = run_sql("""SELECT last_updated from bsrMETHODDATA \
                                    where id_bsrMETHOD = %s""", (method_id,))
+                if res_data:
+                    data_dict_ordered = load_rank_array(get_rank_array_path(method_id),
+                                                        res_data[0][0])
+                if data_dict_ordered is None:
+                    res_data = run_sql("""SELECT data_dict_ordered from bsrMETHODDATACHUNK \
+                                       where id_bsrMETHOD = %s""", (method_id,))
                 res_buckets = run_sql("""SELECT bucket_no, bucket_data from bsrMETHODDATABUCKET\
                                       where id_bsrMETHOD = %s""", (method_id,))
             except Exception:
                 # database problems, return empty cache
                 return {}
-            try:
-                data_dict_ordered = deserialize_via_marshal(res_data[0][0])
-            except:
+            if data_dict_ordered is None:
                 data_dict_ordered = {}
+                try:
+                    for row in res_data:
+                        data_dict_ordered.update(deserialize_via_marshal(row[0]))
+                except:
+                    data_dict_ordered = {}
             alldicts['data_dict_ordered'] = data_dict_ordered # recid: weight
             if not res_buckets:
                 alldicts['bucket_data'] = {}
@@ -4110,6 +4449,10 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
         solution.union_update(input_recids & sort_cache['bucket_data'][bucket_no])
         if len(solution) >= irec_max:
             break
+    if isinstance(sort_cache['data_dict_ordered'], BibSortRankArray):
+        return sort_records_bibsort_rank_array(sort_cache['data_dict_ordered'],
+                                               solution, input_recids, sort_method,
+                                               sort_order, irec_max, sort_or_rank)
     dict_solution = {}
     missing_records = []
     for recid in solution:
@@ -4144,6 +4487,34 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
     else:
         return solution[index_min:]
 
+def sort_records_bibsort_rank_array(rank_array, solution, input_recids, sort_method, sort_order, irec_max, sort_or_rank='s'):
+    """Same as the end of sort_records_bibsort, for the records in the
+    buckets 'solution', but using the memory-mapped BibSort weights
+    and sorting only the records that are going to be returned."""
+    missing_records = list(solution.difference(rank_array.keys_intbitset))
+    if len(solution) < irec_max:
+        missing_records = sorted(missing_records + list(input_recids.difference(solution)))
+    latest_first = sort_method.strip().lower().startswith('latest') and sort_order == 'd'
+    # only the last irec_max records of the solution are returned:
+    nb_records_to_sort = irec_max
+    if latest_first:
+        nb_records_to_sort = max(irec_max - len(missing_records), 0)
+    sorted_recids, sorted_weights = rank_array.get_sorted_tail(solution, reverse=sort_order=='a',
+                                                               nb_records=nb_records_to_sort)
+    if latest_first:
+        # if we want to sort the records on their insertion date, add the mission records at the top
+        solution = sorted_recids + missing_records
+        weights = sorted_weights + [0] * len(missing_records)
+    else:
+        solution = missing_records + sorted_recids
+        weights = [0] * len(missing_records) + sorted_weights
+    #calculate the min index on the reverted list
+    index_min = max(len(solution) - irec_max, 0)
+    if sort_or_rank == 'r':
+        return (solution[index_min:], weights[index_min:])
+    else:
+        return solution[index_min:]
+
 
 def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_pattern='', verbose=0, of='hb', ln=CFG_SITE_LANG, rg=None, jrec=None):
     """OLD FASHION SORTING WITH NO CACHE, for sort fields that are not run in BibSort
@@ -4166,8 +4537,6 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
         if of.startswith('h'):
             write_warning(_("Sorry, sorting is allowed on sets of up to %d records only. Using default sort order.") % CFG_WEBSEARCH_NB_RECORDS_TO_SORT, "Warning", req=req)
         return recIDs[index_min:]
-    recIDs_dict = {}
-    recIDs_out = []
 
     if not tags:
         # tags have not been camputed yet
@@ -4183,17 +4552,19 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
             write_warning("Sorting preferentially by %s." % cgi.escape(sort_pattern), req=req)
      ## check if we have sorting tag defined:
     if tags:
-        # fetch the necessary field values:
+        # fetch the necessary field values of all the records at once:
+        tags_vals = [get_fieldvalues_for_records(recIDs, tag) for tag in tags]
+        recIDs_keys = {}
         for recID in recIDs:
             val = "" # will hold value for recID according to which sort
             vals = [] # will hold all values found in sorting tag for recID
-            for tag in tags:
+            for tag, tag_vals in zip(tags, tags_vals):
                 if CFG_CERN_SITE and tag == '773__c':
                     # CERN hack: journal sorting
                     # 773__c contains page numbers, e.g. 3-13, and we want to sort by 3, and numerically:
-                    vals.extend(["%050s" % x.split("-", 1)[0] for x in get_fieldvalues(recID, tag)])
+                    vals.extend(["%050s" % x.split("-", 1)[0] for x in tag_vals.get(recID, [])])
                 else:
-                    vals.extend(get_fieldvalues(recID, tag))
+                    vals.extend(tag_vals.get(recID, []))
             if sort_pattern:
                 # try to pick that tag value that corresponds to sort pattern
                 bingo = 0
@@ -4207,27 +4578,27 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
             else:
                 # no sort pattern defined, so join them all together
                 val = string.join(vals)
-            val = strip_accents(val.lower()) # sort values regardless of accents and case
-            if recIDs_dict.has_key(val):
-                recIDs_dict[val].append(recID)
-            else:
-                recIDs_dict[val] = [recID]
-        # sort them:
-        recIDs_dict_keys = recIDs_dict.keys()
-        recIDs_dict_keys.sort()
-        # now that keys are sorted, create output array:
-        for k in recIDs_dict_keys:
-            for s in recIDs_dict[k]:
-                recIDs_out.append(s)
-        # ascending or descending?
+            recIDs_keys[recID] = strip_accents(val.lower()) # sort values regardless of accents and case
+        # sort them by value, records having the same value staying in
+        # their original order; the output is read from its end, so
+        # only the last irec_max records of it need to be sorted:
+        decorated = [(recIDs_keys[recID], i, recID) for i, recID in enumerate(recIDs)]
+        nb_to_sort = len(recIDs) - index_min
         if sort_order == 'a':
-            recIDs_out.reverse()
+            # ascending order: output is the reversed sorted list
+            if nb_to_sort < len(decorated):
+                decorated = heapq.nsmallest(nb_to_sort, decorated)
+            else:
+                decorated.sort()
+            decorated.reverse()
+        else:
+            if nb_to_sort < len(decorated):
+                decorated = heapq.nlargest(nb_to_sort, decorated)
+                decorated.reverse()
+            else:
+                decorated.sort()
         # okay, we are done
-        # return only up to the maximum that we need to sort
-        if len(recIDs_out) != len(recIDs):
-            dummy, irec_max = get_interval_for_records_to_sort(len(recIDs_out), jrec, rg)
-            index_min = max(len(recIDs_out) - irec_max, 0) #just to be sure that the min index is not negative
-        return recIDs_out[index_min:]
+        return [recID for dummy_val, dummy_i, recID in decorated]
     else:
         # good, no sort needed
         return recIDs[index_min:]
@@ -4379,6 +4750,11 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
                     display_add_to_basket = False
                 req.write(websearch_templates.tmpl_record_format_htmlbrief_header(
                     ln = ln))
+                prefetched = None
+                if not CFG_BIBFORMAT_USE_OLD_BIBFORMAT:
+                    # only the new BibFormat uses the prefetched data, see print_record()
+                    prefetched = prefetch_records([recIDs[irec] for irec in range(irec_max, irec_min, -1)],
+                                                  format, ln)
                 for irec in range(irec_max, irec_min, -1):
                     row_number = jrec+irec_max-irec
                     recid = recIDs[irec]
@@ -4387,7 +4763,8 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
                     else:
                         relevance = ''
                     record = print_record(recIDs[irec], format, ot, ln, search_pattern=search_pattern,
-                                                  user_info=user_info, verbose=verbose, sf=sf, so=so, sp=sp, rm=rm)
+                                                  user_info=user_info, verbose=verbose, sf=sf, so=so, sp=sp, rm=rm,
+                                                  prefetched=prefetched)
 
                     req.write(websearch_templates.tmpl_record_format_htmlbrief_body(
                         ln = ln,
@@ -4673,9 +5050,28 @@ def get_record(recid):
                 pass
     return create_record(print_record(recid, 'xm'))[0]
 
+def get_records(recIDs):
+    """Return dictionary recID -> record object for the list of record
+    IDs RECIDS.  Same as get_record(), but the serialized record
+    structures are fetched with one query for all of them."""
+    out = {}
+    if CFG_BIBUPLOAD_SERIALIZE_RECORD_STRUCTURE and recIDs:
+        res = run_sql("SELECT id_bibrec, value FROM bibfmt WHERE id_bibrec IN (%s) AND FORMAT='recstruct'" % \
+                      ','.join([str(int(recID)) for recID in recIDs]))
+        for recID, value in res:
+            try:
+                out[recID] = deserialize_via_marshal(value)
+            except:
+                ### In case of corruption, get_record() will rebuild it
+                pass
+    for recID in recIDs:
+        if recID not in out:
+            out[recID] = get_record(recID)
+    return out
+
 def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.decompress,
                  search_pattern=None, user_info=None, verbose=0, sf='', so='d',
-                 sp='', rm='', brief_links=True):
+                 sp='', rm='', brief_links=True, prefetched=None):
     """
     Prints record 'recID' formatted according to 'format'.
 
@@ -4683,6 +5079,9 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
     only for proper linking purposes: e.g. when a certain ranking
     method or a certain sort field was selected, keep it selected in
     any dynamic search links that may be printed.
+
+    'prefetched' is the data of the record, as returned by
+    bibformat.prefetch_records() for a page of records.
     """
     if format == 'recstruct':
         return get_record(recID)
@@ -4704,7 +5103,10 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
     out = ""
 
     # sanity check:
-    record_exist_p = record_exists(recID)
+    if prefetched is not None and recID in prefetched['exists']:
+        record_exist_p = prefetched['exists'][recID]
+    else:
+        record_exist_p = record_exists(recID)
     if record_exist_p == 0: # doesn't exist
         return out
 
@@ -4732,7 +5134,8 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
                 out += ' ' + _("The record %d replaces it." % merged_recid)
         else:
             out += call_bibformat(recID, format, ln, search_pattern=search_pattern,
-                                  user_info=user_info, verbose=verbose)
+                                  user_info=user_info, verbose=verbose,
+                                  prefetched=prefetched)
 
             # at the end of HTML brief mode, print the "Detailed record" functionality:
             if brief_links and format.lower().startswith('hb') and \
@@ -5037,7 +5440,8 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
 
     return out
 
-def call_bibformat(recID, format="HD", ln=CFG_SITE_LANG, search_pattern=None, user_info=None, verbose=0):
+def call_bibformat(recID, format="HD", ln=CFG_SITE_LANG, search_pattern=None, user_info=None, verbose=0,
+                   prefetched=None):
     """
     Calls BibFormat and returns formatted record.
 
@@ -5062,7 +5466,8 @@ def call_bibformat(recID, format="HD", ln=CFG_SITE_LANG, search_pattern=None, us
                          ln=ln,
                          search_pattern=keywords,
                          user_info=user_info,
-                         verbose=verbose)
+                         verbose=verbose,
+                         prefetched=prefetched)
 
     if CFG_WEBSEARCH_FULLTEXT_SNIPPETS and user_info and \
            'fulltext' in user_info['uri'].lower():
@@ -5847,14 +6252,17 @@ def prs_simple_search(results_in_any_collection, kwargs=None, req=None, of=None,
                     only_hosted_colls_actual_or_potential_results_p=None, query_representation_in_cache=None,
                     ap=None, hosted_colls_actual_or_potential_results_p=None, wl=None, em=None,
                     **dummy):
-    try:
-        results_in_cache = intbitset().fastload(
-            search_results_cache.get(query_representation_in_cache))
-    except:
-        results_in_cache = None
+    results_in_cache = None
+    if CFG_WEBSEARCH_SEARCH_CACHE_SIZE > 0:
+        collection = None
+        if search_results_collection_variant_p(cc, kwargs.get('colls_to_search')):
+            collection = cc
+        results_in_cache = get_search_results_from_cache(query_representation_in_cache,
+                                                         collection=collection)
 
     if results_in_cache is not None:
-        # query is not in the cache already, so reuse it:
+        # query is in the cache already, so reuse it:
+        kwargs['results_in_cache_p'] = True
         results_in_any_collection.union_update(results_in_cache)
         if verbose and of.startswith("h"):
             write_warning("Search stage 0: query found in cache, reusing cached results.", req=req)
@@ -5898,13 +6306,35 @@ def prs_intersect_results_with_collrecs(results_final, results_in_any_collection
         return page_end(req, of, ln, em)
 
 
-def prs_store_results_in_cache(query_representation_in_cache, results_in_any_collection, req=None, verbose=None, of=None, **dummy):
-    if CFG_WEBSEARCH_SEARCH_CACHE_SIZE > 0:
-        search_results_cache.set(query_representation_in_cache,
-                                 results_in_any_collection.fastdump(),
-                                 timeout=CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT)
+def search_results_collection_variant_p(cc, colls_to_search):
+    """Return True if the results of a search in collections
+    colls_to_search started from cc can be taken from the results of
+    the query restricted to cc, i.e. if the reclists of all of them
+    are included in the reclist of cc.  (Virtual sons of cc, for
+    example, do not have to be.)"""
+    if not cc or not colls_to_search:
+        return False
+    cc_reclist = get_collection_reclist(cc)
+    for coll in colls_to_search:
+        if coll != cc and not get_collection_reclist(coll).issubset(cc_reclist):
+            return False
+    return True
+
+
+def prs_store_results_in_cache(results_in_any_collection, query_representation_in_cache=None,
+                               req=None, verbose=None, of=None, cc=None, colls_to_search=None,
+                               results_in_cache_p=False, **dummy):
+    if CFG_WEBSEARCH_SEARCH_CACHE_SIZE > 0 and not results_in_cache_p:
+        cc = cc or CFG_SITE_NAME
+        if not set_search_results_in_cache(query_representation_in_cache,
+                                           results_in_any_collection):
+            # too broad query, try to cache at least its results in cc:
+            if search_results_collection_variant_p(cc, colls_to_search):
+                set_search_results_in_cache(query_representation_in_cache,
+                                            results_in_any_collection & get_collection_reclist(cc),
+                                            collection=cc)
         search_results_cache.set(query_representation_in_cache + '::cc',
-                                 dummy.get('cc', CFG_SITE_NAME),
+                                 cc,
                                  timeout=CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT)
     if verbose and of.startswith("h"):
         write_warning(req, "Search stage 3: storing query results in cache.", req=req)
@@ -6233,7 +6663,7 @@ def prs_search_common(kwargs=None, req=None, of=None, cc=None, ln=None, uid=None
                     dt=None, jrec=None, ec=None, action=None, colls_to_search=None, wash_colls_debug=None,
                     verbose=None, wl=None, em=None, **dummy):
 
-    query_representation_in_cache = get_search_results_cache_key(**kwargs)
+    kwargs['query_representation_in_cache'] = get_search_results_cache_key(**kwargs)
     page_start(req, of, cc, aas, ln, uid, p=create_page_title_search_pattern_info(p, p1, p2, p3), em=em)
 
     if of.startswith("h") and verbose and wash_colls_debug:
@@ -6270,7 +6700,7 @@ def prs_search_common(kwargs=None, req=None, of=None, cc=None, ln=None, uid=None
         return None
 
     # store this search query results into search results cache if needed:
-    prs_store_results_in_cache(query_representation_in_cache, results_in_any_collection, **kwargs)
+    prs_store_results_in_cache(results_in_any_collection, **kwargs)
 
     # search stage 4 and 5: intersection with collection universe and sorting/limiting
     try:
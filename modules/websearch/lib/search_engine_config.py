@@ -49,6 +49,26 @@ CFG_WEBSEARCH_RESULTS_OVERVIEW_MAX_COLLS_TO_PRINT = 10
 ## Prefix used for search results cache.
 CFG_SEARCH_RESULTS_CACHE_PREFIX = "search_results::"
 
+## Name of the schNOTIFY row whose version is the current generation
+## of the search results cache.
+CFG_SEARCH_RESULTS_CACHE_GENERATION_NAME = "search_results_cache"
+
+## Outside of a request (CLI, daemons) the generation of the search
+## results cache is re-read from the database at most every that many
+## seconds.
+CFG_SEARCH_RESULTS_CACHE_GENERATION_CHECK_INTERVAL = 5
+
+## The last_updated timestamps of the indexes, which empty the
+## in-process hitlist caches of the web workers, are checked at most
+## every that many seconds.
+CFG_WEBSEARCH_INDEX_LAST_UPDATED_CHECK_INTERVAL = 5
+
+## Search arguments identifying a query in the search results cache.
+CFG_SEARCH_RESULTS_CACHE_QUERY_ARGUMENTS = ('p', 'f', 'cc', 'wl', 'aas', 'ap',
+                                            'p1', 'f1', 'm1', 'op1',
+                                            'p2', 'f2', 'm2', 'op2',
+                                            'p3', 'f3', 'm3')
+
 class InvenioWebSearchUnknownCollectionError(Exception):
     """Exception for bad collection."""
     def __init__(self, colname):
@@ -280,10 +280,39 @@ class TestSearchUnitFunction(InvenioTestCase):
             search_engine.search_unit('BOOK', 'collection'))
 
 
+class TestQueryPlanner(InvenioTestCase):
+    """Test the evaluation order of basic search units."""
+
+    def test_intersections_smallest_first(self):
+        """search engine - query plan puts small known hitsets first"""
+        from invenio.intbitset import intbitset
+        units = [['+', 'a', 'title', 'w'],
+                 ['-', 'huge', 'collection', 'w'],
+                 ['+', 'rare', 'author', 'w'],
+                 ['+', 'c', 'abstract', 'w']]
+        known = {0: intbitset(range(1, 100)), 2: intbitset([5])}
+        self.assertEqual(search_engine.plan_basic_search_units(units, known),
+                         [2, 0, 3, 1])
+
+    def test_or_keeps_position(self):
+        """search engine - query plan does not move units across OR"""
+        from invenio.intbitset import intbitset
+        units = [['+', 'a', '', 'w'],
+                 ['+', 'b', '', 'w'],
+                 ['|', 'c', '', 'w'],
+                 ['-', 'd', '', 'w'],
+                 ['+', 'e', '', 'w']]
+        known = {0: intbitset(range(1, 100)), 1: intbitset([1]),
+                 4: intbitset([1, 2])}
+        self.assertEqual(search_engine.plan_basic_search_units(units, known),
+                         [1, 0, 2, 4, 3])
+
+
 TEST_SUITE = make_test_suite(TestWashQueryParameters,
                              TestQueryParser,
                              TestMiscUtilityFunctions,
-                             TestSearchUnitFunction)
+                             TestSearchUnitFunction,
+                             TestQueryPlanner)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -85,3 +85,36 @@ def get_fieldvalues(recIDs, tag, repetitive_values=True, sort=True, split_by=0):
             return [i for res in map(get_res, zip(*[iter(recIDs)]*split_by)) for i in res]
 
     return out
+
+def get_fieldvalues_for_records(recIDs, tag, chunk_size=1000):
+    """
+    Return dictionary of record ID -> list of field values for field
+    TAG of all the records RECIDS, the values of each record being in
+    the same order as returned by get_fieldvalues().  The values are
+    fetched by one query per CHUNK_SIZE records.
+    """
+    out = {}
+    if tag == "001___":
+        for recID in recIDs:
+            out[recID] = [str(recID)]
+        return out
+    digits = tag[0:2]
+    try:
+        intdigits = int(digits)
+        if intdigits < 0 or intdigits > 99:
+            raise ValueError
+    except ValueError:
+        # invalid tag value asked for
+        return out
+    bx = "bib%sx" % digits
+    bibx = "bibrec_bib%sx" % digits
+    recIDs = list(recIDs)
+    for i in xrange(0, len(recIDs), chunk_size):
+        chunk = recIDs[i:i + chunk_size]
+        query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx " \
+                "WHERE bibx.id_bibrec IN (%s) AND bx.id=bibx.id_bibxxx AND " \
+                "bx.tag LIKE %%s ORDER BY bibx.field_number, bx.tag ASC" % \
+                (bx, bibx, ("%s,"*len(chunk))[:-1])
+        for recID, value in run_sql(query, tuple(chunk) + (tag,)):
+            out.setdefault(recID, []).append(value)
+    return out
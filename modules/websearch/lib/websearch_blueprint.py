@@ -294,8 +294,9 @@ def search(collection, p, of, so, rm):
 
     collection_breadcrumbs(collection)
 
-    qid = get_search_query_id(**argd)
-    recids = perform_request_search(req=request.get_legacy_request(), **argd)
+    req = request.get_legacy_request()
+    qid = get_search_query_id(req=req, **argd)
+    recids = perform_request_search(req=req, **argd)
 
     if so or rm:
         recids.reverse()
@@ -17,36 +17,199 @@
 ## along with Invenio; if not, write to the Free Software Foundation, Inc.,
 ## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
+"""
+Search results cache shared by all the web workers.
+
+The hitsets of the queries are stored, fastdumped, in the global cache
+engine (e.g. Redis) so that pagination, facets and popular queries do
+not have to run the search again.  Entries are admitted only if their
+payload is small enough; the hitset of a broad query can still be
+cached restricted to the collection that was searched.  All the keys
+carry the current cache generation, which BibUpload, BibIndex and
+WebColl bump when they finish, so that stale results are never served
+once the records or the indexes have changed.  The generation is kept
+in the schNOTIFY table, that all the nodes share (the bibtasks run
+without the Flask application and cannot reach the cache engine), and
+is read once per request.
+"""
+
+import time
+
+from flask import g, has_request_context
+
 from invenio.cache import cache
-from invenio.search_engine_config import CFG_SEARCH_RESULTS_CACHE_PREFIX
+from invenio.config import CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT, \
+     CFG_WEBSEARCH_SEARCH_CACHE_MAX_HITSET_SIZE, \
+     CFG_BIBFORMAT_HIDDEN_TAGS
+from invenio.dbquery import run_sql
+from invenio.search_engine_config import CFG_SEARCH_RESULTS_CACHE_PREFIX, \
+     CFG_SEARCH_RESULTS_CACHE_GENERATION_NAME, \
+     CFG_SEARCH_RESULTS_CACHE_GENERATION_CHECK_INTERVAL, \
+     CFG_SEARCH_RESULTS_CACHE_QUERY_ARGUMENTS
 from invenio.hashutils import md5
+from invenio.intbitset import intbitset
 
 search_results_cache = cache
 
+CFG_SEARCH_RESULTS_CACHE_COUNTERS = ('hits', 'misses', 'rejected')
+
+## generation read outside of a request, with the time it was read at
+_SEARCH_RESULTS_CACHE_GENERATION = [None, 0]
+
+
+def get_search_results_cache_generation():
+    """
+    Returns the current generation of the search results cache.  It
+    is read from the database once per request, or at most every
+    CFG_SEARCH_RESULTS_CACHE_GENERATION_CHECK_INTERVAL seconds outside
+    of a request.
+    """
+    if has_request_context():
+        if getattr(g, 'search_results_cache_generation', None) is not None:
+            return g.search_results_cache_generation
+    elif _SEARCH_RESULTS_CACHE_GENERATION[0] is not None and \
+             time.time() - _SEARCH_RESULTS_CACHE_GENERATION[1] < \
+             CFG_SEARCH_RESULTS_CACHE_GENERATION_CHECK_INTERVAL:
+        return _SEARCH_RESULTS_CACHE_GENERATION[0]
+    res = run_sql("SELECT version FROM schNOTIFY WHERE name=%s",
+                  (CFG_SEARCH_RESULTS_CACHE_GENERATION_NAME, ))
+    generation = res and str(res[0][0]) or '0'
+    if has_request_context():
+        g.search_results_cache_generation = generation
+    else:
+        _SEARCH_RESULTS_CACHE_GENERATION[:] = [generation, time.time()]
+    return generation
+
+
+def invalidate_search_results_cache():
+    """
+    Starts a new generation of the search results cache, so that all
+    the results cached so far are ignored (and eventually expire).
+    Called by the tasks modifying records, indexes or collections.
+    """
+    run_sql("""INSERT INTO schNOTIFY (name, version, last_updated)
+               VALUES (%s, 1, NOW())
+               ON DUPLICATE KEY UPDATE version=version+1, last_updated=NOW()""",
+            (CFG_SEARCH_RESULTS_CACHE_GENERATION_NAME, ))
+    if has_request_context():
+        g.search_results_cache_generation = None
+    _SEARCH_RESULTS_CACHE_GENERATION[:] = [None, 0]
+    return get_search_results_cache_generation()
+
+
+def search_results_can_see_hidden_tags(req=None, ap=0):
+    """
+    Tells whether the search of the user behind REQ is run against
+    the hidden MARC tags too, as in search_pattern(), which makes its
+    results differ from the ones of the other users.
+    """
+    if not CFG_BIBFORMAT_HIDDEN_TAGS:
+        return False
+    if req:
+        from invenio.webuser import collect_user_info
+        return bool(collect_user_info(req).get('precached_canseehiddenmarctags',
+                                               False))
+    return ap == -9
+
 
 def get_search_query_id(**kwargs):
     """
-    Returns unique query indentifier.
+    Returns unique query indentifier.  Simple and advanced search
+    arguments are all part of it, as well as whether the user behind
+    the C{req} argument can search the hidden MARC tags.
     """
-    p = kwargs.get('p', '')
-    f = kwargs.get('f', '')
-    cc = kwargs.get('cc', '')
-    wl = kwargs.get('wl', '')
-    return md5(repr((p, f, cc, wl))).hexdigest()
+    query = [kwargs.get(arg) or '' for arg in CFG_SEARCH_RESULTS_CACHE_QUERY_ARGUMENTS]
+    query.append(search_results_can_see_hidden_tags(kwargs.get('req'),
+                                                    kwargs.get('ap') or 0))
+    return md5(repr(tuple(query))).hexdigest()
 
 
 def get_search_results_cache_key(**kwargs):
     """
     Returns key for search results cache.
     """
-    return CFG_SEARCH_RESULTS_CACHE_PREFIX + get_search_query_id(**kwargs)
+    return get_search_results_cache_key_from_qid(get_search_query_id(**kwargs))
 
 
 def get_search_results_cache_key_from_qid(qid):
     """
     Returns key for search results cache from query identifier.
     """
-    return CFG_SEARCH_RESULTS_CACHE_PREFIX + qid
+    return CFG_SEARCH_RESULTS_CACHE_PREFIX + \
+           get_search_results_cache_generation() + '::' + qid
+
+
+def _get_collection_variant_key(key, collection):
+    """
+    Returns key of the results of query 'key' restricted to collection.
+    """
+    return key + '::coll::' + md5(collection).hexdigest()
+
+
+def _increment_counter(name):
+    """
+    Increments the shared counter 'name' of the search results cache.
+    """
+    try:
+        search_results_cache.cache.inc(CFG_SEARCH_RESULTS_CACHE_PREFIX +
+                                       'stats::' + name)
+    except Exception:
+        pass
+
+
+def get_search_results_from_cache(key, collection=None):
+    """
+    Returns the cached hitset of the query 'key', or None.  If the
+    query is not cached for all the collections, its results restricted
+    to 'collection' are looked up, if given.
+    """
+    keys = [key]
+    if collection is not None:
+        keys.append(_get_collection_variant_key(key, collection))
+    for variant_key in keys:
+        try:
+            data = search_results_cache.get(variant_key)
+            if data is not None:
+                hitset = intbitset(data)
+                _increment_counter('hits')
+                return hitset
+        except Exception:
+            pass
+    _increment_counter('misses')
+    return None
+
+
+def set_search_results_in_cache(key, hitset, collection=None,
+                                timeout=CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT):
+    """
+    Stores the hitset of the query 'key', or its restriction to
+    'collection' if given, in the cache.  Returns False if the hitset
+    is too big to be admitted.
+    """
+    data = hitset.fastdump()
+    if CFG_WEBSEARCH_SEARCH_CACHE_MAX_HITSET_SIZE > 0 and \
+           len(data) > CFG_WEBSEARCH_SEARCH_CACHE_MAX_HITSET_SIZE:
+        _increment_counter('rejected')
+        return False
+    if collection is not None:
+        key = _get_collection_variant_key(key, collection)
+    search_results_cache.set(key, data, timeout=timeout)
+    return True
+
+
+def get_search_results_cache_statistics():
+    """
+    Returns dictionary with the hit, miss and rejection counters of
+    the search results cache and its current generation.
+    """
+    out = {'generation': get_search_results_cache_generation()}
+    for name in CFG_SEARCH_RESULTS_CACHE_COUNTERS:
+        try:
+            out[name] = int(search_results_cache.get(
+                CFG_SEARCH_RESULTS_CACHE_PREFIX + 'stats::' + name) or 0)
+        except Exception:
+            out[name] = 0
+    return out
 
 
 def get_collection_name_from_cache(qid):
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the search results cache."""
+
+__revision__ = "$Id$"
+
+from invenio.importutils import lazy_import
+from invenio.testutils import make_test_suite, run_test_suite, InvenioTestCase
+
+websearch_cache = lazy_import('invenio.websearch_cache')
+
+
+class TestSearchResultsCacheGeneration(InvenioTestCase):
+    """Test the invalidation of the search results cache."""
+
+    def setUp(self):
+        """Keep the generation in memory instead of schNOTIFY"""
+        self.versions = {}
+        self.queries = []
+        self.run_sql = websearch_cache.run_sql
+        websearch_cache.run_sql = self._run_sql
+        websearch_cache._SEARCH_RESULTS_CACHE_GENERATION[:] = [None, 0]
+
+    def tearDown(self):
+        """Restore the database access"""
+        websearch_cache.run_sql = self.run_sql
+        websearch_cache._SEARCH_RESULTS_CACHE_GENERATION[:] = [None, 0]
+
+    def _run_sql(self, sql, param=None):
+        """Minimal schNOTIFY emulation"""
+        self.queries.append(sql)
+        name = param[0]
+        if sql.startswith('SELECT'):
+            if name in self.versions:
+                return ((self.versions[name], ), )
+            return ()
+        self.versions[name] = self.versions.get(name, 0) + 1
+        return 1
+
+    def test_missing_generation(self):
+        """websearch cache - default generation"""
+        self.assertEqual('0', websearch_cache.get_search_results_cache_generation())
+
+    def test_generation_read_once(self):
+        """websearch cache - generation is not re-read for every key"""
+        first = websearch_cache.get_search_results_cache_key(p='ellis')
+        second = websearch_cache.get_search_results_cache_key(p='ellis')
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(self.queries))
+
+    def test_invalidation(self):
+        """websearch cache - invalidation starts a new generation"""
+        key = websearch_cache.get_search_results_cache_key(p='ellis')
+        first = websearch_cache.invalidate_search_results_cache()
+        self.assertEqual(first, websearch_cache.get_search_results_cache_generation())
+        self.assertNotEqual(key, websearch_cache.get_search_results_cache_key(p='ellis'))
+        second = websearch_cache.invalidate_search_results_cache()
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, websearch_cache.get_search_results_cache_generation())
+
+
+class TestSearchResultsCacheKeys(InvenioTestCase):
+    """Test the keys of the search results cache."""
+
+    def test_query_id(self):
+        """websearch cache - query identifier ignores other arguments"""
+        self.assertEqual(websearch_cache.get_search_query_id(p='ellis', cc='Articles'),
+                         websearch_cache.get_search_query_id(p='ellis', cc='Articles', jrec=11))
+        self.assertNotEqual(websearch_cache.get_search_query_id(p='ellis', cc='Articles'),
+                            websearch_cache.get_search_query_id(p='ellis', cc='Books'))
+
+    def test_advanced_query_id(self):
+        """websearch cache - advanced and simple searches differ"""
+        self.assertNotEqual(websearch_cache.get_search_query_id(p='ellis', cc='Articles'),
+                            websearch_cache.get_search_query_id(p='ellis', cc='Articles', aas=1,
+                                                                p1='muon', f1='title', m1='a'))
+        self.assertNotEqual(websearch_cache.get_search_query_id(p='ellis', p1='muon', op1='a'),
+                            websearch_cache.get_search_query_id(p='ellis', p1='muon', op1='n'))
+
+
+TEST_SUITE = make_test_suite(TestSearchResultsCacheGeneration,
+                             TestSearchResultsCacheKeys, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
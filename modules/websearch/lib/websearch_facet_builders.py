@@ -24,7 +24,9 @@ from werkzeug.utils import cached_property
 from flask import g, url_for, request, abort, current_app
 
 from invenio.websearch_cache import search_results_cache, \
-                                    get_search_results_cache_key_from_qid
+                                    get_search_results_cache_key_from_qid, \
+                                    get_search_results_cache_generation, \
+                                    get_search_results_from_cache
 from invenio.intbitset import intbitset as HitSet
 from invenio.config import CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT, CFG_PYLIBDIR
 from invenio.pluginutils import PluginContainer
@@ -34,6 +36,8 @@ from invenio.search_engine import search_pattern, \
                                   get_field_tags, \
                                   get_records_that_can_be_displayed, \
                                   get_most_popular_field_values
+from invenio.websearch_facet_index import CFG_NUMPY_IMPORTABLE, \
+                                  get_most_popular_field_values_in_hitset
 
 
 def get_current_user_records_that_can_be_displayed(qid):
@@ -45,16 +49,16 @@ def get_current_user_records_that_can_be_displayed(qid):
     @return: records in intbitset
     """
     @search_results_cache.memoize(timeout=CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT)
-    def get_records_for_user(qid, uid):
+    def get_records_for_user(qid, uid, generation):
         key = get_search_results_cache_key_from_qid(qid)
-        data = search_results_cache.get(key)
-        if data is None:
-            return []
         cc = search_results_cache.get(key + '::cc')
-        return get_records_that_can_be_displayed(current_user,
-                                                 HitSet().fastload(data), cc)
+        hitset = get_search_results_from_cache(key, collection=cc)
+        if hitset is None:
+            return []
+        return get_records_that_can_be_displayed(current_user, hitset, cc)
     # Simplifies API
-    return get_records_for_user(qid, current_user.get_id())
+    return get_records_for_user(qid, current_user.get_id(),
+                                get_search_results_cache_generation())
 
 
 def faceted_results_filter(recids, filter_data, facets):
@@ -165,6 +169,11 @@ class FacetBuilder(object):
         return self.get_recids_intbitset(qid).tolist()
 
     def get_facets_for_query(self, qid, limit=20, parent=None):
+        if CFG_NUMPY_IMPORTABLE:
+            facets = get_most_popular_field_values_in_hitset(
+                self.get_recids_intbitset(qid), self.name, limit=limit)
+            if facets is not None:
+                return facets
         return get_most_popular_field_values(self.get_recids(qid),
                                              get_field_tags(self.name)
                                              )[0:limit]
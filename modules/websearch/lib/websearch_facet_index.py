@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Precomputed field values of all the records, for facet counting.
+
+get_most_popular_field_values() fetches the values of the hits from
+the bibXXx tables and counts them in Python, which is far too slow for
+queries with hundreds of thousands of hits.  Here, for the tags of a
+facet field, two parallel arrays list all the (recid, value id)
+occurrences of the repository.  The counts of a hitset are then
+obtained by masking the occurrences of its recids and counting the
+value ids with numpy.bincount().
+
+The indexes are stored in the facetINDEX table, so that all the nodes
+share them.  WebColl builds them and then updates them with the values
+of the records modified since its previous run.  Web workers only load
+them, when their last_updated time changes; a field without index is
+registered in the table for the next WebColl run, and meanwhile its
+facet is counted the old way.
+"""
+
+__revision__ = "$Id$"
+
+from array import array
+
+try:
+    ## import optional module:
+    import numpy
+    CFG_NUMPY_IMPORTABLE = True
+except ImportError:
+    CFG_NUMPY_IMPORTABLE = False
+
+from invenio.dbquery import run_sql, serialize_via_marshal, \
+     deserialize_via_marshal
+from invenio.data_cacher import DataCacher
+from invenio.intbitset import intbitset
+
+## number of records whose values are fetched by one SQL query when
+## the index is built:
+CFG_WEBSEARCH_FACET_INDEX_CHUNK_SIZE = 50000
+
+## the arrays are stored as little-endian 32-bit integers, so that
+## all the nodes can load them:
+CFG_WEBSEARCH_FACET_INDEX_DTYPE = '<i4'
+
+
+class FacetValuesIndex(object):
+    """
+    Field values of all the records, stored as an array of recids and
+    an array of value ids, one item per occurrence of a value.
+    """
+
+    def __init__(self, pairs=()):
+        """
+        @param pairs: iterable of (recid, value) occurrences
+        """
+        self.values = []
+        self._value_ids = {}
+        self.recids, self.value_ids = self._get_occurrences_arrays(pairs)
+        self._update_max_recid()
+        self._update_ranks()
+
+    def _get_occurrences_arrays(self, pairs):
+        """Return the arrays of the recids and of the value ids of the
+        (recid, value) occurrences of pairs, adding the new values."""
+        recids = array('i')
+        value_ids = array('i')
+        for recid, value in pairs:
+            value_id = self._value_ids.get(value)
+            if value_id is None:
+                value_id = self._value_ids[value] = len(self.values)
+                self.values.append(value)
+            recids.append(recid)
+            value_ids.append(value_id)
+        return (numpy.frombuffer(recids, dtype=numpy.intc).astype(CFG_WEBSEARCH_FACET_INDEX_DTYPE),
+                numpy.frombuffer(value_ids, dtype=numpy.intc).astype(CFG_WEBSEARCH_FACET_INDEX_DTYPE))
+
+    def _update_max_recid(self):
+        self.max_recid = 0
+        if len(self.recids):
+            self.max_recid = int(self.recids.max())
+
+    def _update_ranks(self):
+        """Compute the rank of every value in the case-insensitive
+        alphabetical order, used to break ties between equally
+        frequent values."""
+        order = sorted(xrange(len(self.values)),
+                       key=lambda value_id: self.values[value_id].lower())
+        self.ranks = numpy.empty(len(self.values), dtype=CFG_WEBSEARCH_FACET_INDEX_DTYPE)
+        self.ranks[order] = numpy.arange(len(self.values))
+
+    def __len__(self):
+        """Return the number of occurrences."""
+        return len(self.recids)
+
+    def _get_recids_mask(self, recids):
+        """Return the boolean array telling, for every recid up to
+        max_recid, whether it belongs to recids."""
+        mask = numpy.zeros(self.max_recid + 1, dtype=numpy.bool_)
+        if len(recids):
+            recids = numpy.fromiter(recids, dtype=numpy.intc, count=len(recids))
+            mask[recids[recids <= self.max_recid]] = True
+        return mask
+
+    def update(self, recids, pairs):
+        """
+        Replace the occurrences of the records recids by the (recid,
+        value) occurrences of pairs, i.e. by their current values.
+        Values that are no longer used keep their value id.
+        """
+        if len(self.recids):
+            kept = ~self._get_recids_mask(recids)[self.recids]
+            self.recids = self.recids[kept]
+            self.value_ids = self.value_ids[kept]
+        nb_values = len(self.values)
+        recids, value_ids = self._get_occurrences_arrays(pairs)
+        self.recids = numpy.concatenate((self.recids, recids))
+        self.value_ids = numpy.concatenate((self.value_ids, value_ids))
+        self._update_max_recid()
+        if len(self.values) != nb_values:
+            self._update_ranks()
+
+    def dumps(self):
+        """Return the index serialized for the facetINDEX table."""
+        return serialize_via_marshal((self.values,
+                                      self.recids.tostring(),
+                                      self.value_ids.tostring(),
+                                      self.ranks.tostring()))
+
+    def loads(self, data):
+        """Load the index serialized by dumps()."""
+        values, recids, value_ids, ranks = deserialize_via_marshal(data)
+        self.values = values
+        self._value_ids = dict((value, value_id) for value_id, value in enumerate(values))
+        self.recids = numpy.frombuffer(recids, dtype=CFG_WEBSEARCH_FACET_INDEX_DTYPE)
+        self.value_ids = numpy.frombuffer(value_ids, dtype=CFG_WEBSEARCH_FACET_INDEX_DTYPE)
+        self.ranks = numpy.frombuffer(ranks, dtype=CFG_WEBSEARCH_FACET_INDEX_DTYPE)
+        self._update_max_recid()
+        return self
+
+    def count(self, hitset):
+        """Return the array of the frequencies of all the values in
+        the records of hitset."""
+        if not len(hitset) or not len(self.recids):
+            return numpy.zeros(len(self.values), dtype=numpy.intp)
+        found = self.value_ids[self._get_recids_mask(hitset)[self.recids]]
+        if not len(found):
+            return numpy.zeros(len(self.values), dtype=numpy.intp)
+        return numpy.bincount(found, minlength=len(self.values))
+
+    def get_most_popular_values(self, hitset, limit=None, exclude_values=None):
+        """
+        Return the list of (value, frequency) of the values of the
+        records of hitset sorted by descending frequency and then
+        alphabetically, like get_most_popular_field_values() does.
+        Only the 'limit' most popular values are sorted and returned,
+        if given.
+        """
+        counts = self.count(hitset)
+        for value in exclude_values or ():
+            value_id = self._value_ids.get(value)
+            if value_id is not None:
+                counts[value_id] = 0
+        found = numpy.flatnonzero(counts)
+        if limit and len(found) > limit:
+            ## top-k: keep only the values at least as frequent as the
+            ## limit-th most frequent one
+            found_counts = counts[found]
+            if hasattr(numpy, 'partition'):
+                threshold = numpy.partition(found_counts, len(found) - limit)[len(found) - limit]
+            else:
+                threshold = numpy.sort(found_counts)[len(found) - limit]
+            found = found[found_counts >= threshold]
+        found = found[numpy.lexsort((self.ranks[found], -counts[found]))]
+        if limit:
+            found = found[:limit]
+        return [(self.values[value_id], int(counts[value_id]))
+                for value_id in found]
+
+
+def get_field_values_occurrences(tags, recids=None):
+    """
+    Return iterator over the (recid, value) occurrences of the MARC
+    tags of all the records, or of the records recids if given.  Tags
+    may contain the '%' wildcard.
+    """
+    if recids is None:
+        max_recid = run_sql("SELECT MAX(id) FROM bibrec")[0][0] or 0
+        chunks = [("BETWEEN %s AND %s", (start, start + CFG_WEBSEARCH_FACET_INDEX_CHUNK_SIZE - 1))
+                  for start in xrange(1, max_recid + 1, CFG_WEBSEARCH_FACET_INDEX_CHUNK_SIZE)]
+    else:
+        recids = list(recids)
+        chunks = []
+        for start in xrange(0, len(recids), CFG_WEBSEARCH_FACET_INDEX_CHUNK_SIZE):
+            chunk = tuple(recids[start:start + CFG_WEBSEARCH_FACET_INDEX_CHUNK_SIZE])
+            chunks.append(("IN (%s)" % ','.join(['%s'] * len(chunk)), chunk))
+    for tag in tags:
+        digits = tag[0:2]
+        try:
+            intdigits = int(digits)
+            if intdigits < 0 or intdigits > 99:
+                raise ValueError
+        except ValueError:
+            # invalid tag value asked for
+            continue
+        bx = "bib%sx" % digits
+        bibx = "bibrec_bib%sx" % digits
+        for condition, params in chunks:
+            query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx " \
+                    "WHERE bibx.id_bibrec %s " \
+                    "AND bx.id=bibx.id_bibxxx AND bx.tag LIKE %%s" % (bx, bibx, condition)
+            for row in run_sql(query, params + (tag, )):
+                yield row
+
+
+def get_facet_values_index_fields():
+    """Return the fields whose facet values index is maintained."""
+    return [row[0] for row in run_sql("SELECT field FROM facetINDEX")]
+
+
+def update_facet_values_index(field, tags, force=False):
+    """
+    Update the facet values index of field, whose MARC tags are tags,
+    with the values of the records modified since it was last updated,
+    or build it if it does not exist yet or if force is set.  Return
+    the number of records whose values were (re)read.
+    """
+    modified_until = str(run_sql("SELECT NOW()")[0][0])
+    res = run_sql("SELECT data, modified_until FROM facetINDEX WHERE field=%s",
+                  (field, ))
+    if res and res[0][0] is not None and not force:
+        index = FacetValuesIndex().loads(res[0][0])
+        recids = intbitset(run_sql("SELECT id FROM bibrec WHERE modification_date>=%s",
+                                   (res[0][1], )))
+        if not recids:
+            ## Nothing to do; the web workers keep their index.
+            run_sql("UPDATE facetINDEX SET modified_until=%s WHERE field=%s",
+                    (modified_until, field))
+            return 0
+        index.update(recids, get_field_values_occurrences(tags, recids))
+        nb_records = len(recids)
+    else:
+        index = FacetValuesIndex(get_field_values_occurrences(tags))
+        nb_records = len(numpy.unique(index.recids))
+    run_sql("""INSERT INTO facetINDEX (field, data, modified_until, last_updated)
+               VALUES (%s, %s, %s, NOW())
+               ON DUPLICATE KEY UPDATE data=VALUES(data),
+               modified_until=VALUES(modified_until), last_updated=NOW()""",
+            (field, index.dumps(), modified_until))
+    return nb_records
+
+
+class FacetValuesDataCacher(DataCacher):
+    """
+    Cache holding the FacetValuesIndex of the given field, as stored
+    in the facetINDEX table, or None if there is none yet.
+    """
+    def __init__(self, field):
+        self.field = field
+
+        def cache_filler():
+            try:
+                res = run_sql("SELECT data FROM facetINDEX WHERE field=%s",
+                              (self.field, ))
+                if not res:
+                    ## to be built by the next WebColl run:
+                    run_sql("INSERT IGNORE INTO facetINDEX (field) VALUES (%s)",
+                            (self.field, ))
+                    return None
+            except Exception:
+                # database problems, no index
+                return None
+            if res[0][0] is None:
+                return None
+            return FacetValuesIndex().loads(res[0][0])
+
+        def timestamp_verifier():
+            try:
+                res = run_sql("SELECT last_updated FROM facetINDEX WHERE field=%s",
+                              (self.field, ))
+            except Exception:
+                res = None
+            if res:
+                return str(res[0][0])
+            return "1970-01-01 00:00:00"
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+_FACET_VALUES_CACHE = {}
+
+
+def get_most_popular_field_values_in_hitset(hitset, field, limit=None,
+                                            exclude_values=None):
+    """
+    Return the list of (value, frequency) of the values of field in
+    the records of hitset, sorted by descending frequency and then
+    alphabetically.  Equivalent to get_most_popular_field_values()
+    with count_repetitive_values=True, but uses the facet values index
+    of the field.  Return None if there is no index for the field yet.
+    Requires numpy.
+    """
+    try:
+        cacher = _FACET_VALUES_CACHE[field]
+        cacher.recreate_cache_if_needed()
+    except KeyError:
+        cacher = _FACET_VALUES_CACHE[field] = FacetValuesDataCacher(field)
+    if cacher.cache is None:
+        return None
+    return cacher.cache.get_most_popular_values(hitset, limit, exclude_values)
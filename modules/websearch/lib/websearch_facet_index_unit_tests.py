@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the facet values index."""
+
+__revision__ = "$Id$"
+
+from invenio.importutils import lazy_import
+from invenio.testutils import make_test_suite, run_test_suite, InvenioTestCase
+from invenio.intbitset import intbitset
+
+websearch_facet_index = lazy_import('invenio.websearch_facet_index')
+
+
+class TestFacetValuesIndex(InvenioTestCase):
+    """Test facet counting over the facet values index."""
+
+    def setUp(self):
+        """Index a few occurrences"""
+        if not websearch_facet_index.CFG_NUMPY_IMPORTABLE:
+            self.index = None
+            return
+        self.index = websearch_facet_index.FacetValuesIndex([
+            (1, 'Ellis, J'), (2, 'Ellis, J'), (2, 'ellis, n'), (3, 'Bob'),
+            (3, 'Bob'), (5, 'Ellis, N'), (9, 'Zed')])
+
+    def test_most_popular_values(self):
+        """websearch facet index - frequencies, then alphabetical order"""
+        if self.index is None:
+            return
+        self.assertEqual([('Bob', 2), ('Ellis, J', 2), ('ellis, n', 1), ('Ellis, N', 1)],
+                         self.index.get_most_popular_values(intbitset([1, 2, 3, 5, 10])))
+
+    def test_top_values(self):
+        """websearch facet index - limit and excluded values"""
+        if self.index is None:
+            return
+        hitset = intbitset([1, 2, 3, 5, 9])
+        self.assertEqual([('Bob', 2), ('Ellis, J', 2)],
+                         self.index.get_most_popular_values(hitset, limit=2))
+        self.assertEqual([('Ellis, J', 2), ('ellis, n', 1)],
+                         self.index.get_most_popular_values(hitset, limit=2,
+                                                            exclude_values=['Bob']))
+
+    def test_empty(self):
+        """websearch facet index - empty hitset and empty index"""
+        if self.index is None:
+            return
+        self.assertEqual([], self.index.get_most_popular_values(intbitset()))
+        self.assertEqual([], websearch_facet_index.FacetValuesIndex().get_most_popular_values(intbitset([1])))
+
+    def test_serialization(self):
+        """websearch facet index - stored index gives the same counts"""
+        if self.index is None:
+            return
+        index = websearch_facet_index.FacetValuesIndex().loads(self.index.dumps())
+        hitset = intbitset([1, 2, 3, 5, 9])
+        self.assertEqual(self.index.get_most_popular_values(hitset),
+                         index.get_most_popular_values(hitset))
+
+    def test_update(self):
+        """websearch facet index - update with the values of modified records"""
+        if self.index is None:
+            return
+        ## record 3 was modified, record 9 deleted and record 12 created
+        self.index.update(intbitset([3, 9, 12]), [(3, 'Alice'), (12, 'Zed')])
+        self.assertEqual([('Ellis, J', 2), ('Alice', 1), ('ellis, n', 1), ('Ellis, N', 1), ('Zed', 1)],
+                         self.index.get_most_popular_values(intbitset(range(1, 20))))
+        self.assertEqual([('Zed', 1)],
+                         self.index.get_most_popular_values(intbitset([9, 12])))
+
+
+TEST_SUITE = make_test_suite(TestFacetValuesIndex, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -782,6 +782,17 @@ class CollectionFieldFieldvalue(db.Model):
                 lazy='joined')
 
 
+class FacetINDEX(db.Model):
+    """Represents a FacetINDEX record."""
+    __tablename__ = 'facetINDEX'
+    field = db.Column(db.String(255), primary_key=True, nullable=False)
+    data = db.Column(db.LargeBinary)
+    modified_until = db.Column(db.DateTime, nullable=False,
+                server_default='1900-01-01 00:00:00')
+    last_updated = db.Column(db.DateTime, nullable=False,
+                server_default='1900-01-01 00:00:00')
+
+
 __all__ = ['Collection',
            'Collectionname',
            'Collectiondetailedrecordpagetabs',
@@ -802,4 +813,5 @@ __all__ = ['Collection',
            'FieldTag',
            'WebQuery',
            'UserQuery',
-           'CollectionFieldFieldvalue']
+           'CollectionFieldFieldvalue',
+           'FacetINDEX']
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Versioned binary snapshot of the collection reclists.
+
+webcoll publishes the reclists of all the collections in one file:
+
+    header | index | reclists
+
+where the header holds a magic string and the length of the index,
+the index is a marshalled dictionary with the version of the snapshot,
+the time up to which record modifications are reflected in it and,
+for each collection, the position, length and checksum of its
+fastdumped reclist and the dbquery it was computed from.  Web workers
+map the file and deserialize the reclist of a collection only when it
+is first needed; when a new snapshot is published, they keep the
+reclists whose checksum did not change.  The file is replaced by an
+atomic rename, so that readers always see a consistent snapshot, and
+a mapping is released only when the last reference to it goes away,
+since other threads may still be reading it.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import mmap
+import marshal
+import struct
+import tempfile
+import time
+import zlib
+
+from invenio.config import CFG_CACHEDIR
+from invenio.intbitset import intbitset
+
+CFG_WEBSEARCH_RECLIST_SNAPSHOT_PATH = os.path.join(CFG_CACHEDIR, 'collections',
+                                                   'reclists.snapshot')
+
+CFG_WEBSEARCH_RECLIST_SNAPSHOT_MAGIC = 'INVRCLS1'
+CFG_WEBSEARCH_RECLIST_SNAPSHOT_HEADER = '<8sI' # magic, index length
+CFG_WEBSEARCH_RECLIST_SNAPSHOT_HEADER_SIZE = struct.calcsize(CFG_WEBSEARCH_RECLIST_SNAPSHOT_HEADER)
+
+
+class InvenioWebSearchReclistSnapshotError(Exception):
+    """Error raised for missing or corrupted reclist snapshots."""
+    pass
+
+
+def write_reclist_snapshot(collections, modified_until, version,
+                           path=CFG_WEBSEARCH_RECLIST_SNAPSHOT_PATH):
+    """
+    Write the reclist snapshot 'path'.
+
+    @param collections: dictionary of collection name -> (reclist,
+        dbquery)
+    @param modified_until: timestamp ('%Y-%m-%d %H:%M:%S') up to which
+        the record modifications are reflected in the reclists
+    @param version: version number of the snapshot
+    """
+    blobs = []
+    entries = {}
+    offset = 0
+    for name, (reclist, dbquery) in collections.iteritems():
+        blob = reclist.fastdump()
+        entries[name] = (offset, len(blob), zlib.crc32(blob) & 0xffffffff,
+                         dbquery)
+        blobs.append(blob)
+        offset += len(blob)
+    index = marshal.dumps({'version': version,
+                           'modified_until': modified_until,
+                           'collections': entries})
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp', dir=directory)
+    try:
+        tmp_file = os.fdopen(fd, 'wb')
+        try:
+            tmp_file.write(struct.pack(CFG_WEBSEARCH_RECLIST_SNAPSHOT_HEADER,
+                                       CFG_WEBSEARCH_RECLIST_SNAPSHOT_MAGIC,
+                                       len(index)))
+            tmp_file.write(index)
+            for blob in blobs:
+                tmp_file.write(blob)
+        finally:
+            tmp_file.close()
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ReclistSnapshot(object):
+    """
+    Read-only, memory-mapped reclist snapshot.  Reclists are
+    deserialized on demand.
+    """
+
+    def __init__(self, path=CFG_WEBSEARCH_RECLIST_SNAPSHOT_PATH):
+        self.path = path
+        snapshot_file = open(path, 'rb')
+        try:
+            self.mtime = os.fstat(snapshot_file.fileno()).st_mtime
+            self._map = mmap.mmap(snapshot_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        finally:
+            snapshot_file.close()
+        if len(self._map) < CFG_WEBSEARCH_RECLIST_SNAPSHOT_HEADER_SIZE:
+            raise InvenioWebSearchReclistSnapshotError("%s is truncated" % path)
+        magic, index_length = struct.unpack(
+            CFG_WEBSEARCH_RECLIST_SNAPSHOT_HEADER,
+            self._map[:CFG_WEBSEARCH_RECLIST_SNAPSHOT_HEADER_SIZE])
+        if magic != CFG_WEBSEARCH_RECLIST_SNAPSHOT_MAGIC:
+            raise InvenioWebSearchReclistSnapshotError("%s is not a reclist snapshot" % path)
+        self._blobs_start = CFG_WEBSEARCH_RECLIST_SNAPSHOT_HEADER_SIZE + index_length
+        try:
+            index = marshal.loads(self._map[CFG_WEBSEARCH_RECLIST_SNAPSHOT_HEADER_SIZE:
+                                            self._blobs_start])
+        except (ValueError, EOFError, TypeError):
+            raise InvenioWebSearchReclistSnapshotError("%s has a corrupted index" % path)
+        self.version = index['version']
+        self.modified_until = index['modified_until']
+        self._entries = index['collections']
+
+    def get_timestamp(self):
+        """Return the time at which the snapshot was published."""
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.mtime))
+
+    def has_collection(self, name):
+        return name in self._entries
+
+    def get_checksum(self, name):
+        """Return the checksum of the reclist of collection 'name', or
+        None if the collection is not in the snapshot."""
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        return entry[2]
+
+    def get_dbquery(self, name):
+        """Return the dbquery the reclist of collection 'name' was
+        computed from."""
+        return self._entries[name][3]
+
+    def get_reclist(self, name):
+        """Return the reclist of collection 'name', or None if the
+        collection is not in the snapshot."""
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        offset, length = entry[0], entry[1]
+        start = self._blobs_start + offset
+        if start + length > len(self._map):
+            raise InvenioWebSearchReclistSnapshotError("%s is truncated" % self.path)
+        return intbitset(self._map[start:start + length])
+
+
+def load_reclist_snapshot(path=CFG_WEBSEARCH_RECLIST_SNAPSHOT_PATH):
+    """Return the ReclistSnapshot stored in 'path', or None if there is
+    no valid snapshot."""
+    try:
+        return ReclistSnapshot(path)
+    except (IOError, OSError, mmap.error, InvenioWebSearchReclistSnapshotError):
+        return None
+
+
+def get_reclist_snapshot_timestamp(path=CFG_WEBSEARCH_RECLIST_SNAPSHOT_PATH):
+    """Return the time at which the snapshot 'path' was published, or
+    an old date if there is none."""
+    try:
+        return time.strftime("%Y-%m-%d %H:%M:%S",
+                             time.localtime(os.path.getmtime(path)))
+    except OSError:
+        return "1970-01-01 00:00:00"
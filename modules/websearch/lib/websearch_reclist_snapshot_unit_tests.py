@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the collection reclist snapshots."""
+
+__revision__ = "$Id$"
+
+import os
+import shutil
+import tempfile
+
+from invenio.importutils import lazy_import
+from invenio.testutils import make_test_suite, run_test_suite, InvenioTestCase
+from invenio.intbitset import intbitset
+
+websearch_reclist_snapshot = lazy_import('invenio.websearch_reclist_snapshot')
+
+
+class TestReclistSnapshot(InvenioTestCase):
+    """Test writing and reading of reclist snapshots."""
+
+    def setUp(self):
+        """Write a small snapshot"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'reclists.snapshot')
+        self.collections = {'Preprints': (intbitset([1, 2, 3]), 'collection:PREPRINT'),
+                            'Atlantis Institute of Fictive Science': (intbitset([1, 2, 3, 10]), None),
+                            'Empty': (intbitset(), 'collection:EMPTY')}
+        websearch_reclist_snapshot.write_reclist_snapshot(self.collections,
+                                                          '2013-06-27 10:00:00',
+                                                          3, self.path)
+        self.snapshot = websearch_reclist_snapshot.ReclistSnapshot(self.path)
+
+    def tearDown(self):
+        """Remove the snapshot"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_reclists(self):
+        """websearch reclist snapshot - reclists and dbqueries"""
+        for name, (reclist, dbquery) in self.collections.items():
+            self.assertEqual(reclist, self.snapshot.get_reclist(name))
+            self.assertEqual(dbquery, self.snapshot.get_dbquery(name))
+        self.assertEqual(None, self.snapshot.get_reclist('Unknown'))
+        self.failIf(self.snapshot.has_collection('Unknown'))
+
+    def test_header(self):
+        """websearch reclist snapshot - version and modification time"""
+        self.assertEqual(3, self.snapshot.version)
+        self.assertEqual('2013-06-27 10:00:00', self.snapshot.modified_until)
+
+    def test_checksums(self):
+        """websearch reclist snapshot - checksums follow the content"""
+        collections = dict(self.collections)
+        collections['Preprints'] = (intbitset([1, 2]), 'collection:PREPRINT')
+        websearch_reclist_snapshot.write_reclist_snapshot(collections,
+                                                          '2013-06-27 11:00:00',
+                                                          4, self.path)
+        new_snapshot = websearch_reclist_snapshot.ReclistSnapshot(self.path)
+        self.assertNotEqual(self.snapshot.get_checksum('Preprints'),
+                            new_snapshot.get_checksum('Preprints'))
+        self.assertEqual(self.snapshot.get_checksum('Empty'),
+                         new_snapshot.get_checksum('Empty'))
+        ## the old mapping is still valid
+        self.assertEqual(intbitset([1, 2, 3]), self.snapshot.get_reclist('Preprints'))
+        self.assertEqual(['reclists.snapshot'], os.listdir(self.tmpdir))
+
+    def test_missing_snapshot(self):
+        """websearch reclist snapshot - missing or corrupted snapshot"""
+        self.assertEqual(None, websearch_reclist_snapshot.load_reclist_snapshot(
+            os.path.join(self.tmpdir, 'missing')))
+        corrupted = os.path.join(self.tmpdir, 'corrupted')
+        open(corrupted, 'w').write('INVALID!' * 4)
+        self.assertEqual(None, websearch_reclist_snapshot.load_reclist_snapshot(corrupted))
+
+
+TEST_SUITE = make_test_suite(TestReclistSnapshot, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -51,9 +51,10 @@ from invenio.search_engine import perform_request_search, \
     guess_primary_collection_of_a_record, guess_collection_of_a_record, \
     collection_restricted_p, get_permitted_restricted_collections, \
     search_pattern, search_unit, search_unit_in_bibrec, \
-    wash_colls, record_public_p
+    wash_colls, record_public_p, create_basic_search_units, \
+    search_units_in_bibwords
 from invenio import search_engine_summarizer
-from invenio.search_engine_utils import get_fieldvalues
+from invenio.search_engine_utils import get_fieldvalues, get_fieldvalues_for_records
 from invenio.intbitset import intbitset
 from invenio.search_engine import intersect_results_with_collrecs
 from invenio.bibrank_bridge_utils import get_external_word_similarity_ranker
@@ -1099,6 +1100,15 @@ class WebSearchBooleanQueryTest(unittest.TestCase):
                          test_web_page_content(CFG_SITE_URL + '/search?m1=a&p1=ellis&op1=a&m2=a&p2=muon&op2=a&p3=letter',
                                                expected_text="Boolean query returned no hits. Please combine your search terms differently."))
 
+    def test_batched_word_lookup_matches_individual_lookup(self):
+        """ websearch - batched word lookup gives same hitsets as search_unit """
+        units = create_basic_search_units(None, 'ellis muon title:of author:aoeuidhtns ell*', '')
+        prefetched = search_units_in_bibwords(units)
+        self.failIf(4 in prefetched) # wildcard unit is not batched
+        for idx_unit, hitset in prefetched.items():
+            self.assertEqual(search_unit(units[idx_unit][1], units[idx_unit][2], units[idx_unit][3]),
+                             hitset)
+
 
 class WebSearchAuthorQueryTest(unittest.TestCase):
     """Check various author-related queries."""
@@ -2333,6 +2343,16 @@ class WebSearchGetFieldValuesTest(unittest.TestCase):
         self.assertEqual(get_fieldvalues([18, 13], '700__a'),
                          ['Dawson, S', 'Ellis, R K', 'Enqvist, K', 'Nanopoulos, D V'])
 
+    def test_get_fieldvalues_for_records(self):
+        """websearch - get_fieldvalues_for_records() per record, in chunks"""
+        self.assertEqual(get_fieldvalues_for_records([], '700__a'), {})
+        self.assertEqual(get_fieldvalues_for_records([10, 13], '001___'),
+                         {10: ['10'], 13: ['13']})
+        values = get_fieldvalues_for_records([18, 13, 10], '700__a', chunk_size=2)
+        self.assertEqual(values[18], get_fieldvalues(18, '700__a'))
+        self.assertEqual(values[13], get_fieldvalues(13, '700__a'))
+        self.assertEqual(values.get(10, []), get_fieldvalues(10, '700__a'))
+
     def test_get_fieldvalues_repetitive(self):
         """websearch - get_fieldvalues() for repetitive values"""
         self.assertEqual(get_fieldvalues([17, 18], '909C1u'),
@@ -2805,6 +2825,29 @@ class WebSearchExactTitleIndexTest(unittest.TestCase):
             self.fail(merge_error_messages(error_messages))
 
 
+class WebSearchResultsCacheTest(unittest.TestCase):
+    """Check the search results cache."""
+
+    def test_invalidation(self):
+        """websearch - search results cache invalidation starts a new generation"""
+        from invenio.websearch_cache import get_search_results_cache_generation, \
+             invalidate_search_results_cache
+        first = invalidate_search_results_cache()
+        self.assertEqual(first, get_search_results_cache_generation())
+        second = invalidate_search_results_cache()
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, get_search_results_cache_generation())
+
+    def test_collection_variant(self):
+        """websearch - search results of a collection reused only for its subsets"""
+        from invenio.search_engine import search_results_collection_variant_p
+        self.failUnless(search_results_collection_variant_p('Articles & Preprints',
+                                                            ['Articles', 'Preprints']))
+        self.failIf(search_results_collection_variant_p('Articles',
+                                                        ['Articles', 'Books']))
+        self.failIf(search_results_collection_variant_p('', ['Articles']))
+
+
 TEST_SUITE = make_test_suite(WebSearchWebPagesAvailabilityTest,
                              WebSearchTestSearch,
                              WebSearchTestBrowse,
@@ -2848,7 +2891,8 @@ TEST_SUITE = make_test_suite(WebSearchWebPagesAvailabilityTest,
                              WebSearchAuthorCountQueryTest,
                              WebSearchPerformRequestSearchRefactoringTest,
                              WebSearchGetRecordTests,
-                             WebSearchExactTitleIndexTest)
+                             WebSearchExactTitleIndexTest,
+                             WebSearchResultsCacheTest)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE, warn_user=True)
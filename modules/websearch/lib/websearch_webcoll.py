@@ -42,13 +42,19 @@ from invenio.config import \
      CFG_WEBSEARCH_DEFAULT_SEARCH_INTERFACE, \
      CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS
 from invenio.messages import gettext_set_language, language_list_long
-from invenio.search_engine import search_pattern_parenthesised, get_creation_date, get_field_i18nname, collection_restricted_p, sort_records, EM_REPOSITORY
+from invenio.search_engine import search_pattern_parenthesised, get_creation_date, get_field_i18nname, collection_restricted_p, sort_records, EM_REPOSITORY, \
+     get_field_tags
 from invenio.dbquery import run_sql, Error, get_table_update_time
 from invenio.bibrank_record_sorter import get_bibrank_methods
 from invenio.dateutils import convert_datestruct_to_dategui, strftime
 from invenio.bibformat import format_record
 from invenio.shellutils import mymkdir
 from invenio.intbitset import intbitset
+from invenio.websearch_reclist_snapshot import load_reclist_snapshot, \
+     write_reclist_snapshot
+from invenio.websearch_cache import invalidate_search_results_cache
+from invenio.websearch_facet_index import CFG_NUMPY_IMPORTABLE, \
+     get_facet_values_index_fields, update_facet_values_index
 from invenio.websearch_external_collections import \
      external_collection_load_states, \
      dico_collection_external_searches, \
@@ -67,6 +73,9 @@ from invenio.signalutils import webcoll_after_webpage_cache_update
 
 ## global vars
 COLLECTION_HOUSE = {} # will hold collections we treat in this run of the program; a dict of {collname2, collobject1}, ...
+RECLIST_SNAPSHOT = None # reclist snapshot published by the previous run, if any
+MODIFIED_RECIDS = None # records modified since RECLIST_SNAPSHOT was computed; None means unknown
+EXCLUDED_RECIDS = None # deleted (and dummy) records, that do not belong to any collection
 
 # CFG_CACHE_LAST_UPDATED_TIMESTAMP_TOLERANCE -- cache timestamp
 # tolerance (in seconds), to account for the fact that an admin might
@@ -142,6 +151,7 @@ class Collection:
             self.id = 1
             self.dbquery = None
             self.nbrecs = None
+            self.old_nbrecs = None
             self.reclist = intbitset()
             self.old_reclist = intbitset()
             self.reclist_updated_since_start = 1
@@ -155,6 +165,7 @@ class Collection:
                     self.name = res[0][1]
                     self.dbquery = res[0][2]
                     self.nbrecs = res[0][3]
+                    self.old_nbrecs = self.nbrecs
                     try:
                         self.reclist = intbitset(res[0][4])
                     except:
@@ -164,6 +175,7 @@ class Collection:
                     self.id = None
                     self.dbquery = None
                     self.nbrecs = None
+                    self.old_nbrecs = None
                     self.reclist = intbitset()
                     self.reclist_updated_since_start = 1
                 self.old_reclist = intbitset(self.reclist)
@@ -748,14 +760,18 @@ class Collection:
                     # add this reclist ``for real'' only if it is public
                     reclist.union_update(coll_reclist)
                 reclist_with_nonpublic_subcolls.union_update(coll_reclist_with_nonpublic_subcolls)
+        elif self.can_reuse_snapshot_reclist():
+            # B - collection does have dbquery, that did not change since
+            #     the previous run, and no record was modified since, so
+            #     the reclist of the previous run is still valid
+            write_message("... reusing reclist of %s from the previous run" % self.name, verbose=6)
+            reclist = RECLIST_SNAPSHOT.get_reclist(self.name)
+            reclist_with_nonpublic_subcolls = copy.deepcopy(reclist)
         else:
-            # B - collection does have dbquery, so compute it:
+            # C - collection does have dbquery, so compute it:
             #     (note: explicitly remove DELETED records)
-            if CFG_CERN_SITE:
-                reclist = search_pattern_parenthesised(None, self.dbquery + \
-                                         ' -980__:"DELETED" -980__:"DUMMY"', ap=-9) #ap=-9 for allow queries containing hidden tags
-            else:
-                reclist = search_pattern_parenthesised(None, self.dbquery + ' -980__:"DELETED"', ap=-9) #ap=-9 allow queries containing hidden tags
+            reclist = search_pattern_parenthesised(None, self.dbquery, ap=-9) #ap=-9 allow queries containing hidden tags
+            reclist.difference_update(get_excluded_recids())
             reclist_with_nonpublic_subcolls = copy.deepcopy(reclist)
         # store the results:
         self.nbrecs = len(reclist_with_nonpublic_subcolls)
@@ -766,6 +782,19 @@ class Collection:
         # return the two sets:
         return (self.reclist, self.reclist_with_nonpublic_subcolls)
 
+    def can_reuse_snapshot_reclist(self):
+        """Return True if the reclist of this dbquery collection stored
+        in the snapshot of the previous run is still valid, i.e. if no
+        record was modified or reindexed since and the dbquery is the
+        same.  When any record was modified the dbquery is recomputed
+        on the whole database, since it may depend on other records
+        than the modified ones (e.g. refersto:, citedby:, collection:)."""
+        return RECLIST_SNAPSHOT is not None and \
+               MODIFIED_RECIDS is not None and \
+               not MODIFIED_RECIDS and \
+               RECLIST_SNAPSHOT.has_collection(self.name) and \
+               RECLIST_SNAPSHOT.get_dbquery(self.name) == self.dbquery
+
     def calculate_nbrecs_for_external_collection(self, timeout=CFG_EXTERNAL_COLLECTION_TIMEOUT):
         """Calculate the total number of records, aka nbrecs, for given external collection."""
         #if self.calculate_reclist_run_already:
@@ -817,10 +846,11 @@ class Collection:
         write_message("... updating reclist of %s (%s recs)" % (self.name, self.nbrecs), verbose=6)
         sys.stdout.flush()
         try:
-            ## In principle we could skip this update if old_reclist==reclist
-            ## however we just update it here in case of race-conditions.
-            run_sql("UPDATE collection SET nbrecs=%s, reclist=%s WHERE id=%s",
-                    (self.nbrecs, self.reclist.fastdump(), self.id))
+            ## Unchanged reclists are not written, so that the collection
+            ## table is not touched and web workers do not reload it.
+            if self.old_reclist != self.reclist or self.old_nbrecs != self.nbrecs:
+                run_sql("UPDATE collection SET nbrecs=%s, reclist=%s WHERE id=%s",
+                        (self.nbrecs, self.reclist.fastdump(), self.id))
             if self.old_reclist != self.reclist:
                 self.reclist_updated_since_start = 1
             else:
@@ -877,6 +907,101 @@ def perform_display_collection(colID, colname, aas, ln, em, show_help_boxes):
     return (c_body, data["navtrail_%s"%aas], data["lt_portalbox"], data["rt_portalbox"],
             data["tp_portalbox"], data["te_portalbox"], data["last_updated"])
 
+def get_excluded_recids():
+    """Return the records that are excluded from all the collections,
+    i.e. the DELETED ones (and the DUMMY ones at CERN).  They are
+    searched only once per run instead of once per collection."""
+    global EXCLUDED_RECIDS
+    if EXCLUDED_RECIDS is None:
+        if CFG_CERN_SITE:
+            EXCLUDED_RECIDS = search_pattern_parenthesised(None, '980__:"DELETED" or 980__:"DUMMY"', ap=-9)
+        else:
+            EXCLUDED_RECIDS = search_pattern_parenthesised(None, '980__:"DELETED"', ap=-9)
+    return EXCLUDED_RECIDS
+
+def get_reclists_modified_until():
+    """Return the time up to which record modifications are reflected
+    in the reclists computed now, i.e. the oldest last update time of
+    the indexes (record modifications are searchable only once they
+    are indexed)."""
+    now = get_current_time_timestamp()
+    res = run_sql("SELECT COUNT(*), MIN(last_updated) FROM idxINDEX")
+    if not res or not res[0][0]:
+        return now
+    if res[0][1] is None:
+        ## Some index is being fully reindexed
+        return "1970-01-01 00:00:00"
+    return min(str(res[0][1]), now)
+
+def get_indexes_last_updated_timestamp():
+    """Return the last time any index table was written."""
+    timestamps = []
+    for tablename in ('idxWORD%', 'idxPAIR%', 'idxPHRASE%'):
+        try:
+            timestamps.append(get_table_update_time(tablename))
+        except ValueError:
+            # There are no such index tables. That's OK.
+            pass
+    if timestamps:
+        return max(timestamps)
+    return "1970-01-01 00:00:00"
+
+def get_modified_recids(since):
+    """Return the records modified since the timestamp 'since'."""
+    return intbitset(run_sql("SELECT id FROM bibrec WHERE modification_date>=%s",
+                             (since, )))
+
+def load_previous_reclists():
+    """Load the reclist snapshot of the previous run and the records
+    modified since it was computed, in order to reuse the reclists of
+    the previous run when no record was modified since."""
+    global RECLIST_SNAPSHOT, MODIFIED_RECIDS
+    RECLIST_SNAPSHOT = load_reclist_snapshot()
+    MODIFIED_RECIDS = None
+    if RECLIST_SNAPSHOT is not None and not task_get_option("force"):
+        MODIFIED_RECIDS = get_modified_recids(RECLIST_SNAPSHOT.modified_until)
+        write_message("%d records modified since the previous reclist snapshot version %s" %
+                      (len(MODIFIED_RECIDS), RECLIST_SNAPSHOT.version), verbose=3)
+        if not MODIFIED_RECIDS and \
+               get_indexes_last_updated_timestamp() > RECLIST_SNAPSHOT.get_timestamp():
+            ## Indexes were rewritten without any record being
+            ## modified (e.g. reindexing), search results may differ.
+            MODIFIED_RECIDS = None
+
+def publish_reclists(colls, modified_until):
+    """Publish the new reclist snapshot with the reclists of colls,
+    keeping those of the other collections from the previous snapshot."""
+    collections = {}
+    version = 1
+    if RECLIST_SNAPSHOT is not None:
+        version = RECLIST_SNAPSHOT.version + 1
+        if task_has_option("collection"):
+            ## The other collections were computed earlier
+            modified_until = min(modified_until, RECLIST_SNAPSHOT.modified_until)
+            for row in run_sql("SELECT name FROM collection"):
+                reclist = RECLIST_SNAPSHOT.get_reclist(row[0])
+                if reclist is not None:
+                    collections[row[0]] = (reclist, RECLIST_SNAPSHOT.get_dbquery(row[0]))
+    for coll in colls:
+        if coll.id is not None:
+            collections[coll.name] = (coll.reclist, coll.dbquery)
+    write_reclist_snapshot(collections, modified_until, version)
+    write_message("Published reclist snapshot version %s" % version, verbose=3)
+    # cached search results restricted to collections may be outdated:
+    invalidate_search_results_cache()
+
+def update_facet_values_indexes():
+    """Update the facet values indexes of the fields used by the web
+    workers with the values of the records modified since the previous
+    run, so that the web workers never have to build them."""
+    if not CFG_NUMPY_IMPORTABLE:
+        return
+    for field in get_facet_values_index_fields():
+        nb_records = update_facet_values_index(field, get_field_tags(field),
+                                               force=task_get_option("force"))
+        write_message("... updated facet values index of %s for %s records" % (field, nb_records), verbose=6)
+        task_sleep_now_if_required(can_stop_too=True)
+
 def get_datetime(var, format_string="%Y-%m-%d %H:%M:%S"):
     """Returns a date string according to the format string.
        It can handle normal date strings and shifts with respect
@@ -1090,6 +1215,8 @@ def task_run_core():
                 colls.append(get_collection(row[0]))
         # secondly, update collection reclist cache:
         if task_get_option('part', 1) == 1:
+            reclists_modified_until = get_reclists_modified_until()
+            load_previous_reclists()
             i = 0
             for coll in colls:
                 i += 1
@@ -1101,6 +1228,8 @@ def task_run_core():
                 coll.update_reclist()
                 task_update_progress("Part 1/2: done %d/%d" % (i, len(colls)))
                 task_sleep_now_if_required(can_stop_too=True)
+            publish_reclists(colls, reclists_modified_until)
+            update_facet_values_indexes()
         # thirdly, update collection webpage cache:
         if task_get_option("part", 2) == 2:
             i = 0